@@ -0,0 +1,107 @@
+"""
+JSON parser backends, picked at import time and switchable with `use`.
+
+JSON Lines records are parsed one line at a time with `loads`, which is
+orjson when it is installed and the standard library otherwise. Streamed
+documents go through ijson, using its fastest installed backend (the
+yajl2_c C extension ships in the ijson wheels). Whatever is picked, results
+match the standard library: orjson turns integers beyond 64 bits into
+floats and rejects NaN / Infinity, so lines holding a run of 20 or more
+digits, and lines orjson rejects, are handed to json.loads, which also
+raises the error reported for a bad line.
+
+The JSON_LINES_BACKEND and JSON_STREAM_BACKEND environment variables
+override the automatic choice ('auto', or a name from LINE_BACKENDS /
+STREAM_BACKENDS). `active()` reports what is in use.
+"""
+
+import json
+import os
+try:
+    import orjson
+except Exception:
+    orjson = None
+try:
+    import ijson as _ijson
+except Exception:
+    _ijson = None
+
+LINE_BACKENDS = ('orjson', 'stdlib')
+STREAM_BACKENDS = ('yajl2_c', 'yajl2_cffi', 'yajl2', 'python')
+# Every digit maps to 0, so a run of 20 digits shows up as 20 zeros (a regex is
+# as slow as parsing the line with json)
+_DIGITS_TO_ZERO = bytes.maketrans(b'123456789', b'000000000')
+_BIG_NUMBER = b'0' * 20
+
+# The selected backends: `loads(bytes)` for JSON Lines records and the ijson
+# backend module (None without ijson) for streamed documents
+loads = json.loads
+ijson = None
+_names = {'lines': 'stdlib', 'stream': None}
+
+
+def _orjson_loads(data):
+    if _BIG_NUMBER not in data.translate(_DIGITS_TO_ZERO):
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(data)
+
+
+def _line_backend(name):
+    if name == 'orjson':
+        if orjson is None:
+            raise ValueError("JSON backend 'orjson' is not installed")
+        return _orjson_loads
+    if name == 'stdlib':
+        return json.loads
+    raise ValueError(f"Unknown JSON Lines backend '{name}', expected one of {', '.join(LINE_BACKENDS)}")
+
+
+def _stream_backend(name):
+    if name not in STREAM_BACKENDS:
+        raise ValueError(f"Unknown ijson backend '{name}', expected one of {', '.join(STREAM_BACKENDS)}")
+    if _ijson is None:
+        raise ValueError("ijson is not installed")
+    try:
+        return _ijson.get_backend(name)
+    except Exception as e:
+        raise ValueError(f"ijson backend '{name}' is not available: {e}") from e
+
+
+def available():
+    """Names of the installed backends: {'lines': [...], 'stream': [...]}"""
+    stream = []
+    for name in STREAM_BACKENDS if _ijson is not None else ():
+        try:
+            _stream_backend(name)
+        except ValueError:
+            continue
+        stream.append(name)
+    return {'lines': [name for name in LINE_BACKENDS if name != 'orjson' or orjson is not None],
+            'stream': stream}
+
+
+def use(lines=None, stream=None):
+    """Switch the JSON Lines and/or ijson backend; 'auto' picks the fastest
+    installed. Raises ValueError for an unknown or missing backend."""
+    global loads, ijson
+    if lines is not None:
+        if lines == 'auto':
+            lines = available()['lines'][0]
+        loads = _line_backend(lines)
+        _names['lines'] = lines
+    if stream is not None:
+        if stream == 'auto':
+            stream = next(iter(available()['stream']), None)
+        ijson = _stream_backend(stream) if stream is not None else None
+        _names['stream'] = stream
+
+
+def active():
+    """Names of the backends in use: {'lines': ..., 'stream': ...}"""
+    return dict(_names)
+
+
+use(lines=os.environ.get('JSON_LINES_BACKEND', 'auto'), stream=os.environ.get('JSON_STREAM_BACKEND', 'auto'))
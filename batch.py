@@ -0,0 +1,261 @@
+"""
+Batch conversion of many JSON files: zip / tar archives and multi-file uploads.
+
+Inputs are read one after another, straight from the upload or archive
+stream (nothing is extracted up front), and each is converted into its own
+artifact by a pool of worker processes, a few inputs per worker in flight
+at once. Small inputs travel to the workers in memory; an input over
+MEMORY_BYTES is first spooled to a temporary file so memory stays bounded.
+
+The results are either one table per input ('separate', kept as tables
+like the relational layout's, see main.iter_table_bundle) or their union
+('union'): every input's rows under the union of all their columns, with
+the input's name in SOURCE_COLUMN. Columns are typed over all inputs.
+"""
+
+import concurrent.futures
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import zipfile
+
+from columntypes import BOOLEAN, FLOAT, INTEGER, STRING, ColumnTypes
+from engine import CHUNK_SIZE, DEFAULT_FLATTENING, SCHEMA_MODES
+from parallel import IN_FLIGHT_PER_WORKER, ordered_results
+from readers import InvalidJSONError, LineErrors
+from relational import remove_tables
+from writers import (ARTIFACT_SUFFIXES, COLUMNAR_FORMATS, COMPRESSION_SUFFIXES, iter_artifact_rows, open_writer,
+                     row_index_path, write_rows)
+
+BATCH_MODES = ('union', 'separate')
+SOURCE_COLUMN = '_source'
+EXTRA_COLUMN = '_extra'
+ZIP_SUFFIXES = ('.zip',)
+TAR_SUFFIXES = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+MEMBER_SUFFIXES = ('.json', '.jsonl', '.ndjson')
+MEMORY_BYTES = 8 * 1024 * 1024  # Larger inputs reach the workers as a spooled file
+# Values kept typed when artifacts are merged; date-times stay text for the writer to parse
+_MERGED_TYPES = (BOOLEAN, INTEGER, FLOAT)
+
+
+def is_archive(filename):
+    """True if `filename` names a zip or (compressed) tar archive"""
+    name = (filename or '').lower()
+    return name.endswith(ZIP_SUFFIXES + TAR_SUFFIXES)
+
+
+def _is_member(name):
+    base = name.rsplit('/', 1)[-1]
+    return name.lower().endswith(MEMBER_SUFFIXES) and not base.startswith('.') and '__MACOSX/' not in name
+
+
+def iter_archive(stream, filename):
+    """Yield (name, binary stream) for the JSON / JSON Lines members of the
+    archive `filename` read from `stream`, in archive order; directories and
+    other files are skipped. A tar archive is read sequentially; a zip needs
+    a seekable `stream` for its central directory."""
+    try:
+        if filename.lower().endswith(ZIP_SUFFIXES):
+            with zipfile.ZipFile(stream) as archive:
+                for info in archive.infolist():
+                    if not info.is_dir() and _is_member(info.filename):
+                        with archive.open(info) as member:
+                            yield info.filename, member
+        else:
+            with tarfile.open(fileobj=stream, mode='r|*') as archive:
+                for info in archive:
+                    if info.isfile() and _is_member(info.name):
+                        yield info.name, archive.extractfile(info)
+    except (zipfile.BadZipFile, tarfile.TarError, EOFError) as e:
+        raise InvalidJSONError(f"Unreadable archive '{filename}': {e}") from None
+
+
+def _read_input(stream, directory=None):
+    """The contents of `stream` as bytes, or the path of a temporary copy
+    when it holds more than MEMORY_BYTES"""
+    data = stream.read(MEMORY_BYTES + 1)
+    if len(data) <= MEMORY_BYTES:
+        return data
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.json', dir=directory) as spool:
+        spool.write(data)
+        while True:
+            data = stream.read(MEMORY_BYTES)
+            if not data:
+                return spool.name
+            spool.write(data)
+
+
+class _BadLines(LineErrors):
+    """Bad lines of one input, kept for the parent process to report"""
+
+    def __init__(self, stop_on_error):
+        super().__init__('fail' if stop_on_error else 'skip')
+        self.lines = []
+
+    def handle(self, line_num, offset, raw, error):
+        super().handle(line_num, offset, raw, error)
+        self.lines.append((line_num, offset, raw, str(error)))
+
+
+def _new_artifact(artifact_format, compression, directory=None):
+    suffix = ARTIFACT_SUFFIXES[artifact_format] + COMPRESSION_SUFFIXES.get(compression, '')
+    fd, path = tempfile.mkstemp(suffix=suffix, dir=directory)
+    os.close(fd)
+    return path
+
+
+def convert_input(name, source, artifact_format, compression, schema_mode, flattening, record_path, window,
+                  max_preview, stop_on_error, directory=None):
+    """Worker task: convert one input (bytes, or the path of a spooled copy,
+    which is removed) into a new temporary artifact in `directory`.
+    Returns the table result (name, path, columns, types, rows,
+    preview_rows) plus its `bad_lines` as (line, offset, raw, message)."""
+    errors = _BadLines(stop_on_error)
+    path = _new_artifact(artifact_format, compression, directory)
+    try:
+        with (io.BytesIO(source) if isinstance(source, bytes) else open(source, 'rb')) as stream:
+            rows, header, preview_rows, types = SCHEMA_MODES[schema_mode](
+                stream, path, window=window, max_preview=max_preview, artifact_format=artifact_format,
+                compression=compression, flattening=flattening, record_path=record_path, errors=errors)
+    except BaseException as e:
+        remove_tables([{'path': path}])
+        if isinstance(e, ValueError):
+            # Say which input failed
+            raise (InvalidJSONError if isinstance(e, InvalidJSONError) else ValueError)(f"{name}: {e}") from None
+        raise
+    finally:
+        if not isinstance(source, bytes):
+            os.unlink(source)
+    return {'name': name, 'path': path, 'columns': header, 'types': types, 'rows': rows,
+            'preview_rows': preview_rows, 'bad_lines': errors.lines}
+
+
+def table_name(name):
+    """Name of the 'separate' table of input `name`: its path less the suffix"""
+    lowered = name.lower()
+    for suffix in MEMBER_SUFFIXES:
+        if lowered.endswith(suffix):
+            return name[:-len(suffix)] or name
+    return name
+
+
+def union_header(tables):
+    """SOURCE_COLUMN, the sorted union of the tables' columns and, when any
+    table has one, the EXTRA_COLUMN of sampled conversions last"""
+    columns = set()
+    for table in tables:
+        columns.update(table['columns'])
+    extra = [EXTRA_COLUMN] if EXTRA_COLUMN in columns else []
+    columns -= {SOURCE_COLUMN, EXTRA_COLUMN}
+    return [SOURCE_COLUMN] + sorted(columns) + extra
+
+
+def _union_rows(tables, header, types, window):
+    for table in tables:
+        positions = {name: i for i, name in enumerate(table['columns'])}
+        picks = [positions.get(name) for name in header[1:]]
+        merged = {name: types[name] for name in table['columns'] if types[name] in _MERGED_TYPES}
+        for rows in iter_artifact_rows(table['path'], 'csv', window, types=merged):
+            for row in rows:
+                yield (table['name'],) + tuple([None if i is None else row[i] for i in picks])
+
+
+def batch_convert(inputs, mode='union', artifact_format='csv', compression=None, schema_mode='sample',
+                  flattening=DEFAULT_FLATTENING, record_path=None, window=CHUNK_SIZE, max_preview=20,
+                  workers=1, errors=None, target=None, progress=None):
+    """Convert every (name, binary stream) of `inputs` (see iter_archive)
+    with `workers` processes, flattening as set by `flattening` and fixing
+    each input's columns as `schema_mode` says. Inputs are read in turn and
+    converted concurrently; results keep the input order.
+
+    'separate' returns the table results, one per input named after it,
+    stored as `artifact_format` with `compression`. 'union' writes all rows
+    into `target` (a path or writable binary file; a new temporary artifact
+    if None) and returns one table result for it, named 'union'. Bad JSON
+    Lines records go to `errors` (a LineErrors) with the input named in
+    their message; `progress` (a jobs.Progress) gets the rows written.
+    Raises InvalidJSONError if no input is found.
+    """
+    if mode not in BATCH_MODES:
+        raise ValueError(f"Unknown batch mode '{mode}'")
+    if errors is None:
+        errors = LineErrors()
+    union = mode == 'union'
+    # Union inputs go through plain CSV, which keeps every value's text for the merge
+    input_format, input_compression = ('csv', None) if union else (artifact_format, compression)
+    # Spooled inputs and unfinished artifacts live here, so a failure leaves nothing behind
+    directory = tempfile.mkdtemp(prefix='json2tabular_batch_')
+    try:
+        tasks = ((name, _read_input(stream, directory), input_format, input_compression, schema_mode, flattening,
+                  record_path, window, max_preview, errors.mode == 'fail', directory)
+                 for name, stream in inputs)
+        tables = []
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers) if workers > 1 else _InProcess()
+        with executor:
+            for table in ordered_results(executor, convert_input, tasks, workers * IN_FLIGHT_PER_WORKER):
+                tables.append(table)
+                for line_num, offset, raw, message in table.pop('bad_lines'):
+                    errors.handle(line_num, offset, raw, f"{message} (in {table['name']})")
+                if progress is not None and not union:
+                    progress.add_rows(table['rows'])
+        if not tables:
+            raise InvalidJSONError("No JSON or JSON Lines files found")
+        if not union:
+            for table in tables:
+                table['path'] = _keep(table['path'], input_format, input_compression)
+                table['name'] = table_name(table['name'])
+            return tables
+        return _write_union(tables, target, artifact_format, compression, window, max_preview, progress)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def _keep(path, artifact_format, compression):
+    """Move an artifact (and its row index) out of the work directory"""
+    kept = _new_artifact(artifact_format, compression)
+    os.replace(path, kept)
+    if os.path.exists(row_index_path(path)):
+        os.replace(row_index_path(path), row_index_path(kept))
+    return kept
+
+
+def _write_union(tables, target, artifact_format, compression, window, max_preview, progress):
+    header = union_header(tables)
+    types = ColumnTypes({SOURCE_COLUMN: STRING})
+    for table in tables:
+        types.update(table['types'])
+    created = target is None
+    if created:
+        target = _new_artifact(artifact_format, compression)
+    try:
+        columnar = artifact_format in COLUMNAR_FORMATS
+        writer = open_writer(target, header, artifact_format, compression, types.as_dict() if columnar else None)
+        total_rows, preview_rows = write_rows(writer, _union_rows(tables, header, types, window), window,
+                                              max_preview, progress)
+    except BaseException:
+        if created:
+            remove_tables([{'path': target}])
+        raise
+    return {'name': 'union', 'path': target, 'columns': header, 'types': writer.types.as_dict(),
+            'rows': total_rows, 'preview_rows': preview_rows, 'sources': len(tables)}
+
+
+class _InProcess:
+    """Executor running tasks in the calling process as they are submitted"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def submit(self, task, *args):
+        future = concurrent.futures.Future()
+        try:
+            future.set_result(task(*args))
+        except BaseException as e:
+            future.set_exception(e)
+        return future
+
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Parser benchmark: records/sec and MB/s of every installed JSON backend.
+
+Writes synthetic flat, nested and wide documents both as JSON Lines and as
+one JSON array, then parses each file through readers.iter_records with
+every JSON Lines backend (on the .jsonl files) and every ijson backend (on
+the .json files). "stdlib json.load" parses the whole array in memory, for
+reference. ijson's pure Python backend is some 20x slower than the others
+and only runs with --pure-python.
+
+    python benchmarks/bench_backends.py --records 100000
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import backends  # noqa: E402
+from readers import iter_records  # noqa: E402
+
+
+def flat_record(i):
+    record = {f"field_{k}": i * k for k in range(20)}
+    record.update({f"label_{k}": f"value {i} {k}" for k in range(10)})
+    return record
+
+
+def nested_record(i):
+    return {
+        'id': i,
+        'user': {'name': f"user {i}", 'email': f"u{i}@example.com", 'age': i % 90},
+        'order': {'total': i * 1.25, 'items': [{'sku': f"s{i}{j}", 'qty': j} for j in range(3)]},
+        'tags': ['a', 'b'] if i % 3 else ['c'],
+        'active': i % 2 == 0,
+    }
+
+
+def wide_record(i):
+    return {f"group_{g}": {f"attr_{a}": i + a for a in range(40)} for g in range(25)}
+
+
+DOCUMENTS = {
+    'flat': flat_record,
+    'nested': nested_record,
+    'wide': wide_record,
+}
+
+
+def write_documents(directory, name, make, count):
+    """Write `count` records as name.jsonl and name.json; returns both paths"""
+    lines_path = os.path.join(directory, f"{name}.jsonl")
+    array_path = os.path.join(directory, f"{name}.json")
+    with open(lines_path, 'w', encoding='utf-8') as lines, open(array_path, 'w', encoding='utf-8') as array:
+        array.write('[')
+        for i in range(count):
+            text = json.dumps(make(i))
+            lines.write(text + '\n')
+            array.write((',\n' if i else '\n') + text)
+        array.write('\n]\n')
+    return lines_path, array_path
+
+
+def measure(parse, path, repeat):
+    """Best (records, seconds) of `repeat` runs of parse(binary file)"""
+    best = None
+    for _ in range(repeat):
+        with open(path, 'rb') as stream:
+            start = time.perf_counter()
+            count = sum(1 for _ in parse(stream))
+            elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return count, best
+
+
+def report(document, parser, path, count, seconds):
+    megabytes = os.path.getsize(path) / 1e6
+    print(f"{document:<10}{parser:<26}{count / seconds:>14,.0f}/s{megabytes / seconds:>11.1f} MB/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--records', type=int, default=50000, help='records per document type')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per measurement (best is kept)')
+    parser.add_argument('--pure-python', action='store_true', help="include ijson's pure Python backend")
+    args = parser.parse_args()
+
+    installed = backends.available()
+    if not args.pure_python:
+        installed['stream'] = [name for name in installed['stream'] if name != 'python']
+    selected = backends.active()
+    print(f"installed: JSON Lines {', '.join(installed['lines'])}; ijson {', '.join(installed['stream']) or '-'}")
+    print(f"{'document':<10}{'parser':<26}{'records':>16}{'throughput':>16}")
+    with tempfile.TemporaryDirectory() as directory:
+        try:
+            for document, make in DOCUMENTS.items():
+                lines_path, array_path = write_documents(directory, document, make, args.records)
+                for name in installed['lines']:
+                    backends.use(lines=name)
+                    count, seconds = measure(iter_records, lines_path, args.repeat)
+                    report(document, f"lines: {name}", lines_path, count, seconds)
+                for name in installed['stream']:
+                    backends.use(stream=name)
+                    count, seconds = measure(iter_records, array_path, args.repeat)
+                    report(document, f"array: ijson {name}", array_path, count, seconds)
+                count, seconds = measure(json.load, array_path, args.repeat)
+                report(document, "array: stdlib json.load", array_path, count, seconds)
+        finally:
+            backends.use(lines=selected['lines'], stream=selected['stream'] or 'auto')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Scaling benchmark: JSON Lines to CSV with 1..N worker processes.
+
+Writes a synthetic JSONL file, converts it once with the sequential
+spooled conversion and then with parallel_convert at each worker count,
+and reports records/sec and speedup over the sequential run.
+
+    python benchmarks/bench_parallel.py --records 500000 --workers 1 2 4 8
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flattener import Flattening  # noqa: E402
+from engine import spooled_convert_file  # noqa: E402
+from parallel import RANGE_BYTES, parallel_convert  # noqa: E402
+
+
+def record(i):
+    return {
+        'id': i,
+        'user': {'name': f"user {i}", 'email': f"u{i}@example.com", 'age': i % 90},
+        'order': {'total': i * 1.25, 'items': [{'sku': f"s{i}{j}", 'qty': j} for j in range(3)]},
+        'tags': ['a', 'b'] if i % 3 else ['c'],
+        'active': i % 2 == 0,
+    }
+
+
+def default_workers():
+    counts = [1]
+    while counts[-1] * 2 <= (os.cpu_count() or 1):
+        counts.append(counts[-1] * 2)
+    return counts
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--records', type=int, default=200000, help='records in the input file')
+    parser.add_argument('--workers', type=int, nargs='+', default=default_workers(),
+                        help='worker counts to measure (default: powers of two up to the CPU count)')
+    parser.add_argument('--range-bytes', type=int, default=RANGE_BYTES, help='bytes per worker task')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        source = os.path.join(workdir, 'input.jsonl')
+        with open(source, 'w', encoding='utf-8') as f:
+            for i in range(args.records):
+                f.write(json.dumps(record(i)) + '\n')
+        size_mb = os.path.getsize(source) / 1e6
+        output = os.path.join(workdir, 'output.csv')
+
+        print(f"{args.records:,} records, {size_mb:.1f} MB, {os.cpu_count()} CPUs")
+        print(f"{'workers':<12}{'seconds':>10}{'records/s':>14}{'speedup':>10}")
+
+        with open(source, 'rb') as stream:
+            (rows, *_), baseline = timed(lambda: spooled_convert_file(stream, output))
+        print(f"{'sequential':<12}{baseline:>10.2f}{rows / baseline:>12,.0f}/s{1:>9.1f}x")
+
+        for workers in args.workers:
+            (rows, *_), elapsed = timed(lambda: parallel_convert(
+                source, output, Flattening(), workers=workers, range_bytes=args.range_bytes))
+            print(f"{workers:<12}{elapsed:>10.2f}{rows / elapsed:>12,.0f}/s{baseline / elapsed:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+"""
+Pipeline benchmark: throughput, peak memory and temp disk of every stage.
+
+Generates synthetic JSON Lines and JSON array inputs of a chosen size,
+nesting depth, width, array length and key heterogeneity, then runs each
+stage on them in a fresh process:
+
+    parse     readers.iter_records
+    flatten   parse + flattening to rows (engine.sampled_rows)
+    csv       parse + flatten + the CSV writer (engine.convert)
+    excel     parse + flatten + the xlsx writer (engine.convert)
+    convert   POST /api/convert through Flask's test client, upload included
+
+Stages stream, so each includes the ones above it. Every run reports
+records/s and MB/s of input, the peak RSS of its process and the peak size
+of its temporary directory (sampled every few milliseconds). A stage that
+fails is recorded with its error and the others still run. Results are
+saved as JSON; --compare reads an earlier results file, prints the change
+of every stage and exits with status 1 if one got slower by more than
+--threshold percent.
+
+    python benchmarks/bench_suite.py --records 50000 --output before.json
+    python benchmarks/bench_suite.py --records 50000 --output after.json --compare before.json
+    python benchmarks/bench_suite.py --size-mb 200 --depth 4 --heterogeneity 0.3 --stages flatten csv
+"""
+
+import argparse
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import backends  # noqa: E402
+import engine  # noqa: E402
+from flattener import ARRAY_MODES  # noqa: E402
+from readers import iter_records  # noqa: E402
+
+RESULTS_VERSION = 1
+FORMATS = ('jsonl', 'json')
+DISK_POLL_SECONDS = 0.005
+_EPOCH = datetime(2024, 1, 1)
+
+
+def _value(i, k, rng):
+    kind = k % 5
+    if kind == 0:
+        return i * (k + 1)
+    if kind == 1:
+        return round(rng.random() * 1000, 3)
+    if kind == 2:
+        return f"value {i} {k}"
+    if kind == 3:
+        return rng.random() < 0.5
+    return (_EPOCH + timedelta(seconds=rng.randrange(10 ** 8))).isoformat()
+
+
+def _node(i, rng, depth, width, array_length, heterogeneity, key_pool):
+    node = {'id': i}
+    for k in range(width):
+        # A heterogeneous field takes a key from the pool, so columns differ between records
+        name = f"k{rng.randrange(key_pool)}" if rng.random() < heterogeneity else f"f{k}"
+        node[name] = _value(i, k, rng)
+    if array_length:
+        node['items'] = [{'sku': f"s{i}-{j}", 'qty': j, 'price': round(rng.random() * 100, 2)}
+                         for j in range(array_length)]
+    if depth > 1:
+        node['child'] = _node(i, rng, depth - 1, width, array_length, heterogeneity, key_pool)
+    return node
+
+
+def make_record(i, rng, depth=2, width=10, array_length=3, heterogeneity=0.0, key_pool=1000):
+    """Synthetic record `i`: `width` scalar fields (integers, floats, text,
+    booleans and date-times) on each of `depth` nested objects, each of
+    which also holds an `items` array of `array_length` small objects. A
+    share `heterogeneity` of the fields is named from a pool of `key_pool`
+    keys instead of by position."""
+    return _node(i, rng, depth, width, array_length, heterogeneity, key_pool)
+
+
+def write_inputs(directory, dataset):
+    """Write the records of `dataset` as input.jsonl and input.json: its
+    `records`, or as many as make the JSON Lines file `size_mb` large.
+    Returns ({format: path}, records)"""
+    rng = random.Random(dataset['seed'])
+    shape = {key: dataset[key] for key in ('depth', 'width', 'array_length', 'heterogeneity', 'key_pool')}
+    limit = dataset['size_mb'] * 1e6 if dataset['size_mb'] else None
+    paths = {fmt: os.path.join(directory, f"input.{fmt}") for fmt in FORMATS}
+    written = count = 0
+    with open(paths['jsonl'], 'w', encoding='utf-8') as lines, open(paths['json'], 'w', encoding='utf-8') as array:
+        array.write('[')
+        while (written < limit) if limit else (count < dataset['records']):
+            text = json.dumps(make_record(count, rng, **shape))
+            lines.write(text + '\n')
+            array.write((',\n' if count else '\n') + text)
+            written += len(text) + 1
+            count += 1
+        array.write('\n]\n')
+    return paths, count
+
+
+def _flattening(settings):
+    return engine.make_flattening(settings['arrays'], settings['array_limit'])
+
+
+def parse_stage(path, settings, workdir):
+    def run():
+        with open(path, 'rb') as stream:
+            return {'rows': sum(1 for _ in iter_records(stream))}
+    return run
+
+
+def flatten_stage(path, settings, workdir):
+    flattening = _flattening(settings)
+
+    def run():
+        with open(path, 'rb') as stream:
+            header, rows = engine.sampled_rows(stream, settings['window'], flattening)
+            return {'rows': sum(1 for _ in rows), 'columns': len(header)}
+    return run
+
+
+def _write_stage(output_format):
+    def stage(path, settings, workdir):
+        flattening = _flattening(settings)
+        target = os.path.join(workdir, f"output{engine.OUTPUT_EXTENSIONS[output_format]}")
+
+        def run():
+            with open(path, 'rb') as stream:
+                summary = engine.convert(stream, target, output_format, settings['schema_mode'],
+                                         flattening=flattening, window=settings['window'])
+            return {'rows': summary['rows'], 'columns': len(summary['columns']),
+                    'output_bytes': os.path.getsize(target)}
+        return run
+    return stage
+
+
+def convert_stage(path, settings, workdir):
+    import main  # Imported here, once the temporary directory is set, as it places its stores there
+
+    main.app.config.update(RESULT_CACHE_BYTES=0, STREAM_WINDOW=settings['window'])
+    client = main.app.test_client()
+    form = {'output_format': 'csv', 'schema_mode': settings['schema_mode'], 'arrays': settings['arrays'],
+            'array_limit': str(settings['array_limit'])}
+
+    def run():
+        with open(path, 'rb') as stream:
+            response = client.post('/api/convert', data=dict(form, file=(stream, os.path.basename(path))),
+                                   content_type='multipart/form-data')
+        body = response.get_json(silent=True) or {}
+        if response.status_code != 200:
+            raise RuntimeError(f"/api/convert answered {response.status_code}: {body.get('error', '')}")
+        return {'rows': body['rows'], 'columns': body['columns']}
+    return run
+
+
+STAGES = {
+    'parse': parse_stage,
+    'flatten': flatten_stage,
+    'csv': _write_stage('csv'),
+    'excel': _write_stage('excel'),
+    'convert': convert_stage,
+}
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, in MB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1e6 if sys.platform == 'darwin' else peak / 1e3  # Bytes on macOS, KB elsewhere
+
+
+def directory_bytes(directory):
+    total = 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:  # Removed while walking
+                pass
+    return total
+
+
+class DiskWatcher(threading.Thread):
+    """Tracks the largest size `directory` reaches while running"""
+
+    def __init__(self, directory):
+        super().__init__(daemon=True)
+        self.directory = directory
+        self.peak = 0
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(DISK_POLL_SECONDS):
+            self.peak = max(self.peak, directory_bytes(self.directory))
+
+    def stop(self):
+        self._done.set()
+        self.join()
+        self.peak = max(self.peak, directory_bytes(self.directory))
+        return self.peak
+
+
+def run_stage(stage, path, settings, workdir):
+    """Worker task: time one run of `stage` on `path`, with this process's
+    temporary files kept in workdir/tmp. Returns the stage result plus
+    seconds, base_rss_mb (after setup), peak_rss_mb, peak_temp_mb and
+    temp_left_mb (temporary files still there at the end)."""
+    tempfile.tempdir = os.path.join(workdir, 'tmp')
+    os.makedirs(tempfile.tempdir)
+    backends.use(lines=settings['backends']['lines'], stream=settings['backends']['stream'] or 'auto')
+    run = STAGES[stage](path, settings, workdir)
+    base_rss = peak_rss_mb()
+    watcher = DiskWatcher(tempfile.tempdir)
+    watcher.start()
+    start = time.perf_counter()
+    try:
+        result = run()
+    finally:
+        seconds = time.perf_counter() - start
+        peak_temp = watcher.stop()
+    result.update(seconds=seconds, base_rss_mb=base_rss, peak_rss_mb=peak_rss_mb(), peak_temp_mb=peak_temp / 1e6,
+                  temp_left_mb=directory_bytes(tempfile.tempdir) / 1e6)
+    return result
+
+
+def measure(stage, path, settings, directory, repeat):
+    """Best of `repeat` runs, each in a new process: the fastest run's
+    result, with the largest peak RSS and temp disk of all runs"""
+    best = None
+    context = multiprocessing.get_context('spawn')
+    for attempt in range(repeat):
+        workdir = os.path.join(directory, f"{stage}-{attempt}")
+        os.makedirs(workdir)
+        try:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                result = executor.submit(run_stage, stage, path, settings, workdir).result()
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        if best is None:
+            best = result
+            continue
+        peaks = {key: max(best[key], result[key]) for key in ('peak_rss_mb', 'peak_temp_mb')}
+        if result['seconds'] < best['seconds']:
+            best = result
+        best.update(peaks)
+    return best
+
+
+def report(entry):
+    if 'error' in entry:
+        print(f"{entry['input']:<7}{entry['stage']:<9}  failed: {entry['error']}")
+        return
+    print(f"{entry['input']:<7}{entry['stage']:<9}{entry['seconds']:>9.2f}{entry['records_per_s']:>12,.0f}/s"
+          f"{entry['mb_per_s']:>9.1f}{entry['peak_rss_mb']:>10.0f}{entry['peak_temp_mb']:>11.1f}")
+
+
+def compare(results, previous, threshold):
+    """Print the change of every stage also found in `previous`; returns
+    the number of stages that now fail or got slower by more than
+    `threshold` percent (0 for slower ones when `previous` ran on other
+    data or settings)"""
+    before = {(entry['input'], entry['stage']): entry for entry in previous['results']}
+    comparable = previous.get('dataset') == results['dataset'] and previous.get('settings') == results['settings']
+    if not comparable:
+        print("note: the previous run used other data or settings (see its 'dataset' and 'settings'), "
+              "so no stage counts as slower")
+    print(f"\ncompared with {previous.get('created', 'the previous run')}")
+    print(f"{'input':<7}{'stage':<9}{'records/s':>12}{'peak RSS':>11}{'temp':>11}")
+    regressions = 0
+    for entry in results['results']:
+        old = before.get((entry['input'], entry['stage']))
+        if old is None:
+            continue
+        if 'error' in entry or 'error' in old:
+            # A stage that used to run and now fails counts as slower
+            broke = 'error' not in old
+            regressions += broke
+            print(f"{entry['input']:<7}{entry['stage']:<9}{'failed' if 'error' in entry else 'failed before':>12}"
+                  f"{'  broke' if broke else ''}")
+            continue
+        speed = (entry['records_per_s'] / old['records_per_s'] - 1) * 100
+        memory = entry['peak_rss_mb'] - old['peak_rss_mb']
+        disk = entry['peak_temp_mb'] - old['peak_temp_mb']
+        slower = comparable and speed < -threshold
+        regressions += slower
+        print(f"{entry['input']:<7}{entry['stage']:<9}{speed:>+11.1f}%{memory:>+8.0f} MB{disk:>+8.1f} MB"
+              f"{'  slower' if slower else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    data = parser.add_argument_group('synthetic input')
+    data.add_argument('--records', type=int, default=20000, help='records per input (default: %(default)s)')
+    data.add_argument('--size-mb', type=float, help='write records until the JSON Lines input is this large instead')
+    data.add_argument('--depth', type=int, default=2, help='levels of nested objects per record')
+    data.add_argument('--width', type=int, default=10, help='scalar fields per object')
+    data.add_argument('--array-length', type=int, default=3, help='items in the array of each object')
+    data.add_argument('--heterogeneity', type=float, default=0.0,
+                      help='share of fields (0-1) named from a key pool, so records differ in columns')
+    data.add_argument('--key-pool', type=int, default=1000, help='keys heterogeneous fields are named from')
+    data.add_argument('--seed', type=int, default=1)
+    data.add_argument('--formats', nargs='+', choices=FORMATS, default=list(FORMATS), help='inputs to run')
+    conversion = parser.add_argument_group('conversion settings')
+    conversion.add_argument('--window', type=int, default=engine.CHUNK_SIZE,
+                            help='records sampled for the header and written per batch (default: %(default)s)')
+    conversion.add_argument('--arrays', choices=ARRAY_MODES, default='truncate', help='how arrays become columns')
+    conversion.add_argument('--array-limit', type=int, default=10, help="items kept by --arrays truncate")
+    conversion.add_argument('--schema-mode', choices=list(engine.SCHEMA_MODES), default='sample',
+                            help='schema mode of the csv, excel and convert stages')
+    parser.add_argument('--stages', nargs='+', choices=list(STAGES), default=list(STAGES), help='stages to run')
+    parser.add_argument('--repeat', type=int, default=1, help='runs per measurement (best is kept)')
+    parser.add_argument('--output', default='bench_results.json', help='results file (default: %(default)s)')
+    parser.add_argument('--compare', help='earlier results file to compare with')
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help='percent drop in records/s counted as a regression (default: %(default)s)')
+    args = parser.parse_args()
+
+    dataset = {key: getattr(args, key) for key in ('records', 'size_mb', 'depth', 'width', 'array_length',
+                                                   'heterogeneity', 'key_pool', 'seed')}
+    settings = {'window': args.window, 'arrays': args.arrays, 'array_limit': args.array_limit,
+                'schema_mode': args.schema_mode, 'backends': backends.active()}
+    try:
+        _flattening(settings)
+    except ValueError as e:
+        parser.error(str(e))
+    previous = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            previous = json.load(f)
+
+    results = {'version': RESULTS_VERSION, 'created': datetime.now().isoformat(timespec='seconds'),
+               'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count(),
+               'dataset': dataset, 'settings': settings, 'results': []}
+    with tempfile.TemporaryDirectory(prefix='json2tabular_bench_') as directory:
+        paths, records = write_inputs(directory, dataset)
+        sizes = {fmt: os.path.getsize(paths[fmt]) for fmt in args.formats}
+        print(f"{records:,} records; " + ', '.join(f"{fmt} {size / 1e6:.1f} MB" for fmt, size in sizes.items())
+              + f"; {os.cpu_count()} CPUs; backends {settings['backends']['lines']} / {settings['backends']['stream']}")
+        print(f"{'input':<7}{'stage':<9}{'seconds':>9}{'records/s':>14}{'MB/s':>9}{'peak RSS':>10}{'temp MB':>11}")
+        for fmt in args.formats:
+            for stage in args.stages:
+                entry = {'input': fmt, 'stage': stage, 'input_bytes': sizes[fmt], 'records': records}
+                try:
+                    entry.update(measure(stage, paths[fmt], settings, directory, args.repeat))
+                except Exception as e:  # Recorded, so the other stages still run and can be compared
+                    entry['error'] = f"{type(e).__name__}: {e}"
+                else:
+                    entry['records_per_s'] = records / entry['seconds']
+                    entry['mb_per_s'] = sizes[fmt] / 1e6 / entry['seconds']
+                results['results'].append(entry)
+                report(entry)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"results written to {args.output}")
+    if previous is not None and compare(results, previous, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
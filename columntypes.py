@@ -0,0 +1,152 @@
+"""
+Column types inferred while rows stream past.
+
+Each column holds a point on a small type lattice and only ever moves up
+it, so one pass over the whole input types every column in constant memory
+per column:
+
+                         string
+        /        /          \            \
+    boolean    float      datetime    datetime_tz
+                 |
+              integer
+        (and every type above null)
+
+A column is `boolean`, `integer` (64-bit) or `float` when all its values
+are JSON booleans, integers or numbers; `datetime` when all are ISO 8601
+date-times without a UTC offset (`2024-05-01T12:30:00`, a space may stand
+in for the T) and `datetime_tz` when all have one (`...Z`, `...+02:00`,
+stored as UTC). Anything else, including a mix of the above, is `string`,
+and a column that only ever holds nulls stays `null`. Plain dates are
+strings. The writers turn these into Parquet / Arrow schemas and Excel
+cell types (see writers.py).
+"""
+
+import re
+from datetime import datetime, timezone
+
+NULL = 'null'
+BOOLEAN = 'boolean'
+INTEGER = 'integer'
+FLOAT = 'float'
+DATETIME = 'datetime'
+DATETIME_TZ = 'datetime_tz'
+STRING = 'string'
+TYPES = (NULL, BOOLEAN, INTEGER, FLOAT, DATETIME, DATETIME_TZ, STRING)
+
+_INT64_MIN = -2 ** 63
+_INT64_MAX = 2 ** 63 - 1
+# Seconds are optional and fractions stop at microseconds, as Arrow parses them
+_DATETIME = re.compile(r'\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}(?::\d{2}(?:\.\d{1,6})?)?(Z|[+-]\d{2}(?::?\d{2})?)?')
+_NUMBER_TYPES = {int, float}
+_NONE = type(None)
+_VALUE_TYPES = {_NONE: NULL, bool: BOOLEAN, int: INTEGER, float: FLOAT}
+
+
+def join(a, b):
+    """Least type on the lattice that holds both `a` and `b`"""
+    if a == b or b == NULL:
+        return a
+    if a == NULL:
+        return b
+    if {a, b} == {INTEGER, FLOAT}:
+        return FLOAT
+    return STRING
+
+
+def text_type(text):
+    """DATETIME or DATETIME_TZ if `text` is an ISO 8601 date-time, else STRING"""
+    match = _DATETIME.fullmatch(text)
+    if match is None:
+        return STRING
+    try:
+        datetime.fromisoformat(text)
+    except ValueError:  # e.g. month 13
+        return STRING
+    return DATETIME_TZ if match.group(1) else DATETIME
+
+
+def parse_datetime(text):
+    """The datetime of a `datetime` / `datetime_tz` value, naive and in UTC
+    for the latter"""
+    value = datetime.fromisoformat(text)
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def value_type(value):
+    """Lattice type of a single value"""
+    kind = type(value)
+    if kind is str:
+        return text_type(value)
+    if kind is int and not _INT64_MIN <= value <= _INT64_MAX:
+        return STRING
+    return _VALUE_TYPES.get(kind, STRING)
+
+
+def values_type(values):
+    """Lattice type of a sequence of values"""
+    kinds = set(map(type, values))
+    kinds.discard(_NONE)
+    if not kinds:
+        return NULL
+    if kinds == {bool}:
+        return BOOLEAN
+    if kinds <= _NUMBER_TYPES:
+        if int in kinds:
+            numbers = [*filter(None, values)]  # Drops nulls (and zeros, which fit anyway)
+            if numbers and (min(numbers) < _INT64_MIN or max(numbers) > _INT64_MAX):
+                return STRING
+        return INTEGER if kinds == {int} else FLOAT
+    if kinds == {str}:
+        found = NULL
+        for value in set(values):
+            if value is not None:
+                found = join(found, text_type(value))
+                if found == STRING:
+                    break
+        return found
+    return STRING
+
+
+class ColumnTypes:
+    """Lattice type of every column seen so far, by column name"""
+
+    def __init__(self, types=None):
+        self._types = dict(types or {})
+
+    def __getitem__(self, name):
+        return self._types.get(name, NULL)
+
+    def __iter__(self):
+        return iter(self._types)
+
+    def as_dict(self):
+        return dict(self._types)
+
+    def add(self, name, column_type):
+        """Widen `name` to hold values of `column_type`"""
+        current = self._types.get(name)
+        if current != column_type:
+            self._types[name] = column_type if current is None else join(current, column_type)
+
+    def add_rows(self, header, rows):
+        """Widen every column of `header` to hold a batch of row tuples"""
+        if not rows:
+            return
+        for name, values in zip(header, zip(*rows)):
+            if self._types.get(name) != STRING:
+                self.add(name, values_type(values))
+
+    def add_record(self, flat):
+        """Widen every column of one flat record (a dict)"""
+        types = self._types
+        for name, value in flat.items():
+            if types.get(name) != STRING:
+                self.add(name, value_type(value))
+
+    def update(self, other):
+        """Widen with the types of another ColumnTypes"""
+        for name in other:
+            self.add(name, other[name])
@@ -0,0 +1,349 @@
+"""
+The conversion engine: reader -> flattener -> writer, with no web server.
+
+The Flask app (main.py) and the json2tab command line tool both convert
+through these functions. `convert` is the one-call entry point: it streams
+records from a binary stream into a path or any writable binary file
+(stdout included) as CSV, Excel, Parquet or Arrow:
+
+    import engine
+    with open('events.jsonl', 'rb') as source:
+        summary = engine.convert(source, 'events.parquet', 'parquet',
+                                 flattening=engine.make_flattening(arrays='json'))
+
+The lower-level functions write one artifact per conversion mode and are
+what the web app stores in its sessions.
+"""
+
+import itertools
+import os
+import tempfile
+from collections import deque
+from contextlib import contextmanager
+
+from werkzeug.utils import secure_filename
+
+from columntypes import ColumnTypes
+from flattener import ARRAY_MODES, Flattening
+from parallel import is_json_lines, parallel_convert
+from readers import LineErrors, drain, iter_records, tee
+from relational import relational_columns, remove_tables, write_tables
+from selection import Projection, RowFilter
+from writers import (COLUMNAR_FORMATS, COMPRESSION_SUFFIXES, EXCEL_MAX_ROWS, convert_artifact, iter_artifact_rows,
+                     iter_table_bytes, iter_xlsx_tables, iter_zip, open_writer, pa, write_rows)
+
+OUTPUT_FORMATS = ['csv', 'excel'] + (list(COLUMNAR_FORMATS) if pa is not None else [])
+OUTPUT_EXTENSIONS = {'csv': '.csv', 'excel': '.xlsx', 'parquet': '.parquet', 'arrow': '.arrow'}
+LAYOUTS = ['wide', 'relational']
+CHUNK_SIZE = 1000  # Process in chunks of 1000 records
+DEFAULT_FLATTENING = Flattening()
+
+
+def make_flattening(arrays='truncate', array_limit=10, columns=None, exclude=None, where=None):
+    """Flattening for the conversion options shared by the web form and the
+    command line: `columns` and `exclude` are comma separated globs, `where`
+    predicates separated by ';' (see selection.RowFilter).
+    Raises ValueError for a bad option value."""
+    if arrays not in ARRAY_MODES:
+        raise ValueError(f"Unknown array mode '{arrays}'")
+    try:
+        array_limit = int(array_limit)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid array limit '{array_limit}'")
+    if array_limit < 0:
+        raise ValueError(f"Invalid array limit '{array_limit}'")
+    projection = Projection(*([p.strip() for p in (patterns or '').split(',') if p.strip()]
+                              for patterns in (columns, exclude)))
+    row_filter = RowFilter([p for p in (where or '').split(';') if p.strip()])
+    return Flattening(arrays, array_limit, projection=projection, row_filter=row_filter)
+
+
+def record_columns(records, flattening=DEFAULT_FLATTENING):
+    """Sorted union of the columns `flattening` produces for `records`
+    (already exploded, see Flattening.records)"""
+    keys = {}
+    for obj in records:
+        flattening.keys(obj, keys)
+    return sorted(keys)
+
+
+def record_types(records, flattening=DEFAULT_FLATTENING):
+    """record_columns plus the type of every column over all `records`.
+    Returns (columns, ColumnTypes)"""
+    keys = {}
+    types = ColumnTypes()
+    for obj in records:
+        flat = flattening.row(obj)
+        keys.update(dict.fromkeys(flat))
+        types.add_record(flat)
+    return sorted(keys), types
+
+
+def sampled_rows(stream, window=CHUNK_SIZE, flattening=DEFAULT_FLATTENING, record_path=None, errors=None):
+    """Header and row iterator of a single-pass conversion. The header is
+    fixed from the first `window` records, which are read right away; keys
+    first seen after that are written as a JSON object into the `_extra`
+    column. A column projection leaves `_extra` out unless its patterns
+    keep it, and such later keys are then dropped. The rows are produced lazily as the rest of `stream` is read,
+    holding at most `window` records in memory. Bad JSON Lines records are
+    handed to `errors` (a LineErrors); `record_path` is passed to
+    iter_records. Returns (header, rows)
+    """
+    records = flattening.records(iter_records(stream, errors, record_path))
+
+    # Sample the first window of objects to determine the header
+    sampled = deque(itertools.islice(records, window))
+
+    # Add a reserved column to capture unexpected/new keys beyond the sampled union
+    EXTRA_COL = '_extra'
+    header = [k for k in record_columns(sampled, flattening) if k != EXTRA_COL]
+    extra_column = None
+    if flattening.projection is None or flattening.projection.wants(EXTRA_COL):
+        header.append(EXTRA_COL)
+        extra_column = EXTRA_COL
+    flattener = flattening.compile(header, fill=None, extra_column=extra_column)
+
+    def sampled_then_rest():
+        # Release sampled records as they are written
+        while sampled:
+            yield sampled.popleft()
+        yield from records
+
+    return header, flattener.rows(sampled_then_rest())
+
+
+def stream_convert_file(stream, combined_file_path, window=CHUNK_SIZE, max_preview=20, artifact_format='csv',
+                        compression=None, flattening=DEFAULT_FLATTENING, record_path=None, errors=None,
+                        progress=None):
+    """Stream-parse incoming JSON/JSONL and write the artifact incrementally,
+    with the header of the first `window` records (see sampled_rows).
+    Written rows are reported to `progress` (a jobs.Progress).
+    Returns (total_rows, header, preview_rows, column types)
+    """
+    header, rows = sampled_rows(stream, window, flattening, record_path, errors)
+    writer = open_writer(combined_file_path, header, artifact_format, compression)
+    total_rows, preview_rows = write_rows(writer, rows, window, max_preview, progress)
+    return total_rows, header, preview_rows, writer.types.as_dict()
+
+
+def iter_converted(stream, output_format='csv', compression=None, window=CHUNK_SIZE, flattening=DEFAULT_FLATTENING,
+                   record_path=None, errors=None):
+    """Yield the bytes of `stream` converted to `output_format` as rows are
+    flattened, `window` rows at a time, with no file written (Parquet and
+    Arrow come out at the end, see writers.ArrowRowWriter). The header is
+    sampled (see sampled_rows) before the first byte is yielded, so errors
+    in the first window are raised by the first next()."""
+    header, rows = sampled_rows(stream, window, flattening, record_path, errors)
+    yield from iter_table_bytes(header, iter(lambda: list(itertools.islice(rows, window)), []), output_format,
+                                compression)
+
+
+def spooled_convert_file(stream, combined_file_path, window=CHUNK_SIZE, max_preview=20, artifact_format='csv',
+                         compression=None, flattening=DEFAULT_FLATTENING, record_path=None, workers=1, errors=None,
+                         progress=None):
+    """Two-pass conversion that never needs an `_extra` column.
+    The upload is spooled to disk while a key-only scan builds the complete
+    header, then the spool is read back sequentially and every row is
+    written against that header. Both passes stream. For a columnar
+    artifact the scan also types every column, so the schema holds for the
+    whole input rather than just its first rows. With `workers` > 1 a
+    JSON Lines upload is spooled first and both passes run in parallel
+    (except when exploding arrays, whose record ids need one sequential pass,
+    or reading a `record_path`).
+    Bad JSON Lines records are handed to `errors` during the scan.
+    Returns (total_rows, header, preview_rows, column types)
+    """
+    def scan(source):
+        records = flattening.records(iter_records(source, errors, record_path))
+        if artifact_format in COLUMNAR_FORMATS:
+            header, types = record_types(records, flattening)
+            return header, types.as_dict()
+        return record_columns(records, flattening), None
+
+    def write(source, scanned):
+        header, types = scanned
+        return write_spool(source, header, combined_file_path, window, max_preview, artifact_format,
+                           compression, flattening, record_path, progress, types)
+
+    if workers > 1:
+        with spool_file(stream) as spool:
+            if flattening.arrays != 'explode' and record_path is None and is_json_lines(spool.name):
+                return parallel_convert(spool.name, combined_file_path, flattening, workers=workers,
+                                        window=window, max_preview=max_preview,
+                                        artifact_format=artifact_format, compression=compression,
+                                        errors=errors, progress=progress)
+            return write(spool, scan(spool))
+
+    if stream.seekable():
+        # Already on disk: scan it, then read it again
+        return write(stream, scan(stream))
+
+    with tempfile.TemporaryFile() as spool:
+        teed = tee(stream, spool)
+        scanned = scan(teed)
+        drain(teed)
+        return write(spool, scanned)
+
+
+@contextmanager
+def spool_file(stream):
+    """Yield a named file on disk holding the contents of `stream`: the
+    stream itself if it is one, else a temporary copy"""
+    name = getattr(stream, 'name', None)
+    if stream.seekable() and isinstance(name, str) and os.path.isfile(name):
+        stream.seek(0)
+        yield stream
+        return
+    with tempfile.NamedTemporaryFile(suffix='.json') as spool:
+        drain(tee(stream, spool))
+        spool.flush()
+        spool.seek(0)
+        yield spool
+
+
+def write_spool(spool, header, combined_file_path, window=CHUNK_SIZE, max_preview=20, artifact_format='csv',
+                compression=None, flattening=DEFAULT_FLATTENING, record_path=None, progress=None, types=None):
+    """Second pass of a spooled conversion: write every record against `header`
+    (and the column `types` the scan found, if any).
+    Bad lines were already reported by the scan, so they are skipped silently.
+    """
+    spool.seek(0)
+    flattener = flattening.compile(header, fill=None)
+    writer = open_writer(combined_file_path, header, artifact_format, compression, types)
+    records = flattening.records(iter_records(spool, LineErrors('skip'), record_path))
+    total_rows, preview_rows = write_rows(writer, flattener.rows(records), window, max_preview, progress)
+    return total_rows, header, preview_rows, writer.types.as_dict()
+
+
+def relational_convert_file(stream, artifact_format='csv', schema_mode='sample', window=CHUNK_SIZE, max_preview=20,
+                            compression=None, record_path=None, errors=None, progress=None):
+    """Relational layout: write the root table and one table per path
+    holding an array of objects, each linked to its parent rows (see
+    relational.py). The 'sample' schema mode fixes each table's columns
+    from its first `window` rows, 'spooled' scans the upload for them first.
+    Returns the table results, root table first.
+    """
+    def write(source, headers, errors):
+        return write_tables(iter_records(source, errors, record_path), artifact_format, compression, headers, window,
+                            max_preview, progress=progress)
+
+    if schema_mode == 'sample':
+        return write(stream, None, errors)
+
+    def scan(source):
+        return relational_columns(iter_records(source, errors, record_path))
+
+    # Bad lines were already reported by the scan, so the write skips them silently
+    if stream.seekable():
+        headers = scan(stream)
+        stream.seek(0)
+        return write(stream, headers, LineErrors('skip'))
+
+    with tempfile.TemporaryFile() as spool:
+        teed = tee(stream, spool)
+        headers = scan(teed)
+        drain(teed)
+        spool.seek(0)
+        return write(spool, headers, LineErrors('skip'))
+
+
+SCHEMA_MODES = {
+    'sample': stream_convert_file,
+    'spooled': spooled_convert_file,
+}
+
+
+def iter_table_bundle(tables, artifact_format, output_format, stored=None, sheet_rows=EXCEL_MAX_ROWS):
+    """Bytes of every table of a relational conversion (the table results
+    of write_tables, stored as `artifact_format` compressed with `stored`):
+    an xlsx workbook with a sheet per table, else a zip with a file per
+    table in `output_format`. Tables stored in another format are converted
+    one at a time as the zip is produced, each temporary file removed once
+    it has been added."""
+    if output_format == 'excel':
+        return iter_xlsx_tables(
+            ((table['name'], table['columns'],
+              iter_artifact_rows(table['path'], artifact_format, compression=stored, types=table.get('types')))
+             for table in tables),
+            sheet_rows=sheet_rows)
+
+    def members():
+        names = set()
+        for table in tables:
+            base = secure_filename(table['name']) or 'table'
+            name, count = base, 1
+            while name in names:
+                count += 1
+                name = f"{base}_{count}"
+            names.add(name)
+            if output_format == artifact_format:
+                yield name + OUTPUT_EXTENSIONS[output_format] + COMPRESSION_SUFFIXES.get(stored, ''), table['path']
+                continue
+            with tempfile.NamedTemporaryFile(suffix=OUTPUT_EXTENSIONS[output_format]) as tmp_file:
+                convert_artifact(table['path'], artifact_format, tmp_file.name, output_format, stored,
+                                 table.get('types'))
+                yield name + OUTPUT_EXTENSIONS[output_format], tmp_file.name
+
+    return iter_zip(members())
+
+
+@contextmanager
+def _open_target(target):
+    """`target` as a writable binary file: a path is created (and removed
+    again if the conversion fails), a file object is used as it is"""
+    if not isinstance(target, (str, os.PathLike)):
+        yield target
+        return
+    try:
+        with open(target, 'wb') as f:
+            yield f
+    except BaseException:
+        try:
+            os.unlink(target)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def convert(source, target, output_format='csv', schema_mode='sample', layout='wide', flattening=DEFAULT_FLATTENING,
+            record_path=None, errors=None, compression=None, window=CHUNK_SIZE, workers=1, progress=None):
+    """Convert the JSON / JSON Lines records of `source` (a binary stream,
+    see readers.iter_records) into `target`, a path or a writable binary
+    file such as sys.stdout.buffer, as `output_format`.
+
+    The wide layout streams rows into `target` as they are flattened; with
+    the 'spooled' `schema_mode` the input is scanned first (spooled to a
+    temporary file if it cannot seek), and `workers` > 1 converts JSON
+    Lines in that many processes. The relational layout writes its tables
+    to temporary files, then a zip of them, or an xlsx workbook for Excel.
+    `record_path` is an ijson prefix (readers.record_path_prefix), `errors`
+    a LineErrors for bad JSON Lines records (fail-fast by default) and
+    `compression` ('gzip' / 'zstd') applies to CSV. Written rows are
+    reported to `progress` (a jobs.Progress).
+    Returns a summary dict: rows, columns, column_types, and the tables
+    (name, rows, columns) for the relational layout.
+    """
+    if errors is None:
+        errors = LineErrors()
+    if layout == 'relational':
+        artifact_format = output_format if output_format in COLUMNAR_FORMATS else 'csv'
+        tables = relational_convert_file(source, artifact_format, schema_mode, window, max_preview=0,
+                                         record_path=record_path, errors=errors, progress=progress)
+        try:
+            with _open_target(target) as out:
+                for chunk in iter_table_bundle(tables, artifact_format, output_format):
+                    out.write(chunk)
+        finally:
+            remove_tables(tables)
+        return {'rows': tables[0]['rows'], 'columns': tables[0]['columns'], 'column_types': tables[0]['types'],
+                'tables': [{'name': t['name'], 'rows': t['rows'], 'columns': t['columns']} for t in tables]}
+    if layout not in LAYOUTS:
+        raise ValueError(f"Unknown layout '{layout}'")
+
+    options = {'workers': workers} if schema_mode == 'spooled' else {}
+    with _open_target(target) as out:
+        total_rows, header, _, types = SCHEMA_MODES[schema_mode](
+            source, out, window=window, max_preview=0, artifact_format=output_format, compression=compression,
+            flattening=flattening, record_path=record_path, errors=errors, progress=progress, **options)
+        out.flush()
+    return {'rows': total_rows, 'columns': header, 'column_types': types}
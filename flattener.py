@@ -0,0 +1,375 @@
+"""
+Flattening of nested records into rows, and its schema-specialized form.
+
+flatten_json walks every record generically, building a dict per nesting
+level and re-joining the same key paths for every record. For the uniform
+records that make up most uploads that work is identical each time, so
+CompiledFlattener learns each record shape once, generates a function that
+pulls the leaf values straight out of the nested structure and emits rows
+as tuples in column order. Records that match no learned shape go through
+the regular flatten function instead.
+
+All helpers follow flatten_json's key rules: nested keys are joined with
+`sep`, array items get their index appended, and when `array_limit` is set
+only that many items are kept plus a `<key>_count` column. With
+`json_arrays` an array is instead kept whole as JSON text in one column.
+A `projection` (selection.Projection) drops columns it does not keep and
+skips the subtrees that cannot hold any. Flattening bundles these settings
+with the array modes, projection and row filter offered to users.
+"""
+
+import itertools
+import json
+
+_CONTAINERS = frozenset((dict, list))
+
+ARRAY_MODES = ('truncate', 'index', 'json', 'explode')
+RECORD_ID_COLUMN = '_record'
+
+
+def flatten_json(data, parent_key='', sep='_', array_limit=10, json_arrays=False, projection=None):
+    """Flatten nested JSON structure"""
+    items = []
+    if isinstance(data, dict):
+        for k, v in data.items():
+            new_key = f"{parent_key}{sep}{k}" if parent_key else k
+            if projection is not None and not projection.enters(new_key):
+                continue
+            if isinstance(v, dict):
+                items.extend(flatten_json(v, new_key, sep, array_limit, json_arrays, projection).items())
+            elif isinstance(v, list):
+                if json_arrays:
+                    items.append((new_key, json.dumps(v, ensure_ascii=False)))
+                    continue
+                # Only the first `array_limit` items get columns
+                sample_size = len(v) if array_limit is None else min(array_limit, len(v))
+                for i in range(sample_size):
+                    item = v[i]
+                    if isinstance(item, dict):
+                        items.extend(flatten_json(item, f"{new_key}{sep}{i}", sep, array_limit,
+                                                  projection=projection).items())
+                    else:
+                        items.append((f"{new_key}{sep}{i}", item))
+                # The rest of a long array is only counted
+                if len(v) > sample_size:
+                    items.append((f"{new_key}_count", len(v)))
+            else:
+                items.append((new_key, v))
+    elif isinstance(data, list):
+        sample_size = len(data) if array_limit is None else min(array_limit, len(data))
+        for i in range(sample_size):
+            item = data[i]
+            if isinstance(item, dict):
+                items.extend(flatten_json(item, f"{parent_key}{sep}{i}", sep, array_limit,
+                                          projection=projection).items())
+            else:
+                items.append((f"{parent_key}{sep}{i}", item))
+        if len(data) > sample_size:
+            items.append((f"{parent_key}_total_count", len(data)))
+    else:
+        items.append((parent_key, data))
+    
+    if projection is not None and not parent_key:
+        return {k: v for k, v in items if projection.wants(k)}
+    return dict(items)
+
+
+def explode_record(record):
+    """Expand every non-empty array of objects in `record` into one record
+    per item, the item taking the array's place. Returns the list of
+    records, none of which holds an array of objects any more. Sibling
+    arrays multiply, as if exploded one after the other; other arrays are
+    left as they are.
+    """
+    rows = [{}]
+    for key, value in record.items():
+        if isinstance(value, dict):
+            choices = explode_record(value)
+        elif isinstance(value, list) and value and all(isinstance(item, dict) for item in value):
+            choices = [row for item in value for row in explode_record(item)]
+        else:
+            for row in rows:
+                row[key] = value
+            continue
+        if len(choices) == 1:
+            for row in rows:
+                row[key] = choices[0]
+        else:
+            rows = [{**row, key: choice} for row in rows for choice in choices]
+    return rows
+
+
+class Flattening:
+    """How records are flattened, as chosen by the `arrays` option.
+
+    'truncate' gives the first `array_limit` items of an array their own
+    `<key>_<i>` columns and counts the rest in `<key>_count`; 'index' gives
+    every item a column; 'json' keeps each array as JSON text in a single
+    column. 'explode' turns arrays of objects into child rows: a record
+    yields one row per item (see explode_record), each carrying the
+    1-based number of its source record in RECORD_ID_COLUMN, and any other
+    array is kept as JSON. `projection` (a selection.Projection) keeps only
+    some columns and `row_filter` (a selection.RowFilter) only some rows;
+    exploded rows are filtered one by one. Instances are picklable for
+    worker processes.
+    """
+
+    def __init__(self, arrays='truncate', array_limit=10, sep='_', projection=None, row_filter=None):
+        if arrays not in ARRAY_MODES:
+            raise ValueError(f"Unknown array mode '{arrays}'")
+        if array_limit is not None and array_limit < 0:
+            raise ValueError(f"Invalid array limit {array_limit}")
+        self.arrays = arrays
+        self.array_limit = array_limit if arrays == 'truncate' else None
+        self.json_arrays = arrays in ('json', 'explode')
+        self.sep = sep
+        self.projection = projection or None
+        self.row_filter = row_filter or None
+
+    def _key(self):
+        return (self.arrays, self.array_limit, self.sep, self.projection, self.row_filter)
+
+    def __eq__(self, other):
+        return isinstance(other, Flattening) and self._key() == other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def settings(self):
+        """JSON-serializable description, e.g. for cache keys"""
+        settings = {'arrays': self.arrays, 'array_limit': self.array_limit, 'sep': self.sep}
+        if self.projection is not None:
+            settings.update(columns=list(self.projection.include), exclude=list(self.projection.exclude))
+        if self.row_filter is not None:
+            settings['where'] = list(self.row_filter.predicates)
+        return settings
+
+    def flatten(self, record):
+        return flatten_json(record, sep=self.sep, array_limit=self.array_limit, json_arrays=self.json_arrays,
+                            projection=self.projection)
+
+    def row(self, record):
+        """flatten_json with these settings; a record that is not an object
+        has a `value` column"""
+        if not isinstance(record, dict):
+            if self.projection is None or self.projection.wants('value'):
+                return {'value': record}
+            return {}
+        return self.flatten(record)
+
+    def keys(self, record, keys):
+        """flatten_keys with these settings; a record that is not an object
+        has a `value` column"""
+        if not isinstance(record, dict):
+            if self.projection is None or self.projection.wants('value'):
+                keys['value'] = None
+            return
+        flatten_keys(record, keys, sep=self.sep, array_limit=self.array_limit, json_arrays=self.json_arrays,
+                     projection=self.projection)
+
+    def records(self, records):
+        """The records to flatten: `records` itself, or its exploded rows,
+        less those the row filter rejects"""
+        if self.arrays == 'explode':
+            records = self._explode(records)
+        if self.row_filter is not None:
+            records = self.row_filter.filter(records)
+        return records
+
+    @staticmethod
+    def _explode(records):
+        for record_id, record in enumerate(records, 1):
+            if isinstance(record, dict):
+                for row in explode_record(record):
+                    yield {RECORD_ID_COLUMN: record_id, **row}
+            else:
+                yield record
+
+    def compile(self, columns, **options):
+        """A CompiledFlattener with these settings"""
+        return CompiledFlattener(columns, self.flatten, sep=self.sep, array_limit=self.array_limit,
+                                 json_arrays=self.json_arrays, projection=self.projection, **options)
+
+
+def flatten_keys(data, keys, parent_key='', sep='_', array_limit=10, json_arrays=False, projection=None):
+    """Add the column names flatten_json would produce for `data` to `keys`.
+    `keys` is a dict (used as an ordered set) so first-seen order is kept.
+    Mirrors flatten_json's key rules without building the flattened dict.
+    """
+    if projection is not None:
+        found = {}
+        _flatten_keys(data, found, parent_key, sep, array_limit, json_arrays, projection)
+        keys.update((k, None) for k in found if projection.wants(k))
+    else:
+        _flatten_keys(data, keys, parent_key, sep, array_limit, json_arrays, None)
+
+
+def _flatten_keys(data, keys, parent_key, sep, array_limit, json_arrays, projection):
+    for k, v in data.items():
+        new_key = f"{parent_key}{sep}{k}" if parent_key else k
+        if projection is not None and not projection.enters(new_key):
+            continue
+        if isinstance(v, dict):
+            _flatten_keys(v, keys, new_key, sep, array_limit, json_arrays, projection)
+        elif isinstance(v, list) and json_arrays:
+            keys[new_key] = None
+        elif isinstance(v, list):
+            sample_size = len(v) if array_limit is None else min(array_limit, len(v))
+            for i in range(sample_size):
+                if isinstance(v[i], dict):
+                    _flatten_keys(v[i], keys, f"{new_key}{sep}{i}", sep, array_limit, False, projection)
+                else:
+                    keys[f"{new_key}{sep}{i}"] = None
+            if len(v) > sample_size:
+                keys[f"{new_key}_count"] = None
+        else:
+            keys[new_key] = None
+
+
+class CompiledFlattener:
+    """Flatten records into row tuples ordered like `columns`.
+
+    `flatten` is the reference flatten function used for records that match
+    no learned shape; `sep`, `array_limit` and `json_arrays` must match its
+    behaviour.
+    Columns a record does not have are set to `fill`. Keys that are not in
+    `columns` are JSON-encoded into `extra_column` if given, else dropped.
+    Keys `projection` does not keep are left out of the generated code
+    altogether, and `flatten` must leave them out as well.
+    At most `max_shapes` shapes are compiled; later new shapes fall back.
+    """
+
+    def __init__(self, columns, flatten, sep='_', array_limit=10, fill='',
+                 extra_column=None, max_shapes=256, json_arrays=False, projection=None):
+        self.columns = list(columns)
+        self.flatten = flatten
+        self.sep = sep
+        self.array_limit = array_limit
+        self.json_arrays = json_arrays
+        self.projection = projection
+        self.fill = fill
+        self.extra_column = extra_column
+        self.max_shapes = max_shapes
+        self.shape_count = 0
+        self._known = {k for k in self.columns if k != extra_column}
+        self._shapes = {}  # top-level key tuple -> [extract, ...]
+
+    def row(self, record):
+        """Return the row tuple for one record"""
+        if type(record) is dict:
+            signature = tuple(record)
+            candidates = self._shapes.get(signature)
+            if candidates is not None:
+                for extract in candidates:
+                    try:
+                        row = extract(record)
+                    except (KeyError, IndexError, TypeError):
+                        continue
+                    if row is not None:
+                        return row
+            if self.shape_count < self.max_shapes:
+                extract = self._compile(record)
+                self._shapes.setdefault(signature, []).append(extract)
+                self.shape_count += 1
+                return extract(record)
+        return self._fallback(record)
+
+    def rows(self, records):
+        """Yield row tuples for an iterable of records"""
+        return map(self.row, records)
+
+    def _fallback(self, record):
+        if isinstance(record, dict):
+            flat = self.flatten(record)
+        elif self.projection is None or self.projection.wants('value'):
+            flat = {'value': record}
+        else:
+            flat = {}
+        fill = self.fill
+        row = [flat.get(k, fill) for k in self.columns]
+        if self.extra_column is not None:
+            extra = {k: v for k, v in flat.items() if k not in self._known}
+            row[self.columns.index(self.extra_column)] = (
+                json.dumps(extra, ensure_ascii=False) if extra else fill)
+        return tuple(row)
+
+    def _compile(self, record):
+        """Generate an extract function specialized to the shape of `record`"""
+        sep = self.sep
+        limit = self.array_limit
+        projection = self.projection
+        lines = []
+        leaves = {}     # column key -> local variable holding its value
+        strict = []     # values that must not be containers
+        loose = []      # array items, which may be anything but an object
+        names = itertools.count()
+
+        def local(expr):
+            name = f"v{next(names)}"
+            lines.append(f"{name} = {expr}")
+            return name
+
+        def visit_dict(var, node, parent_key):
+            for k, v in node.items():
+                key = f"{parent_key}{sep}{k}" if parent_key else k
+                if projection is not None and not projection.enters(key):
+                    continue
+                value = local(f"{var}[{k!r}]")
+                if type(v) is dict:
+                    lines.append(f"if type({value}) is not dict or len({value}) != {len(v)}: return None")
+                    visit_dict(value, v, key)
+                elif type(v) is list:
+                    visit_list(value, v, key)
+                else:
+                    leaves[key] = value
+                    strict.append(value)
+
+        def visit_list(var, node, key):
+            if self.json_arrays:
+                lines.append(f"if type({var}) is not list: return None")
+                leaves[key] = f"_dumps({var}, ensure_ascii=False)"
+                return
+            if limit is not None and len(node) > limit:
+                # Long arrays share a shape regardless of their exact length
+                lines.append(f"if type({var}) is not list or len({var}) <= {limit}: return None")
+                sample_size = limit
+            else:
+                lines.append(f"if type({var}) is not list or len({var}) != {len(node)}: return None")
+                sample_size = len(node)
+            for i in range(sample_size):
+                item_key = f"{key}{sep}{i}"
+                item = local(f"{var}[{i}]")
+                if type(node[i]) is dict:
+                    lines.append(f"if type({item}) is not dict or len({item}) != {len(node[i])}: return None")
+                    visit_dict(item, node[i], item_key)
+                else:
+                    leaves[item_key] = item
+                    loose.append(item)
+            if sample_size < len(node):
+                leaves[f"{key}_count"] = f"len({var})"
+
+        visit_dict('r', record, '')
+        if projection is not None:
+            leaves = {k: v for k, v in leaves.items() if projection.wants(k)}
+        if strict:
+            lines.append(f"if not _CONTAINERS.isdisjoint({{{', '.join(f'type({v})' for v in strict)}}}): return None")
+        for value in loose:
+            lines.append(f"if type({value}) is dict: return None")
+
+        extra = [k for k in leaves if k not in self._known]
+        values = []
+        for column in self.columns:
+            if column == self.extra_column:
+                if extra:
+                    pairs = ', '.join(f"{k!r}: {leaves[k]}" for k in extra)
+                    values.append(f"_dumps({{{pairs}}}, ensure_ascii=False)")
+                else:
+                    values.append('_fill')
+            else:
+                values.append(leaves.get(column, '_fill'))
+        lines.append(f"return ({', '.join(values)}{',' if len(values) == 1 else ''})")
+
+        source = "def extract(r):\n" + "\n".join(f"    {line}" for line in lines)
+        namespace = {'_CONTAINERS': _CONTAINERS, '_dumps': json.dumps, '_fill': self.fill}
+        exec(compile(source, '<compiled flattener>', 'exec'), namespace)
+        return namespace['extract']
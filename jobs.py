@@ -0,0 +1,164 @@
+"""
+Background conversion jobs.
+
+An upload is spooled to disk inside the request and then converted by a
+small thread pool, so the request returns at once with a job id. At most
+`workers` jobs convert at the same time and at most `max_pending` are
+queued or running; further submissions are refused with JobsBusyError
+instead of piling up spools and memory. Each job carries a Progress that
+the conversion updates. Given a store (sessions.SessionStore), the runner
+writes each job's state and progress there, at most every
+PUBLISH_SECONDS while it runs, so the status endpoint can answer from any
+worker process, not just the one running the job.
+"""
+
+import concurrent.futures
+import threading
+import time
+import uuid
+
+# Least time between two writes of a running job's progress to the store
+PUBLISH_SECONDS = 0.5
+
+
+class JobsBusyError(RuntimeError):
+    """Raised when the job queue is full"""
+
+
+class Progress:
+    """Bytes consumed and rows written by a running conversion.
+
+    `total_bytes` is the input size and `passes` how many times the input
+    is read (two for the spooled mode), which gives the percentage and ETA.
+    """
+
+    def __init__(self, total_bytes=0, passes=1):
+        self.total_bytes = total_bytes
+        self.passes = passes
+        self.bytes_read = 0
+        self.rows_written = 0
+        self.started = None
+        self.finished = None
+        # Called (at most every PUBLISH_SECONDS) as the counters move
+        self.on_change = None
+        self._published = 0.0
+
+    def add_bytes(self, count):
+        self.bytes_read += count
+        self._changed()
+
+    def add_rows(self, count):
+        self.rows_written += count
+        self._changed()
+
+    def _changed(self):
+        if self.on_change is not None:
+            now = time.monotonic()
+            if now - self._published >= PUBLISH_SECONDS:
+                self._published = now
+                self.on_change()
+
+    def snapshot(self):
+        elapsed = (self.finished or time.time()) - self.started if self.started else 0.0
+        expected = self.total_bytes * self.passes
+        done = min(self.bytes_read, expected)
+        eta = None
+        if elapsed > 0 and 0 < done < expected:
+            eta = round((expected - done) / (done / elapsed), 1)
+        return {
+            'bytes_read': min(self.bytes_read // self.passes, self.total_bytes),
+            'bytes_total': self.total_bytes,
+            'rows_written': self.rows_written,
+            'rows_per_second': round(self.rows_written / elapsed) if elapsed > 0 else 0,
+            'percent': round(100.0 * done / expected, 1) if expected else 0.0,
+            'elapsed_seconds': round(elapsed, 1),
+            'eta_seconds': eta,
+        }
+
+
+class Job:
+    def __init__(self, progress):
+        self.id = str(uuid.uuid4())
+        self.state = 'queued'
+        self.progress = progress
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+
+    def status(self):
+        """The job's state as stored and reported: id, state, progress
+        snapshot, error and result"""
+        return {'id': self.id, 'state': self.state, 'progress': self.progress.snapshot(),
+                'error': self.error, 'result': self.result}
+
+
+class JobRunner:
+    """Run conversion jobs in a bounded thread pool and keep their state,
+    in `store` when given. Finished jobs are forgotten here `keep_seconds`
+    after they end; the store keeps them for its own TTL. The results of
+    jobs run with a store must be JSON-serializable.
+    """
+
+    def __init__(self, workers=2, max_pending=8, keep_seconds=3600, store=None):
+        self.max_pending = max_pending
+        self.keep_seconds = keep_seconds
+        self.store = store
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='convert-job')
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, func, *args, progress=None, cleanup=None):
+        """Queue `func(*args, progress=...)`; its return value becomes the
+        job's result. `cleanup` is called once the job ends, either way.
+        Returns the Job. Raises JobsBusyError when the queue is full.
+        """
+        job = Job(progress or Progress())
+        with self._lock:
+            self._forget_old()
+            active = sum(1 for j in self._jobs.values() if j.state in ('queued', 'running'))
+            if active >= self.max_pending:
+                raise JobsBusyError(f"{active} conversions are already queued or running")
+            self._jobs[job.id] = job
+        self._publish(job)
+        job.progress.on_change = lambda: self._publish(job)
+        self._executor.submit(self._run, job, func, args, cleanup)
+        return job
+
+    def _publish(self, job):
+        if self.store is not None:
+            self.store.put_job(job.id, job.status())
+
+    def _run(self, job, func, args, cleanup):
+        job.state = 'running'
+        job.progress.started = time.time()
+        try:
+            self._publish(job)
+            job.result = func(*args, progress=job.progress)
+            job.state = 'done'
+        except Exception as e:
+            job.error = str(e)
+            job.state = 'failed'
+        finally:
+            job.finished = job.progress.finished = time.time()
+            job.progress.on_change = None
+            try:
+                self._publish(job)
+            finally:
+                if cleanup is not None:
+                    cleanup()
+
+    def _forget_old(self):
+        cutoff = time.time() - self.keep_seconds
+        for job_id in [j.id for j in self._jobs.values() if j.finished and j.finished < cutoff]:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        """The job's status (see Job.status), or None if it is unknown or
+        forgotten. With a store, jobs of every worker process are found."""
+        if self.store is not None:
+            return self.store.get_job(job_id)
+        with self._lock:
+            job = self._jobs.get(job_id)
+        return None if job is None else job.status()
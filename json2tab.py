@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+json2tab: convert JSON / JSON Lines to CSV, Excel, Parquet or Arrow.
+
+Reads a file (or stdin) and writes the table to a file (or stdout) through
+the same engine as the web app, so every conversion option of the upload
+form is available here too. The output format defaults to the extension of
+the output file (csv when writing to stdout), and a .gz / .zst suffix on a
+CSV output compresses it.
+
+    python json2tab.py events.jsonl -o events.parquet
+    curl -s https://example.com/export.json | python json2tab.py --arrays json > export.csv
+    python json2tab.py orders.json --layout relational -o orders.zip
+"""
+
+import argparse
+import sys
+
+import backends
+import engine
+from flattener import ARRAY_MODES
+from readers import ERROR_MODES, LineErrors, record_path_prefix
+from writers import COMPRESSIONS, COMPRESSION_SUFFIXES
+
+
+def output_options(path, output_format, compression):
+    """(format, compression) for the output: the explicit choices, else
+    read off the output file name"""
+    if path is None:
+        return output_format or 'csv', compression
+    name = path.lower()
+    for codec, suffix in COMPRESSION_SUFFIXES.items():
+        if name.endswith(suffix):
+            compression = compression or codec
+            name = name[:-len(suffix)]
+    if output_format is None:
+        output_format = next((fmt for fmt, ext in engine.OUTPUT_EXTENSIONS.items() if name.endswith(ext)), 'csv')
+    return output_format, compression
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='json2tab', description=__doc__.strip().splitlines()[0],
+        epilog='Exits with status 2 for bad options and 1 when the conversion fails.')
+    parser.add_argument('input', nargs='?', default='-', help='JSON or JSON Lines file (default: stdin)')
+    parser.add_argument('-o', '--output', help='output file (default: stdout)')
+    parser.add_argument('-f', '--format', choices=engine.OUTPUT_FORMATS,
+                        help='output format (default: from the output file name, else csv)')
+    parser.add_argument('--compression', choices=COMPRESSIONS, help='compress CSV output')
+    parser.add_argument('--layout', choices=engine.LAYOUTS, default='wide',
+                        help="'relational' writes a table per array of objects, zipped (or one workbook)")
+    parser.add_argument('--schema-mode', choices=list(engine.SCHEMA_MODES), default='sample',
+                        help="'sample' fixes columns from the first --window records, 'spooled' scans all first")
+    parser.add_argument('--window', type=int, default=engine.CHUNK_SIZE,
+                        help='records sampled for the header and written per batch (default: %(default)s)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='processes converting JSON Lines with --schema-mode spooled (default: 1)')
+    parser.add_argument('--arrays', choices=ARRAY_MODES, default='truncate', help='how arrays become columns')
+    parser.add_argument('--array-limit', type=int, default=10, help="items kept by --arrays truncate")
+    parser.add_argument('--columns', help='comma separated globs of the columns to keep')
+    parser.add_argument('--exclude', help='comma separated globs of the columns to drop')
+    parser.add_argument('--where', help="row predicates separated by ';', e.g. 'status=active;age>=30'")
+    parser.add_argument('--record-path', help="JSONPath of the records inside a document, e.g. '$.data[*]'")
+    parser.add_argument('--on-error', choices=ERROR_MODES, default='fail', help='bad JSON Lines records')
+    parser.add_argument('--quarantine', help='file receiving bad lines with --on-error quarantine')
+    parser.add_argument('--json-backend', choices=('auto',) + backends.LINE_BACKENDS,
+                        help='parser for JSON Lines records')
+    parser.add_argument('--stream-backend', choices=('auto',) + backends.STREAM_BACKENDS,
+                        help='ijson backend for JSON documents')
+    parser.add_argument('-q', '--quiet', action='store_true', help='print no summary to stderr')
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    output_format, compression = output_options(args.output, args.format, args.compression)
+    if compression is not None and output_format != 'csv':
+        parser.error(f"--compression applies to csv output, not {output_format}")
+    if args.on_error == 'quarantine' and not args.quarantine:
+        parser.error("--on-error quarantine needs --quarantine FILE")
+    if args.window < 1 or args.workers < 1:
+        parser.error("--window and --workers must be at least 1")
+    try:
+        backends.use(lines=args.json_backend, stream=args.stream_backend)
+        flattening = engine.make_flattening(args.arrays, args.array_limit, args.columns, args.exclude, args.where)
+        record_path = record_path_prefix(args.record_path) if args.record_path else None
+    except ValueError as e:
+        parser.error(str(e))
+
+    quarantine = open(args.quarantine, 'wb') if args.on_error == 'quarantine' else None
+    try:
+        errors = LineErrors(args.on_error, quarantine)
+        source = sys.stdin.buffer if args.input == '-' else open(args.input, 'rb')
+        target = args.output or sys.stdout.buffer
+        with source:
+            summary = engine.convert(source, target, output_format, args.schema_mode, args.layout, flattening,
+                                     record_path, errors, compression, args.window, args.workers)
+    except (OSError, ValueError) as e:
+        print(f"json2tab: {e}", file=sys.stderr)
+        return 1
+    finally:
+        if quarantine is not None:
+            quarantine.close()
+
+    if not args.quiet:
+        for table in summary.get('tables') or [summary]:
+            name = f"{table['name']}: " if 'name' in table else ''
+            print(f"{name}{table['rows']} rows, {len(table['columns'])} columns", file=sys.stderr)
+        if errors.count:
+            print(f"skipped {errors.count} bad lines", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
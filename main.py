@@ -1,329 +1,634 @@
 import json
 import pandas as pd
-from flask import Flask, render_template, request, send_file, flash, redirect, url_for, Response
+from flask import (Flask, render_template, request, send_file, flash, redirect, url_for, Response,
+                   stream_with_context)
 import os
 from werkzeug.utils import secure_filename
 import tempfile
 from datetime import datetime
 import uuid
-import gc
-from io import StringIO
-import csv
-try:
-    import ijson
-except Exception:
-    ijson = None
+import time
+from contextlib import ExitStack
+import shutil
+import hashlib
+import backends
+from readers import (MultipartUpload, InvalidJSONError, LineErrors, ERROR_MODES, iter_records, record_path_prefix,
+                     copy_hashed, counting)
+from profiling import ColumnProfiler
+from sessions import SessionStore
+from jobs import JobRunner, JobsBusyError, Progress
+from writers import (COLUMNAR_FORMATS, ARTIFACT_SUFFIXES, EXCEL_MAX_ROWS, COMPRESSIONS, COMPRESSION_SUFFIXES,
+                     COMPRESSION_MIMETYPES, iter_artifact_rows, iter_xlsx, iter_encoded, convert_artifact,
+                     read_artifact_page, row_index_path)
+from engine import (OUTPUT_FORMATS, OUTPUT_EXTENSIONS, LAYOUTS, CHUNK_SIZE, DEFAULT_FLATTENING, SCHEMA_MODES,
+                    make_flattening, relational_convert_file)
+import engine
+from batch import BATCH_MODES, batch_convert, is_archive, iter_archive
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-here'
 app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024  # Increased to 500MB
 
-ALLOWED_EXTENSIONS = {'json'}
-OUTPUT_FORMATS = ['csv', 'excel']
-CHUNK_SIZE = 1000  # Process in chunks of 1000 records
+ALLOWED_EXTENSIONS = {'json', 'jsonl', 'ndjson'}
+OUTPUT_MIMETYPES = {
+    'csv': 'text/csv',
+    'excel': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'parquet': 'application/vnd.apache.parquet',
+    'arrow': 'application/vnd.apache.arrow.file',
+}
+# Records held in memory while streaming: header sample and write batch size
+app.config['STREAM_WINDOW'] = CHUNK_SIZE
+# 'sample' fixes columns from the first window, 'spooled' scans the whole upload first
+app.config['SCHEMA_MODE'] = 'sample'
+# Worker processes for spooled JSON Lines conversions; 1 converts in-process
+app.config['CONVERT_WORKERS'] = 1
+# Bad JSON Lines records: 'fail' stops, 'skip' drops them, 'quarantine' also saves them to a side file
+app.config['ON_ERROR'] = 'fail'
+# Conversion sessions, shared by all worker processes through a local SQLite file
+app.config['SESSION_DB'] = os.path.join(tempfile.gettempdir(), 'json2tabular_sessions.sqlite3')
+# Sessions expire after this many seconds without access
+app.config['SESSION_TTL'] = 60 * 60
+# Least recently used sessions are evicted once their files exceed this size
+app.config['SESSION_MAX_BYTES'] = 2 * 1024 ** 3
+# Converted results are cached by upload hash + options; 0 disables the cache. It is off
+# by default: with it on, /convert spools and hashes the whole upload before converting
+app.config['RESULT_CACHE_DIR'] = os.path.join(tempfile.gettempdir(), 'json2tabular_cache')
+app.config['RESULT_CACHE_BYTES'] = 0
+app.config['RESULT_CACHE_TTL'] = 7 * 24 * 60 * 60
+# Downloaded sessions are kept this long so interrupted downloads can resume
+app.config['DOWNLOAD_GRACE_SECONDS'] = 10 * 60
+# Background jobs: conversions running at once, and queued + running before uploads are refused
+app.config['JOB_WORKERS'] = 2
+app.config['MAX_PENDING_JOBS'] = 8
+# Bump when a code change alters converted output, so old cache entries miss
+RESULT_CACHE_VERSION = 2
+# Rows per Excel worksheet (header included) before spilling into a new sheet
+app.config['EXCEL_SHEET_ROWS'] = EXCEL_MAX_ROWS
+# Arrays: 'truncate' keeps ARRAY_LIMIT items as columns, 'index' all of them,
+# 'json' stores them as JSON text, 'explode' turns arrays of objects into rows
+app.config['ARRAY_MODE'] = 'truncate'
+app.config['ARRAY_LIMIT'] = 10
+# 'wide' writes one table; 'relational' one table per array-of-objects path, linked by row ids
+app.config['LAYOUT'] = 'wide'
+# Records inside a wrapper object, as a JSONPath ('$.data.results[*]') or ijson prefix
+# ('data.results.item'); None reads top-level records or the array of a wrapper that only adds metadata
+app.config['RECORD_PATH'] = None
+# CSV artifacts can be kept compressed on disk: None, 'gzip' or 'zstd'
+app.config['ARTIFACT_COMPRESSION'] = None
+# Most rows returned by one /preview/<session_id>/rows request
+app.config['PREVIEW_PAGE_ROWS'] = 1000
+# Archives and multi-file uploads: 'union' writes one table with a _source column, 'separate' one per file
+app.config['BATCH_MODE'] = 'union'
+# Worker processes converting the files of a batch; 1 converts in-process
+app.config['BATCH_WORKERS'] = os.cpu_count() or 1
+
+class InvalidOptionError(ValueError):
+    """Raised for an unknown conversion option value"""
+
+def session_store():
+    """The app's SessionStore, opened on first use from the current config"""
+    store = app.extensions.get('session_store')
+    if store is None:
+        store = app.extensions['session_store'] = SessionStore(
+            app.config['SESSION_DB'], ttl=app.config['SESSION_TTL'],
+            max_bytes=app.config['SESSION_MAX_BYTES'])
+    return store
 
 def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
-
-def flatten_json(data, parent_key='', sep='_'):
-    """Flatten nested JSON structure - optimized version"""
-    items = []
-    if isinstance(data, dict):
-        for k, v in data.items():
-            new_key = f"{parent_key}{sep}{k}" if parent_key else k
-            if isinstance(v, dict):
-                items.extend(flatten_json(v, new_key, sep=sep).items())
-            elif isinstance(v, list):
-                # Handle arrays more efficiently
-                if len(v) > 0:
-                    # For large arrays, only sample first few items to determine structure
-                    sample_size = min(10, len(v))
-                    for i in range(sample_size):
-                        item = v[i]
-                        if isinstance(item, dict):
-                            items.extend(flatten_json(item, f"{new_key}{sep}{i}", sep=sep).items())
-                        else:
-                            items.append((f"{new_key}{sep}{i}", item))
-                    # For remaining items in large arrays, use a more compact representation
-                    if len(v) > sample_size:
-                        items.append((f"{new_key}_count", len(v)))
-            else:
-                items.append((new_key, v))
-    elif isinstance(data, list):
-        # Handle large lists more efficiently
-        sample_size = min(10, len(data))
-        for i in range(sample_size):
-            item = data[i]
-            if isinstance(item, dict):
-                items.extend(flatten_json(item, f"{parent_key}{sep}{i}", sep=sep).items())
-            else:
-                items.append((f"{parent_key}{sep}{i}", item))
-        if len(data) > sample_size:
-            items.append((f"{parent_key}_total_count", len(data)))
-    else:
-        items.append((parent_key, data))
-    
-    return dict(items)
-
-def process_json_chunks(json_data, chunk_size=CHUNK_SIZE):
-    """Process JSON data in chunks to handle large datasets"""
-    if isinstance(json_data, list):
-        # Process list in chunks
-        for i in range(0, len(json_data), chunk_size):
-            chunk = json_data[i:i + chunk_size]
-            if all(isinstance(item, dict) for item in chunk):
-                # Flatten each object in the chunk
-                flattened_chunk = [flatten_json(item) for item in chunk]
-                yield pd.DataFrame(flattened_chunk)
-            else:
-                # Simple list chunk
-                yield pd.DataFrame(chunk, columns=['value'])
-            
-            # Force garbage collection after each chunk
-            gc.collect()
-    else:
-        # Single object or simple value
-        if isinstance(json_data, dict):
-            flattened = flatten_json(json_data)
-            yield pd.DataFrame([flattened])
-        else:
-            yield pd.DataFrame([json_data], columns=['value'])
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS or is_archive(filename)
+
+@app.route('/')
+def index():
+    return render_template('index.html')
 
+def upload_option(upload, name, default=None):
+    """Option from a form field sent before the file part, else the query string"""
+    return upload.form.get(name) or request.args.get(name, default)
 
-def stream_convert_file(file_storage, combined_file_path, sample_size=500, max_preview=20):
-    """Stream-parse incoming JSON/JSONL and write to CSV incrementally.
-    Uses ijson if available (for large JSON arrays). For JSONL, falls back to line-by-line parsing.
-    Returns (total_rows, header, preview_rows)
+def open_upload():
+    """Open the multipart request body for incremental reading.
+    Returns None if the request is not a multipart upload.
     """
-    stream = file_storage.stream
-    # Create iterator over objects
-    def line_iterator(s):
-        for raw in s:
-            if isinstance(raw, bytes):
-                line = raw.decode('utf-8')
-            else:
-                line = raw
-            line = line.strip()
-            if not line:
-                continue
-            yield json.loads(line)
+    boundary = request.mimetype_params.get('boundary')
+    if request.mimetype != 'multipart/form-data' or not boundary:
+        return None
+    return MultipartUpload(request.stream, boundary.encode('latin-1'))
 
-    if ijson:
-        try:
-            iterator = ijson.items(stream, 'item')
-        except Exception:
-            # fallback to line iterator
-            try:
-                stream.seek(0)
-            except Exception:
-                pass
-            iterator = line_iterator(stream)
+def conversion_settings(upload):
+    """Validated conversion options of an upload.
+    Parquet/Arrow artifacts are written directly when that output format is
+    known before the file part; otherwise the artifact is CSV.
+    """
+    requested_format = upload_option(upload, 'output_format')
+    if requested_format is not None and requested_format not in OUTPUT_FORMATS:
+        raise InvalidOptionError(f"Unsupported output format '{requested_format}'")
+    artifact_format = requested_format if requested_format in COLUMNAR_FORMATS else 'csv'
+
+    schema_mode = upload_option(upload, 'schema_mode', app.config['SCHEMA_MODE'])
+    if schema_mode not in SCHEMA_MODES:
+        raise InvalidOptionError(f"Unknown schema mode '{schema_mode}'")
+
+    on_error = upload_option(upload, 'on_error', app.config['ON_ERROR'])
+    if on_error not in ERROR_MODES:
+        raise InvalidOptionError(f"Unknown error mode '{on_error}'")
+
+    artifact_compression = app.config['ARTIFACT_COMPRESSION'] if artifact_format == 'csv' else None
+    if artifact_compression is not None and artifact_compression not in COMPRESSIONS:
+        raise InvalidOptionError(f"Unsupported compression '{artifact_compression}'")
+
+    flattening = flattening_settings(upload)
+
+    layout = upload_option(upload, 'layout', app.config['LAYOUT'])
+    if layout not in LAYOUTS:
+        raise InvalidOptionError(f"Unknown layout '{layout}'")
+    if layout == 'relational' and (flattening.projection or flattening.row_filter):
+        raise InvalidOptionError("columns, exclude and where apply to the wide layout only")
+
+    # Archives are always a batch; other uploads are one when `batch` asks for it
+    batch = upload_option(upload, 'batch') or (app.config['BATCH_MODE'] if is_archive(upload.filename) else None)
+    if batch is not None and batch not in BATCH_MODES:
+        raise InvalidOptionError(f"Unknown batch mode '{batch}'")
+    if batch is not None and layout != 'wide':
+        raise InvalidOptionError("Archives and multi-file uploads are converted with the wide layout only")
+
+    options = {}
+    if batch is not None:
+        options['workers'] = workers_option(upload, app.config['BATCH_WORKERS'])
+    elif schema_mode == 'spooled' and layout == 'wide':
+        options['workers'] = workers_option(upload, app.config['CONVERT_WORKERS'])
+
+    return {
+        'requested_format': requested_format,
+        'artifact_format': artifact_format,
+        'schema_mode': schema_mode,
+        'on_error': on_error,
+        'artifact_compression': artifact_compression,
+        'compression': compression_option(upload_option(upload, 'compression')),
+        'flattening': flattening,
+        'layout': layout,
+        'record_path': record_path_option(upload),
+        'batch': batch,
+        'options': options
+    }
+
+def workers_option(upload, default):
+    """Validated `workers` option, at most the number of CPUs"""
+    workers = upload_option(upload, 'workers', default)
+    try:
+        workers = int(workers)
+    except (TypeError, ValueError):
+        raise InvalidOptionError(f"Invalid worker count '{workers}'")
+    if workers < 1:
+        raise InvalidOptionError(f"Invalid worker count '{workers}'")
+    return min(workers, os.cpu_count() or 1)
+
+def flattening_settings(upload):
+    """Flattening chosen by the `arrays` and `array_limit` options, keeping
+    the columns matched by the `columns` globs (comma separated) less the
+    `exclude` ones, and the rows meeting every `where` predicate (separated
+    by ';', see selection.RowFilter)"""
+    try:
+        return make_flattening(upload_option(upload, 'arrays', app.config['ARRAY_MODE']),
+                               upload_option(upload, 'array_limit', app.config['ARRAY_LIMIT']),
+                               *(upload_option(upload, name) for name in ('columns', 'exclude', 'where')))
+    except ValueError as e:
+        raise InvalidOptionError(str(e))
+
+def record_path_option(upload):
+    """ijson prefix of the `record_path` option (JSONPath or ijson prefix), or
+    None to let iter_records find the records"""
+    record_path = upload_option(upload, 'record_path', app.config['RECORD_PATH'])
+    if not record_path:
+        return None
+    try:
+        return record_path_prefix(record_path)
+    except ValueError as e:
+        raise InvalidOptionError(str(e))
+
+def compression_option(value):
+    """Validated download compression: 'gzip', 'zstd' or None for 'none' / unset"""
+    if not value or value == 'none':
+        return None
+    if value not in COMPRESSIONS:
+        raise InvalidOptionError(f"Unsupported compression '{value}'")
+    return value
+
+def final_output_format(form, settings):
+    """Output format once all form fields are known, including ones sent after
+    the file. A late `compression` field is applied to `settings` as well."""
+    output_format = form.get('output_format') or settings['requested_format'] or 'csv'
+    if output_format not in OUTPUT_FORMATS:
+        raise InvalidOptionError(f"Unsupported output format '{output_format}'")
+    if 'compression' in form:
+        settings['compression'] = compression_option(form['compression'])
+    return output_format
+
+def finish_upload(upload):
+    """upload.finish(), refusing an upload with file parts that were not converted"""
+    form = upload.finish()
+    if upload.skipped_files:
+        raise InvalidOptionError(f"{len(upload.skipped_files) + 1} files were uploaded but only one is converted; "
+                                 "send batch=union or batch=separate ahead of them to convert them together")
+    return form
+
+def convert_upload(upload):
+    """Run the streaming conversion for an opened upload and register a session.
+    Returns (session_id, session_data, preview_rows)
+    """
+    settings = conversion_settings(upload)
+    filename = upload.filename
+    if settings['batch'] is not None:
+        with ExitStack() as stack:
+            result, cache_hit = convert_batch(upload_inputs(upload, stack), settings), False
     else:
+        with ExitStack() as stack:
+            source, digest = upload.stream, None
+            if result_cache() is not None:
+                # Spool the upload while hashing it; a hit skips parsing entirely
+                source = stack.enter_context(tempfile.NamedTemporaryFile(suffix='.json'))
+                digest = copy_hashed(upload.stream, source)
+                source.seek(0)
+            result, cache_hit = convert_cached(source, digest, settings)
+
+    try:
+        # Fields sent after the file part are only known once it is consumed
+        output_format = final_output_format(finish_upload(upload), settings)
+    except BaseException:
+        remove_files(*result_files(result))
+        raise
+
+    session_id, session_data = register_session(result, settings, filename, output_format, cache_hit)
+    return session_id, session_data, result['preview_rows']
+
+def upload_inputs(upload, stack):
+    """(name, stream) of every file part of a batch upload, the members of
+    archives in their place. A zip is spooled to a temporary file (entered
+    on `stack`) to reach its central directory; tar archives and plain
+    files are read straight from the request body."""
+    while True:
+        name = upload.filename
+        if is_archive(name):
+            stream = upload.stream
+            if name.lower().endswith('.zip'):
+                stream = stack.enter_context(tempfile.TemporaryFile())
+                shutil.copyfileobj(upload.stream, stream)
+                stream.seek(0)
+            yield from iter_archive(stream, name)
+        elif allowed_file(name):
+            yield name, upload.stream
+        else:
+            raise InvalidOptionError(f"Invalid file format: {name}")
+        if not upload.next_file():
+            return
+
+def convert_batch(inputs, settings, progress=None):
+    """Convert the (name, stream) `inputs` of an archive or multi-file
+    upload as one batch (see batch.py) into a result like convert_source's:
+    the union table, or with the 'separate' mode one table per file."""
+    quarantine = None
+    if settings['on_error'] == 'quarantine':
+        quarantine = tempfile.NamedTemporaryFile(delete=False, suffix='.jsonl')
+    errors = LineErrors(settings['on_error'], quarantine)
+    try:
         try:
-            stream.seek(0)
-        except Exception:
-            pass
-        iterator = line_iterator(stream)
+            written = batch_convert(
+                inputs, settings['batch'], settings['artifact_format'], settings['artifact_compression'],
+                settings['schema_mode'], settings['flattening'], settings['record_path'],
+                window=app.config['STREAM_WINDOW'], workers=settings['options']['workers'], errors=errors,
+                progress=progress)
+        finally:
+            if quarantine is not None:
+                quarantine.close()
+    except BaseException:
+        remove_files(quarantine and quarantine.name)
+        raise
+
+    quarantine_path = None
+    if quarantine is not None:
+        if errors.count:
+            quarantine_path = quarantine.name
+        else:
+            os.unlink(quarantine.name)
 
-    sampled = []
-    total_rows = 0
-    preview_rows = []
+    if settings['batch'] == 'separate':
+        # One table per file; the first stands for the session like a relational root table
+        root, sources = written[0], len(written)
+        tables = [{key: table[key] for key in ('name', 'path', 'columns', 'types', 'rows')} for table in written]
+    else:
+        root, sources, tables = written, written['sources'], None
+    return {
+        'df_path': root['path'],
+        'quarantine_path': quarantine_path,
+        'df_shape': (root['rows'], len(root['columns'])),
+        'df_columns': root['columns'],
+        'df_types': root['types'],
+        'tables': tables,
+        'sources': sources,
+        'invalid_lines': errors.count,
+        'error_samples': [message for _, _, message in errors.samples],
+        'preview_rows': root['preview_rows']
+    }
+
+def convert_cached(source, digest, settings, progress=None):
+    """Convert `source`, or reuse the cached result for the upload with
+    content hash `digest` and the same settings. Without a digest the
+    cache is bypassed. Returns (result, cache_hit)
+    """
+    cache = result_cache() if digest is not None else None
+    cache_key = None
+    if cache is not None:
+        cache_key = result_cache_key(digest, artifact_format=settings['artifact_format'],
+                                     artifact_compression=settings['artifact_compression'],
+                                     schema_mode=settings['schema_mode'], on_error=settings['on_error'],
+                                     flatten=settings['flattening'].settings(), layout=settings['layout'],
+                                     record_path=settings['record_path'])
+        cached = cache.get(cache_key)
+        if cached is not None:
+            result = clone_result(cached)
+            if progress is not None:
+                progress.add_bytes(progress.total_bytes * progress.passes)
+                progress.add_rows(result['df_shape'][0])
+            return result, True
 
-    # Sample first N objects to determine header
-    for _ in range(sample_size):
+    if progress is not None:
+        source = counting(source, progress.add_bytes)
+    result = convert_source(source, settings['artifact_format'], settings['schema_mode'],
+                            settings['on_error'], settings['options'], progress,
+                            compression=settings['artifact_compression'], flattening=settings['flattening'],
+                            layout=settings['layout'], record_path=settings['record_path'])
+    if cache_key is not None:
+        cache_result(cache, cache_key, result)
+    return result, False
+
+def convert_path(path, settings, digest=None, progress=None):
+    """Convert the file at `path`, a spooled upload or any JSON / JSON Lines
+    file on local disk. The file is opened and handed to convert_cached;
+    the readers split JSON Lines from a real file out of a memory map
+    (see readers.map_file).
+    Returns (result, cache_hit)
+    """
+    with open(path, 'rb') as source:
+        return convert_cached(source, digest, settings, progress)
+
+def register_session(result, settings, filename, output_format, cache_hit=False):
+    """Store a conversion result as a download session. Returns (session_id, session_data)"""
+    session_id = str(uuid.uuid4())
+    session_data = {
+        'df_path': result['df_path'],
+        'artifact_format': settings['artifact_format'],
+        'artifact_compression': settings['artifact_compression'],
+        'original_filename': secure_filename(filename),
+        'output_format': output_format,
+        'compression': settings['compression'],
+        'df_shape': result['df_shape'],
+        'df_columns': result['df_columns'],
+        'df_types': result.get('df_types'),
+        'tables': result['tables'],
+        'sources': result.get('sources'),
+        'invalid_lines': result['invalid_lines'],
+        'error_samples': result['error_samples'],
+        'quarantine_path': result['quarantine_path'],
+        'cached': cache_hit
+    }
+    session_store().put(session_id, session_data, files=session_files(session_data))
+    return session_id, session_data
+
+def convert_source(stream, artifact_format, schema_mode, on_error, options, progress=None, compression=None,
+                   flattening=DEFAULT_FLATTENING, layout='wide', record_path=None):
+    """Parse the records at `record_path` (None detects them, see
+    iter_records), flatten them (as set by `flattening`) and write them into
+    a new artifact file, compressed with `compression` as it is written. With the
+    'relational' layout every table gets an artifact, listed in `tables`.
+    Returns a result dict with the artifact and quarantine paths, the shape,
+    columns, tables, bad-line report and preview rows; `df_*` describe the
+    root table.
+    """
+    quarantine = None
+    if on_error == 'quarantine':
+        quarantine = tempfile.NamedTemporaryFile(delete=False, suffix='.jsonl')
+    errors = LineErrors(on_error, quarantine)
+    tables = None
+    if layout == 'wide':
+        suffix = ARTIFACT_SUFFIXES[artifact_format] + COMPRESSION_SUFFIXES.get(compression, '')
+        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp_file:
+            combined_file_path = tmp_file.name
+    try:
         try:
-            obj = next(iterator)
-        except StopIteration:
-            break
-        sampled.append(obj)
-
-    # Build union of keys from sampled objects
-    header_keys = set()
-    for obj in sampled:
-        flat = flatten_json(obj)
-        header_keys.update(flat.keys())
-
-    # Add a reserved column to capture unexpected/new keys beyond the sampled union
-    EXTRA_COL = '_extra'
-    header = sorted(list(header_keys))
-    if EXTRA_COL not in header:
-        header.append(EXTRA_COL)
-
-    # Open CSV and write sampled rows first
-    with open(combined_file_path, 'w', encoding='utf-8', newline='') as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=header)
-        writer.writeheader()
-
-        def write_flat(flat_obj):
-            # Separate unexpected keys into _extra
-            row = {k: flat_obj.get(k, '') for k in header if k != EXTRA_COL}
-            extra = {k: v for k, v in flat_obj.items() if k not in row}
-            if extra:
-                row[EXTRA_COL] = json.dumps(extra, ensure_ascii=False)
+            if layout == 'wide':
+                total_rows, all_columns, preview_rows, column_types = SCHEMA_MODES[schema_mode](
+                    stream, combined_file_path, window=app.config['STREAM_WINDOW'],
+                    artifact_format=artifact_format, compression=compression, flattening=flattening,
+                    record_path=record_path, errors=errors, progress=progress, **options)
             else:
-                row[EXTRA_COL] = ''
-            writer.writerow(row)
-
-        for obj in sampled:
-            flat = flatten_json(obj)
-            write_flat(flat)
-            total_rows += 1
-            if len(preview_rows) < max_preview:
-                preview_rows.append(flat)
-
-        # Continue with the rest of the iterator
-        for obj in iterator:
-            try:
-                flat = flatten_json(obj)
-            except Exception:
-                # Skip unparsable object but continue
-                continue
-            write_flat(flat)
-            total_rows += 1
-            if len(preview_rows) < max_preview:
-                preview_rows.append(flat)
-
-    return total_rows, header, preview_rows
-
-def parse_large_json_file(file_content):
-    """Parse JSON with fallback to streaming for large files"""
+                written = relational_convert_file(
+                    stream, artifact_format, schema_mode, window=app.config['STREAM_WINDOW'],
+                    compression=compression, record_path=record_path, errors=errors, progress=progress)
+                root = written[0]
+                combined_file_path, total_rows, all_columns = root['path'], root['rows'], root['columns']
+                preview_rows, column_types = root['preview_rows'], root['types']
+                tables = [{key: table[key] for key in ('name', 'path', 'columns', 'types', 'rows')}
+                          for table in written]
+        finally:
+            if quarantine is not None:
+                quarantine.close()
+    except BaseException:
+        remove_files(*(artifact_files(combined_file_path) if layout == 'wide' else []),
+                     quarantine and quarantine.name)
+        raise
+
+    quarantine_path = None
+    if quarantine is not None:
+        if errors.count:
+            quarantine_path = quarantine.name
+        else:
+            os.unlink(quarantine.name)
+
+    return {
+        'df_path': combined_file_path,
+        'quarantine_path': quarantine_path,
+        'df_shape': (total_rows, len(all_columns)),
+        'df_columns': all_columns,
+        'df_types': column_types,
+        'tables': tables,
+        'invalid_lines': errors.count,
+        'error_samples': [message for _, _, message in errors.samples],
+        'preview_rows': preview_rows
+    }
+
+def remove_files(*paths):
+    for path in paths:
+        if path and os.path.exists(path):
+            os.unlink(path)
+
+def result_cache():
+    """The conversion result cache, or None when RESULT_CACHE_BYTES is 0"""
+    if not app.config['RESULT_CACHE_BYTES']:
+        return None
+    cache = app.extensions.get('result_cache')
+    if cache is None:
+        os.makedirs(app.config['RESULT_CACHE_DIR'], exist_ok=True)
+        cache = app.extensions['result_cache'] = SessionStore(
+            os.path.join(app.config['RESULT_CACHE_DIR'], 'index.sqlite3'),
+            ttl=app.config['RESULT_CACHE_TTL'], max_bytes=app.config['RESULT_CACHE_BYTES'])
+    return cache
+
+def result_cache_key(digest, **options):
+    """Cache key for an upload's content hash plus every option that
+    changes the converted output"""
+    settings = dict(options, version=RESULT_CACHE_VERSION, window=app.config['STREAM_WINDOW'])
+    if options.get('schema_mode') != 'sample':
+        settings.pop('window')  # only the sample mode's header depends on it
+    encoded = json.dumps(settings, sort_keys=True).encode('utf-8')
+    return hashlib.sha256(digest.encode('ascii') + b'\0' + encoded).hexdigest()
+
+def clone_file(path, directory=None):
+    """Give `path` a second name, without copying when the filesystem allows.
+    Returns the new path (None for None)."""
+    if path is None:
+        return None
+    fd, clone = tempfile.mkstemp(suffix=os.path.splitext(path)[1], dir=directory)
+    os.close(fd)
+    os.unlink(clone)
+    link_or_copy(path, clone)
+    return clone
+
+def link_or_copy(path, target):
     try:
-        # Try standard JSON parsing first
-        return json.loads(file_content)
-    except json.JSONDecodeError:
-        # Try JSON Lines format
-        lines = file_content.strip().split('\n')
-        json_data = []
-        for line_num, line in enumerate(lines, 1):
-            if line.strip():
-                try:
-                    json_data.append(json.loads(line))
-                    # If we're processing too many lines, break early for memory
-                    if line_num > 100000:  # Limit for very large JSONL files
-                        break
-                except json.JSONDecodeError as e:
-                    if line_num <= 100:  # Only show errors for first 100 lines
-                        raise json.JSONDecodeError(f"Invalid JSON on line {line_num}: {str(e)}", line, e.pos)
-        return json_data
+        os.link(path, target)
+    except OSError:
+        shutil.copyfile(path, target)
 
-@app.route('/')
-def index():
-    return render_template('index.html')
+def artifact_files(path):
+    """An artifact and the row index written next to it (CSV only)"""
+    return [path, row_index_path(path)]
 
-@app.route('/convert', methods=['POST'])
-def convert_file():
-    if 'file' not in request.files:
-        flash('No file selected')
-        return redirect(url_for('index'))
+def clone_artifact(path, directory=None):
+    """clone_file for an artifact, bringing its row index along"""
+    clone = clone_file(path, directory)
+    if os.path.exists(row_index_path(path)):
+        link_or_copy(row_index_path(path), row_index_path(clone))
+    return clone
+
+def clone_result(result, directory=None):
+    """Copy of a conversion result whose files are clones of the original's"""
+    clone = dict(result, df_path=clone_artifact(result['df_path'], directory),
+                 quarantine_path=clone_file(result['quarantine_path'], directory))
+    if result.get('tables'):
+        # The root table is the result's own artifact
+        clone['tables'] = [
+            dict(table, path=clone['df_path'] if table['path'] == result['df_path']
+                 else clone_artifact(table['path'], directory))
+            for table in result['tables']]
+    return clone
+
+def result_files(result):
+    """Every file of a conversion result (or session): artifacts with their
+    row indexes, and the quarantine file"""
+    paths = artifact_files(result['df_path'])
+    for table in result.get('tables') or []:
+        if table['path'] != result['df_path']:
+            paths.extend(artifact_files(table['path']))
+    return paths + [result.get('quarantine_path')]
+
+def cache_result(cache, cache_key, result):
+    """Keep a copy of a fresh conversion result under `cache_key`"""
+    try:
+        entry = clone_result(result, app.config['RESULT_CACHE_DIR'])
+        cache.put(cache_key, entry, files=result_files(entry))
+    except OSError as e:
+        print(f"Result cache error: {e}")
+
+def render_preview(session_id, session_data, preview_rows):
+    total_rows, _ = session_data['df_shape']
+    all_columns = session_data['df_columns']
+    preview_df = pd.DataFrame(preview_rows, columns=all_columns)
     
-    file = request.files['file']
-    output_format = request.form.get('output_format', 'csv')
+    preview_data = {
+        'df_html': preview_df.to_html(classes='table table-striped', table_id='preview-table', escape=False),
+        'total_rows': total_rows,
+        'total_columns': len(all_columns),
+        'columns': all_columns,
+        'original_filename': session_data['original_filename'],
+        'output_format': session_data['output_format'],
+        'output_formats': OUTPUT_FORMATS,
+        'session_id': session_id,
+        'is_large_file': total_rows > 10000,
+        'invalid_lines': session_data['invalid_lines'],
+        'error_samples': session_data['error_samples'],
+        'has_quarantine': session_data['quarantine_path'] is not None,
+        'tables': [{'name': table['name'], 'rows': table['rows'], 'columns': len(table['columns'])}
+                   for table in session_data.get('tables') or []]
+    }
     
-    if file.filename == '':
+    return render_template('preview.html', **preview_data)
+
+@app.route('/preview/<session_id>/rows')
+def preview_page(session_id):
+    """One page of a session's converted rows, read from the artifact
+    through its row index. `offset` and `limit` select the rows and
+    `columns` (repeatable, comma separated) the columns returned. With the
+    relational layout, `table` picks the table (the root table by default).
+    """
+    session_data = session_store().get(session_id)
+    if session_data is None:
+        return {'error': 'Session expired or invalid'}, 404
+    path, header, total_rows = session_data['df_path'], session_data['df_columns'], session_data['df_shape'][0]
+    if 'table' in request.args:
+        tables = {table['name']: table for table in session_data.get('tables') or []}
+        table = tables.get(request.args['table'])
+        if table is None:
+            return {'error': f"Unknown table '{request.args['table']}'"}, 404
+        path, header, total_rows = table['path'], table['columns'], table['rows']
+    try:
+        offset = int(request.args.get('offset', 0))
+        limit = int(request.args.get('limit', 100))
+    except ValueError:
+        return {'error': 'offset and limit must be integers'}, 400
+    if offset < 0 or limit < 0:
+        return {'error': 'offset and limit must not be negative'}, 400
+    limit = min(limit, app.config['PREVIEW_PAGE_ROWS'])
+    
+    known = set(header)
+    columns = []
+    for value in request.args.getlist('columns'):
+        columns.extend([value] if value in known else [name for name in value.split(',') if name])
+    unknown = [name for name in columns if name not in known]
+    if unknown:
+        return {'error': f"Unknown columns: {', '.join(unknown)}"}, 400
+    
+    rows = []
+    if offset < total_rows and limit:
+        try:
+            rows = read_artifact_page(path, session_data.get('artifact_format', 'csv'),
+                                      header, offset, limit, columns or None,
+                                      session_data.get('artifact_compression'))
+        except Exception as e:
+            return {'error': str(e)}, 500
+    return {
+        'offset': offset,
+        'limit': limit,
+        'total_rows': total_rows,
+        'columns': columns or header,
+        'rows': [list(row) for row in rows]
+    }
+
+@app.route('/convert', methods=['POST'])
+def convert_file():
+    upload = open_upload()
+    if upload is None or not upload.filename:
         flash('No file selected')
         return redirect(url_for('index'))
     
-    if file and allowed_file(file.filename):
+    if allowed_file(upload.filename):
         try:
-            # Read file content
-            json_content = file.read().decode('utf-8')
-            
             # Check file size and warn user
-            file_size = len(json_content)
-            if file_size > 50 * 1024 * 1024:  # 50MB
+            if (request.content_length or 0) > 50 * 1024 * 1024:  # 50MB
                 flash('Large file detected. Processing may take a moment...')
             
-            # Parse JSON with optimizations for large files
-            json_data = parse_large_json_file(json_content)
-            
-            # Process in chunks and combine results
-            all_columns = set()
-            chunk_files = []
-            total_rows = 0
-            
-            # First pass: collect all columns and save chunks
-            for chunk_df in process_json_chunks(json_data):
-                if not chunk_df.empty:
-                    all_columns.update(chunk_df.columns)
-                    total_rows += len(chunk_df)
-                    
-                    # Save chunk to temporary file
-                    with tempfile.NamedTemporaryFile(delete=False, suffix='.csv', mode='w', encoding='utf-8', newline='') as tmp_file:
-                        chunk_df.to_csv(tmp_file, index=False)
-                        chunk_files.append(tmp_file.name)
-            
-            # Create final combined file with consistent columns
-            combined_file = tempfile.NamedTemporaryFile(delete=False, suffix='.csv', mode='w', encoding='utf-8', newline='')
-            combined_file_path = combined_file.name
-            all_columns = sorted(list(all_columns))
-            
-            # Write header
-            writer = csv.writer(combined_file)
-            writer.writerow(all_columns)
-            combined_file.close()  # Close before appending
-            
-            # Combine all chunks with consistent columns
-            for chunk_file in chunk_files:
-                try:
-                    if os.path.exists(chunk_file):
-                        chunk_df = pd.read_csv(chunk_file)
-                        # Reindex to ensure all columns are present
-                        chunk_df = chunk_df.reindex(columns=all_columns, fill_value='')
-                        # Write chunk data to combined file
-                        with open(combined_file_path, 'a', encoding='utf-8', newline='') as f:
-                            chunk_df.to_csv(f, header=False, index=False)
-                        
-                        # Clean up chunk file after successful read
-                        os.unlink(chunk_file)
-                    gc.collect()
-                except Exception as chunk_error:
-                    # Log the error but continue processing
-                    print(f"Error processing chunk file {chunk_file}: {chunk_error}")
-                    # Try to clean up the problematic chunk file
-                    try:
-                        if os.path.exists(chunk_file):
-                            os.unlink(chunk_file)
-                    except:
-                        pass
-            
-            # Create preview from the combined file
-            try:
-                preview_df = pd.read_csv(combined_file_path, nrows=20)
-                preview_rows = min(20, len(preview_df))
-            except Exception as preview_error:
-                # Fallback: create empty preview
-                preview_df = pd.DataFrame(columns=all_columns)
-                preview_rows = 0
-            
-            # Store session data
-            session_id = str(uuid.uuid4())
-            session_data = {
-                'df_path': combined_file_path,
-                'original_filename': secure_filename(file.filename),
-                'output_format': output_format,
-                'df_shape': (total_rows, len(all_columns)),
-                'df_columns': all_columns
-            }
-            
-            preview_data = {
-                'df_html': preview_df.head(preview_rows).to_html(classes='table table-striped', table_id='preview-table', escape=False),
-                'total_rows': total_rows,
-                'total_columns': len(all_columns),
-                'columns': all_columns,
-                'original_filename': secure_filename(file.filename),
-                'output_format': output_format,
-                'session_id': session_id,
-                'is_large_file': total_rows > 10000
-            }
-            
-            # Store in cache
-            if not hasattr(app, 'preview_cache'):
-                app.preview_cache = {}
-            app.preview_cache[session_id] = session_data
-            
-            return render_template('preview.html', **preview_data)
+            session_id, session_data, preview_rows = convert_upload(upload)
+            return render_preview(session_id, session_data, preview_rows)
                 
-        except json.JSONDecodeError as e:
+        except (json.JSONDecodeError, InvalidJSONError) as e:
             flash(f'Invalid JSON file: {str(e)}')
         except MemoryError:
             flash('File too large to process. Please try a smaller file or contact support.')
@@ -334,121 +639,438 @@ def convert_file():
     
     return redirect(url_for('index'))
 
+def release_session(session_id):
+    """Called once a download has been sent: keep the session for the
+    download grace period, so an interrupted transfer can resume with a
+    Range request, then let the store delete its files"""
+    try:
+        session_store().expire_in(session_id, app.config['DOWNLOAD_GRACE_SECONDS'])
+    except Exception as cleanup_error:
+        print(f"Cleanup error: {cleanup_error}")
+
+def session_files(session_data):
+    return [*result_files(session_data), *session_data.get('derived', {}).values()]
+
+def derived_artifact(session_id, session_data, output_format):
+    """Path of the session's output re-encoded as csv / parquet / arrow.
+    The file is made once and kept with the session, so repeat and resumed
+    downloads are served from disk as well."""
+    path = session_data.get('derived', {}).get(output_format)
+    if path and os.path.exists(path):
+        return path
+    with tempfile.NamedTemporaryFile(delete=False, suffix=OUTPUT_EXTENSIONS[output_format]) as tmp_file:
+        path = tmp_file.name
+    try:
+        convert_artifact(session_data['df_path'], session_data.get('artifact_format', 'csv'), path, output_format,
+                         session_data.get('artifact_compression'), session_data.get('df_types'))
+    except BaseException:
+        remove_files(path)
+        raise
+    session_data.setdefault('derived', {})[output_format] = path
+    session_store().update(session_id, session_data, files=session_files(session_data))
+    return path
+
+def iter_table_bundle(session_data, output_format):
+    """Bytes of every table of a relational session: an xlsx workbook with
+    a sheet per table, else a zip with a file per table in `output_format`
+    (see engine.iter_table_bundle)"""
+    return engine.iter_table_bundle(session_data['tables'], session_data.get('artifact_format', 'csv'),
+                                    output_format, session_data.get('artifact_compression'),
+                                    app.config['EXCEL_SHEET_ROWS'])
+
+def download_compression(default=None, stored=None):
+    """Compression for a text download and whether it is a Content-Encoding.
+    An explicit `compression` query option (or the session's `default`)
+    gives a compressed file such as `.csv.gz`. Otherwise a file stored
+    compressed (`stored`) is sent as it is, with a Content-Encoding, to a
+    client whose Accept-Encoding allows it, and any other file is sent
+    plain. Nothing is compressed on the fly unless asked for, so a plain
+    file keeps its Content-Length and Range support (see send_text_file).
+    Returns (compression, content_encoding)
+    """
+    if 'compression' in request.args:
+        return compression_option(request.args['compression']), False
+    if default is not None:
+        return default, False
+    if stored is not None and request.accept_encodings[stored]:
+        return stored, True
+    return None, False
+
+def send_text_file(path, stored, compression, content_encoding, download_name, mimetype):
+    """Send a text artifact stored with compression `stored` as `compression`.
+    A file already stored that way is sent as is (with Range support);
+    anything else is re-encoded chunk by chunk while it is sent.
+    """
+    if compression is not None and not content_encoding:
+        download_name += COMPRESSION_SUFFIXES[compression]
+        mimetype = COMPRESSION_MIMETYPES[compression]
+    if compression == stored:
+        response = send_file(path, as_attachment=True, download_name=download_name,
+                             mimetype=mimetype, conditional=True)
+    else:
+        response = Response(iter_encoded(path, stored, compression), mimetype=mimetype)
+        response.headers['Content-Disposition'] = f'attachment; filename={download_name}'
+    if content_encoding:
+        response.headers['Content-Encoding'] = compression
+    if stored is not None:
+        response.vary.add('Accept-Encoding')
+    return response
+
+@app.route('/quarantine/<session_id>')
+def download_quarantine(session_id):
+    """Download the JSON Lines records that failed to parse, as uploaded"""
+    session_data = session_store().get(session_id)
+    if not session_data or not session_data.get('quarantine_path'):
+        flash('No quarantined records for this session')
+        return redirect(url_for('index'))
+    base_name = os.path.splitext(session_data['original_filename'])[0]
+    try:
+        compression, content_encoding = download_compression()
+    except InvalidOptionError as e:
+        flash(str(e))
+        return redirect(url_for('index'))
+    return send_text_file(session_data['quarantine_path'], None, compression, content_encoding,
+                          f"{base_name}_invalid_lines.jsonl", 'application/x-ndjson')
+
 @app.route('/download/<session_id>')
 def download_file(session_id):
-    if not hasattr(app, 'preview_cache') or session_id not in app.preview_cache:
+    session_data = session_store().get(session_id)
+    if session_data is None:
         flash('Session expired or invalid')
         return redirect(url_for('index'))
     
-    session_data = app.preview_cache[session_id]
-    
     try:
         # Generate output filename
         base_name = os.path.splitext(session_data['original_filename'])[0]
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        output_format = session_data['output_format']
+        output_format = request.args.get('output_format', session_data['output_format'])
+        if output_format not in OUTPUT_FORMATS:
+            flash(f'Unsupported output format: {output_format}')
+            return redirect(url_for('index'))
+        artifact_format = session_data.get('artifact_format', 'csv')
+        output_filename = f"{base_name}_converted_{timestamp}{OUTPUT_EXTENSIONS[output_format]}"
         
-        if output_format == 'csv':
-            # For CSV, stream the file directly
-            output_filename = f"{base_name}_converted_{timestamp}.csv"
-            
-            def generate_csv():
-                with open(session_data['df_path'], 'r', encoding='utf-8') as f:
-                    for line in f:
-                        yield line.encode('utf-8')
-            
-            # Clean up
-            try:
-                if os.path.exists(session_data['df_path']):
-                    os.unlink(session_data['df_path'])
-                if session_id in app.preview_cache:
-                    del app.preview_cache[session_id]
-            except Exception as cleanup_error:
-                print(f"Cleanup error: {cleanup_error}")
-                pass
+        if session_data.get('tables'):
+            # Relational layout: all tables in one workbook, or one zip of files
+            extension = '.xlsx' if output_format == 'excel' else '.zip'
+            def generate_bundle():
+                try:
+                    yield from iter_table_bundle(session_data, output_format)
+                finally:
+                    release_session(session_id)
             
             return Response(
-                generate_csv(),
-                mimetype='text/csv',
-                headers={'Content-Disposition': f'attachment; filename={output_filename}'}
+                generate_bundle(),
+                mimetype=OUTPUT_MIMETYPES['excel'] if output_format == 'excel' else 'application/zip',
+                headers={'Content-Disposition': f'attachment; filename={base_name}_tables_{timestamp}{extension}'}
             )
+        elif output_format == 'csv':
+            # Compressed on request (option or Accept-Encoding), re-encoding
+            # the stored file on the fly unless it is already stored that way
+            if output_format == artifact_format:
+                path, stored = session_data['df_path'], session_data.get('artifact_compression')
+            else:
+                path, stored = derived_artifact(session_id, session_data, output_format), None
+            compression, content_encoding = download_compression(session_data.get('compression'), stored)
+            response = send_text_file(path, stored, compression, content_encoding, output_filename,
+                                      OUTPUT_MIMETYPES['csv'])
+            response.call_on_close(lambda: release_session(session_id))
+            return response
+        elif output_format != 'excel':
+            # Materialized file: sent by the server (sendfile / X-Sendfile when
+            # available) with Content-Length, ETag and Range support
+            if output_format == artifact_format:
+                path = session_data['df_path']
+            else:
+                path = derived_artifact(session_id, session_data, output_format)
+            response = send_file(
+                path,
+                as_attachment=True,
+                download_name=output_filename,
+                mimetype=OUTPUT_MIMETYPES[output_format],
+                conditional=True
+            )
+            response.call_on_close(lambda: release_session(session_id))
+            return response
         else:
-            # For Excel, we need to load and convert (less memory efficient)
-            output_filename = f"{base_name}_converted_{timestamp}.xlsx"
-            
-            # Read in chunks and write to Excel
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx') as tmp_file:
-                # For very large files, we'll need to read in chunks
-                chunk_reader = pd.read_csv(session_data['df_path'], chunksize=5000)
-                
-                with pd.ExcelWriter(tmp_file.name, engine='openpyxl') as writer:
-                    start_row = 0
-                    for chunk in chunk_reader:
-                        chunk.to_excel(writer, sheet_name='Sheet1', startrow=start_row, 
-                                     header=(start_row == 0), index=False)
-                        start_row += len(chunk)
-                        gc.collect()
-                
-                # Clean up
+            # For Excel, stream the workbook to the client as it is produced
+            def generate_xlsx():
                 try:
-                    if os.path.exists(session_data['df_path']):
-                        os.unlink(session_data['df_path'])
-                    if session_id in app.preview_cache:
-                        del app.preview_cache[session_id]
-                except Exception as cleanup_error:
-                    print(f"Cleanup error: {cleanup_error}")
-                    pass
-                
-                return send_file(
-                    tmp_file.name,
-                    as_attachment=True,
-                    download_name=output_filename,
-                    mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-                )
+                    yield from iter_xlsx(
+                        session_data['df_columns'],
+                        iter_artifact_rows(session_data['df_path'], artifact_format,
+                                           compression=session_data.get('artifact_compression'),
+                                           types=session_data.get('df_types')),
+                        sheet_rows=app.config['EXCEL_SHEET_ROWS'])
+                finally:
+                    release_session(session_id)
+            
+            return Response(
+                generate_xlsx(),
+                mimetype=OUTPUT_MIMETYPES['excel'],
+                headers={'Content-Disposition': f'attachment; filename={output_filename}'}
+            )
                 
     except Exception as e:
         flash(f'Error generating download: {str(e)}')
         return redirect(url_for('index'))
 
+def streamed_response(upload):
+    """The upload converted straight into the response body (chunked), rows
+    sent as soon as they are flattened; nothing is written to disk and no
+    session is kept. Options must precede the file part, and only the
+    single-pass conversion applies: sampled schema, wide layout, no batch,
+    no quarantine and no Parquet or Arrow output. Errors in the header sample raise here; a later bad
+    record aborts the response, leaving the chunked body unterminated."""
+    settings = conversion_settings(upload)
+    if settings['batch'] is not None or settings['layout'] != 'wide':
+        raise InvalidOptionError("stream=1 converts a single file with the wide layout")
+    if settings['schema_mode'] != 'sample':
+        raise InvalidOptionError("stream=1 writes rows as they are read, so it needs schema_mode=sample")
+    if settings['on_error'] == 'quarantine':
+        raise InvalidOptionError("stream=1 cannot keep quarantined lines; use on_error=skip")
+    output_format = settings['requested_format'] or 'csv'
+    if output_format in COLUMNAR_FORMATS:
+        raise InvalidOptionError(f"stream=1 writes no temporary files, and {output_format} output is typed over "
+                                 "the whole input, so it cannot be streamed; leave out stream=1")
+    compression = None
+    if output_format == 'csv':
+        compression, _ = download_compression(settings['compression'])
+    chunks = engine.iter_converted(upload.stream, output_format, compression, app.config['STREAM_WINDOW'],
+                                   settings['flattening'], settings['record_path'],
+                                   LineErrors(settings['on_error']))
+    first = next(chunks)
+
+    def generate():
+        yield first
+        yield from chunks
+        finish_upload(upload)
+
+    base_name = os.path.splitext(secure_filename(upload.filename))[0] or 'converted'
+    download_name = f"{base_name}{OUTPUT_EXTENSIONS[output_format]}"
+    mimetype = OUTPUT_MIMETYPES[output_format]
+    if compression is not None:
+        download_name += COMPRESSION_SUFFIXES[compression]
+        mimetype = COMPRESSION_MIMETYPES[compression]
+    response = Response(stream_with_context(generate()), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename={download_name}'
+    return response
+
 @app.route('/api/convert', methods=['POST'])
 def api_convert():
-    """API endpoint for programmatic conversion"""
+    """API endpoint for programmatic conversion.
+    Converts the upload and returns its shape plus a download link, or with
+    `stream=1` the converted file itself (see streamed_response).
+    """
     try:
-        if 'file' not in request.files:
+        upload = open_upload()
+        if upload is None or not upload.filename:
             return {'error': 'No file provided'}, 400
         
-        file = request.files['file']
-        output_format = request.form.get('output_format', 'csv')
+        if not allowed_file(upload.filename):
+            return {'error': 'Invalid file format'}, 400
+        
+        if request.args.get('stream') in ('1', 'true'):
+            return streamed_response(upload)
+        
+        session_id, session_data, _ = convert_upload(upload)
+        total_rows, total_columns = session_data['df_shape']
+        
+        result = {
+            'status': 'success',
+            'rows': total_rows,
+            'columns': total_columns,
+            'column_names': session_data['df_columns'],
+            'column_types': session_data['df_types'],
+            'output_format': session_data['output_format'],
+            'compression': session_data['compression'],
+            'cached': session_data['cached'],
+            'invalid_lines': session_data['invalid_lines'],
+            'errors': session_data['error_samples'],
+            'session_id': session_id,
+            'download_url': url_for('download_file', session_id=session_id)
+        }
+        if session_data['tables']:
+            result['tables'] = [{'name': table['name'], 'rows': table['rows'], 'column_names': table['columns'],
+                                 'column_types': table.get('types')}
+                                for table in session_data['tables']]
+        if session_data.get('sources') is not None:
+            result['sources'] = session_data['sources']
+        if session_data['quarantine_path']:
+            result['quarantine_url'] = url_for('download_quarantine', session_id=session_id)
+        return result
         
-        if not allowed_file(file.filename):
+    except (json.JSONDecodeError, InvalidJSONError) as e:
+        return {'error': f'Invalid JSON file: {str(e)}'}, 400
+    except InvalidOptionError as e:
+        return {'error': str(e)}, 400
+    except Exception as e:
+        return {'error': str(e)}, 500
+
+def job_runner():
+    """The app's JobRunner, started on first use from the current config"""
+    runner = app.extensions.get('job_runner')
+    if runner is None:
+        runner = app.extensions['job_runner'] = JobRunner(
+            workers=app.config['JOB_WORKERS'], max_pending=app.config['MAX_PENDING_JOBS'],
+            store=session_store())
+    return runner
+
+def run_job(spool_path, digest, settings, filename, output_format, progress):
+    """Background half of a job: convert the spooled upload (or the files
+    of a spooled archive) into a session"""
+    if settings['batch'] is not None:
+        with open(spool_path, 'rb') as source:
+            inputs = iter_archive(counting(source, progress.add_bytes), filename)
+            result, cache_hit = convert_batch(inputs, settings, progress), False
+    else:
+        result, cache_hit = convert_path(spool_path, settings, digest, progress)
+    session_id, session_data = register_session(result, settings, filename, output_format, cache_hit)
+    return {'session_id': session_id, 'session_data': session_data, 'preview_rows': result['preview_rows']}
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """Spool an upload and convert it in the background.
+    Returns 202 with the job id and the URL to poll for progress.
+    """
+    try:
+        upload = open_upload()
+        if upload is None or not upload.filename:
+            return {'error': 'No file provided'}, 400
+        
+        if not allowed_file(upload.filename):
             return {'error': 'Invalid file format'}, 400
         
-        # Read and parse JSON
-        json_content = file.read().decode('utf-8')
-        json_data = parse_large_json_file(json_content)
+        settings = conversion_settings(upload)
+        if settings['batch'] is not None and not is_archive(upload.filename):
+            return {'error': 'Send several files to /convert or /api/convert, or one archive here'}, 400
+        with tempfile.NamedTemporaryFile(delete=False, suffix='.json') as spool:
+            digest = copy_hashed(upload.stream, spool)
+        try:
+            output_format = final_output_format(finish_upload(upload), settings)
+            passes = 2 if settings['schema_mode'] == 'spooled' and settings['batch'] is None else 1
+            job = job_runner().submit(
+                run_job, spool.name, digest if result_cache() is not None else None, settings,
+                upload.filename, output_format,
+                progress=Progress(os.path.getsize(spool.name), passes),
+                cleanup=lambda: remove_files(spool.name))
+        except BaseException:
+            remove_files(spool.name)
+            raise
         
-        # Quick analysis without full processing
-        total_rows = 0
-        columns = set()
+        return {
+            'job_id': job.id,
+            'state': job.state,
+            'status_url': url_for('job_status', job_id=job.id)
+        }, 202
         
-        for chunk_df in process_json_chunks(json_data):
-            if not chunk_df.empty:
-                columns.update(chunk_df.columns)
-                total_rows += len(chunk_df)
-                # Only process first few chunks for API response
-                if total_rows > 10000:
-                    break
+    except JobsBusyError as e:
+        return {'error': f'Server busy: {str(e)}. Please retry shortly.'}, 503
+    except InvalidOptionError as e:
+        return {'error': str(e)}, 400
+    except Exception as e:
+        return {'error': str(e)}, 500
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Progress of a background job, plus preview and download links once done"""
+    job = job_runner().get(job_id)
+    if job is None:
+        return {'error': 'Unknown or expired job'}, 404
+    
+    status = {
+        'job_id': job['id'],
+        'state': job['state'],
+        'progress': job['progress']
+    }
+    if job['state'] == 'failed':
+        status['error'] = job['error']
+    elif job['state'] == 'done':
+        session_id = job['result']['session_id']
+        session_data = job['result']['session_data']
+        total_rows, total_columns = session_data['df_shape']
+        status.update({
+            'session_id': session_id,
+            'rows': total_rows,
+            'columns': total_columns,
+            'cached': session_data['cached'],
+            'invalid_lines': session_data['invalid_lines'],
+            'preview_url': url_for('job_preview', job_id=job['id']),
+            'download_url': url_for('download_file', session_id=session_id)
+        })
+        if session_data['quarantine_path']:
+            status['quarantine_url'] = url_for('download_quarantine', session_id=session_id)
+    return status
+
+@app.route('/jobs/<job_id>/preview')
+def job_preview(job_id):
+    job = job_runner().get(job_id)
+    if job is None or job['state'] != 'done':
+        flash('Conversion not found or not finished')
+        return redirect(url_for('index'))
+    result = job['result']
+    return render_preview(result['session_id'], result['session_data'], result['preview_rows'])
+
+@app.route('/api/sessions')
+def api_sessions():
+    """Session store counters: hits, misses, expirations and evictions"""
+    return session_store().stats()
+
+@app.route('/api/profile', methods=['POST'])
+def api_profile():
+    """Pre-flight check: profile an upload without converting it.
+    Scans the whole input once and returns the exact row count and, per
+    column, its type and null count, plus how fast the scan ran.
+    """
+    try:
+        upload = open_upload()
+        if upload is None or not upload.filename:
+            return {'error': 'No file provided'}, 400
+        
+        if not allowed_file(upload.filename):
+            return {'error': 'Invalid file format'}, 400
+        if is_archive(upload.filename):
+            return {'error': 'Archives cannot be profiled; profile one of their files'}, 400
+        
+        on_error = upload_option(upload, 'on_error', app.config['ON_ERROR'])
+        if on_error not in ERROR_MODES:
+            raise InvalidOptionError(f"Unknown error mode '{on_error}'")
+        # Nothing is kept from a profile, so quarantined lines are just skipped
+        errors = LineErrors('fail' if on_error == 'fail' else 'skip')
+        
+        start = time.perf_counter()
+        flattening = flattening_settings(upload)
+        profiler = ColumnProfiler(flattening.flatten).add_all(
+            flattening.records(iter_records(upload.stream, errors, record_path_option(upload))))
+        finish_upload(upload)
+        elapsed = max(time.perf_counter() - start, 1e-9)
+        column_profiles = profiler.columns()
         
         return {
             'status': 'success',
-            'rows': total_rows,
-            'columns': len(columns),
-            'column_names': sorted(list(columns)),
-            'estimated': total_rows > 10000
+            'rows': profiler.rows,
+            'columns': len(column_profiles),
+            'column_names': [column['name'] for column in column_profiles],
+            'column_profiles': column_profiles,
+            'invalid_lines': errors.count,
+            'errors': [message for _, _, message in errors.samples],
+            'throughput': {
+                'bytes': upload.bytes_read,
+                'seconds': round(elapsed, 3),
+                'rows_per_second': round(profiler.rows / elapsed),
+                'mb_per_second': round(upload.bytes_read / elapsed / 1e6, 2),
+                'backends': backends.active()
+            }
         }
         
+    except (json.JSONDecodeError, InvalidJSONError) as e:
+        return {'error': f'Invalid JSON file: {str(e)}'}, 400
+    except InvalidOptionError as e:
+        return {'error': str(e)}, 400
     except Exception as e:
         return {'error': str(e)}, 500
 
 if __name__ == '__main__':
+    active = backends.active()
+    print(f"JSON backends: {active['lines']} for JSON Lines, ijson {active['stream'] or 'unavailable'} for streaming")
     app.run(host='0.0.0.0', port=5000, debug=True)
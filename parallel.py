@@ -0,0 +1,235 @@
+"""
+Multi-process conversion of JSON Lines files.
+
+JSON Lines records are independent of each other, so a spooled JSONL
+upload can be cut into byte ranges on line boundaries and each range
+parsed and flattened in its own worker process, which reads its lines
+straight out of a memory map of the file. The first pass collects
+the column set of every range and merges them into the final header; the
+second pass turns each range into rows against that header. Ranges are
+written out in their original order, and only a few ranges per worker are
+in flight at once so memory stays bounded by the range size.
+"""
+
+import codecs
+import concurrent.futures
+import csv
+import io
+import itertools
+import mmap
+import os
+from collections import deque
+
+import backends
+from columntypes import ColumnTypes
+from readers import LineErrors, is_document, iter_mapped_lines
+from writers import ROW_INDEX_STRIDE, open_writer
+
+RANGE_BYTES = 8 * 1024 * 1024  # Bytes of input handed to a worker per task
+IN_FLIGHT_PER_WORKER = 2       # Ranges queued or held per worker process
+
+_flatteners = {}  # Per-process cache: (header, flattening) -> CompiledFlattener
+
+
+def split_ranges(path, range_bytes=RANGE_BYTES):
+    """Cut the file at `path` into (start, end) byte ranges of about
+    `range_bytes` each, every range ending just after a newline."""
+    size = os.path.getsize(path)
+    ranges = []
+    with open(path, 'rb') as f:
+        start = 0
+        while start < size:
+            end = start + range_bytes
+            if end < size:
+                f.seek(end)
+                f.readline()
+                end = f.tell()
+            else:
+                end = size
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def is_json_lines(path):
+    """True if the file reads as JSON Lines: it does not open an array and
+    its first non-blank lines do not make it a document (see
+    readers.is_document)."""
+    with open(path, 'rb') as f:
+        lines = (line for line in (line.strip() for line in f) if line)
+        head = next(lines, b'')
+        if head.startswith(codecs.BOM_UTF8):
+            head = head[len(codecs.BOM_UTF8):].strip()
+        return bool(head) and not head.startswith(b'[') and not is_document(head, next(lines, None))
+
+
+class _RangeLines:
+    """The lines of one byte range as (offset, line) pairs, newline
+    included, read straight from a memory map of the file rather than
+    copied out of it in one piece. `newlines` counts the newlines seen."""
+
+    def __init__(self, path, start, end):
+        self.path = path
+        self.start = start
+        self.end = end
+        self.newlines = 0
+
+    def __iter__(self):
+        with open(self.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            offset = self.start
+            if offset == 0 and buffer[:len(codecs.BOM_UTF8)] == codecs.BOM_UTF8:
+                offset = len(codecs.BOM_UTF8)
+            for line in iter_mapped_lines(buffer, offset, self.end):
+                yield offset, line
+                offset += len(line)
+                if line.endswith(b'\n'):
+                    self.newlines += 1
+
+
+def _parse_lines(lines, bad_lines=None, stop_on_error=False):
+    """Yield the records of `lines` ((offset, line) pairs). Bad lines are
+    skipped and, if `bad_lines` is given, recorded there as
+    (line, offset, raw, message) with line numbers relative to the range."""
+    loads = backends.loads
+    for line_num, (offset, raw) in enumerate(lines, 1):
+        line = raw.strip()
+        if line:
+            try:
+                yield loads(line)
+            except ValueError as e:
+                if bad_lines is not None:
+                    bad_lines.append((line_num, offset, raw, str(e)))
+                    if stop_on_error:
+                        return
+
+
+def scan_range(path, start, end, flattening, stop_on_error=False, with_types=False):
+    """Worker task: the column names `flattening` finds in one range, and
+    with `with_types` their types (a ColumnTypes, else None).
+    Returns (keys, types, newline_count, bad_lines)
+    """
+    lines = _RangeLines(path, start, end)
+    bad_lines = []
+    keys = {}
+    types = ColumnTypes() if with_types else None
+    for obj in flattening.records(_parse_lines(lines, bad_lines, stop_on_error)):
+        if with_types:
+            flat = flattening.row(obj)
+            keys.update(dict.fromkeys(flat))
+            types.add_record(flat)
+        else:
+            flattening.keys(obj, keys)
+    return keys, types, lines.newlines, bad_lines
+
+
+def convert_range(path, start, end, header, flattening, encode_csv, max_preview):
+    """Worker task: flatten one range against `header`, skipping bad lines.
+    Returns (payload, row_count, preview_rows) where payload is the rows
+    already CSV-encoded when `encode_csv` is set, as a list of
+    (text, row_count) blocks of at most ROW_INDEX_STRIDE rows so the
+    writer can index them, plus their column types, else the row tuples.
+    """
+    key = (tuple(header), flattening)
+    flattener = _flatteners.get(key)
+    if flattener is None:
+        _flatteners.clear()
+        flattener = _flatteners[key] = flattening.compile(header, fill=None)
+    rows = list(flattener.rows(flattening.records(_parse_lines(_RangeLines(path, start, end)))))
+    preview_rows = rows[:max_preview]
+    if encode_csv:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        blocks = []
+        for i in range(0, len(rows), ROW_INDEX_STRIDE):
+            block = rows[i:i + ROW_INDEX_STRIDE]
+            writer.writerows(block)
+            blocks.append((buffer.getvalue(), len(block)))
+            buffer.seek(0)
+            buffer.truncate()
+        types = ColumnTypes()
+        types.add_rows(header, rows)
+        return (blocks, types), len(rows), preview_rows
+    return rows, len(rows), preview_rows
+
+
+def ordered_results(executor, task, arguments, in_flight):
+    """Submit `task` for each argument tuple, keeping at most `in_flight`
+    pending, and yield the results in submission order."""
+    pending = deque()
+    try:
+        for args in arguments:
+            pending.append(executor.submit(task, *args))
+            if len(pending) >= in_flight:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def parallel_convert(path, combined_file_path, flattening, workers=None, range_bytes=RANGE_BYTES,
+                     window=1000, max_preview=20, artifact_format='csv', compression=None, errors=None,
+                     progress=None):
+    """Convert the JSON Lines file at `path` using a pool of `workers` processes,
+    flattening records as set by `flattening` (a flattener.Flattening, which
+    must not explode arrays). Produces the same header and rows as a
+    sequential two-pass conversion; bad lines are reported to `errors`
+    (a LineErrors) during the first pass.
+    A CSV artifact is compressed with `compression` as it is written.
+    Finished ranges are reported to `progress` (a jobs.Progress) if given.
+    The scan also types every column for a columnar artifact's schema.
+    Returns (total_rows, header, preview_rows, column types)
+    """
+    if errors is None:
+        errors = LineErrors()
+    stop_on_error = errors.mode == 'fail'
+    workers = workers or os.cpu_count() or 1
+    ranges = split_ranges(path, range_bytes)
+    in_flight = workers * IN_FLIGHT_PER_WORKER
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        encode_csv = artifact_format == 'csv'
+        keys = {}
+        types = None if encode_csv else ColumnTypes()
+        line_base = 0
+        scans = ((path, start, end, flattening, stop_on_error, not encode_csv) for start, end in ranges)
+        for (start, end), (range_keys, range_types, newline_count, bad_lines) in zip(
+                ranges, ordered_results(executor, scan_range, scans, in_flight)):
+            if progress is not None:
+                progress.add_bytes(end - start)
+            keys.update(range_keys)
+            if range_types is not None:
+                types.update(range_types)
+            for line_num, offset, raw, message in bad_lines:
+                errors.handle(line_base + line_num, offset, raw, message)
+            line_base += newline_count
+        header = sorted(keys)
+
+        arguments = ((path, start, end, header, flattening, encode_csv, max_preview)
+                     for start, end in ranges)
+        total_rows = 0
+        preview_rows = []
+        writer = open_writer(combined_file_path, header, artifact_format, compression,
+                             None if types is None else types.as_dict())
+        try:
+            for (start, end), (payload, row_count, range_preview) in zip(
+                    ranges, ordered_results(executor, convert_range, arguments, in_flight)):
+                if encode_csv:
+                    blocks, block_types = payload
+                    for text, block_rows in blocks:
+                        writer.write_text(text, block_rows)
+                    writer.types.update(block_types)
+                else:
+                    rows = iter(payload)
+                    for batch in iter(lambda: list(itertools.islice(rows, window)), []):
+                        writer.write_batch(batch)
+                total_rows += row_count
+                if progress is not None:
+                    progress.add_bytes(end - start)
+                    progress.add_rows(row_count)
+                if len(preview_rows) < max_preview:
+                    preview_rows.extend(range_preview[:max_preview - len(preview_rows)])
+        finally:
+            writer.close()
+    return total_rows, header, preview_rows, writer.types.as_dict()
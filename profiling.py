@@ -0,0 +1,87 @@
+"""
+Streaming column profile of JSON records.
+
+Used as a pre-flight check: one pass over the records counts the rows and,
+for every flattened column, how many values of each JSON type it holds
+and the type it is written with in typed outputs (see columntypes.py).
+Memory grows with the number of columns, never with the number of rows.
+"""
+
+from columntypes import ColumnTypes
+
+TYPE_NAMES = {
+    bool: 'boolean',
+    int: 'integer',
+    float: 'float',
+    str: 'string',
+    list: 'array',
+    dict: 'object',
+}
+
+
+def column_type(types):
+    """Summarize the non-null type counts of a column as one type name"""
+    names = set(types)
+    if not names:
+        return 'null'
+    if names == {'integer', 'float'}:
+        return 'float'
+    if len(names) == 1:
+        return names.pop()
+    return 'mixed'
+
+
+class ColumnProfiler:
+    """Accumulate row, type and null counts and the inferred type per column.
+
+    `flatten` turns a record into a flat dict, as for conversion, so the
+    profiled columns are exactly the ones the converted file would have.
+    Non-object records are profiled as a single `value` column. Columns are
+    reported sorted, like the spooled conversion header, or in first-seen
+    order if `sort_columns` is false.
+    """
+
+    def __init__(self, flatten, sort_columns=True):
+        self.flatten = flatten
+        self.sort_columns = sort_columns
+        self.rows = 0
+        self._counts = {}  # column -> {python type: count}
+        self._types = ColumnTypes()
+
+    def add(self, record):
+        flat = self.flatten(record) if isinstance(record, dict) else {'value': record}
+        self.rows += 1
+        counts = self._counts
+        for key, value in flat.items():
+            by_type = counts.get(key)
+            if by_type is None:
+                by_type = counts[key] = {}
+            value_type = type(value)
+            by_type[value_type] = by_type.get(value_type, 0) + 1
+        self._types.add_record(flat)
+
+    def add_all(self, records):
+        for record in records:
+            self.add(record)
+        return self
+
+    def column_names(self):
+        return sorted(self._counts) if self.sort_columns else list(self._counts)
+
+    def columns(self):
+        """Per-column profile dicts in column order"""
+        profile = []
+        for name in self.column_names():
+            types = {}
+            for value_type, count in self._counts[name].items():
+                if value_type is not type(None):
+                    type_name = TYPE_NAMES.get(value_type, 'string')
+                    types[type_name] = types.get(type_name, 0) + count
+            profile.append({
+                'name': name,
+                'type': column_type(types),
+                'inferred_type': self._types[name],
+                'null_count': self.rows - sum(types.values()),
+                'types': types,
+            })
+        return profile
@@ -0,0 +1,623 @@
+"""
+Incremental readers for uploaded JSON / JSON Lines documents.
+
+Nothing in here reads a whole upload into memory: the multipart body is
+decoded straight off the request stream and records are parsed from it
+one at a time. JSON Lines in a file on disk (a spooled upload or a local
+file) are split straight out of a read-only memory map of the file.
+"""
+
+import codecs
+import hashlib
+import io
+import itertools
+import json
+import mmap
+import os
+import re
+import stat
+import tempfile
+try:
+    import ijson
+except Exception:
+    ijson = None
+from werkzeug.sansio.multipart import MultipartDecoder, NeedData, Field, File, Data, Epilogue
+
+import backends
+
+READ_SIZE = 64 * 1024  # Bytes pulled from the socket / file per read
+COPY_SIZE = 1024 * 1024  # Bytes per chunk when copying a stream to disk
+MAP_REPORT_SIZE = 1024 * 1024  # Bytes of a memory map consumed between progress reports
+
+
+class InvalidJSONError(ValueError):
+    """Raised when a streamed document is not valid JSON / JSONL"""
+
+
+class _ReadAdapter(io.RawIOBase):
+    """Expose a ``read(size)`` callable as a raw stream for io.BufferedReader"""
+
+    def __init__(self, read):
+        self._read = read
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self._read(len(buffer))
+        size = len(data)
+        buffer[:size] = data
+        return size
+
+
+class MultipartUpload:
+    """Incremental view of a multipart/form-data request body.
+
+    Form fields are collected into ``form`` as they go past and the first
+    file part named ``file_field`` is exposed as ``stream``, a buffered
+    binary stream that reads directly from the request body; ``next_file()``
+    moves on to the next one. Fields sent after the file part are only
+    available once ``finish()`` is called, and so are the names of file
+    parts passed over without being opened, in ``skipped_files``.
+    """
+
+    def __init__(self, stream, boundary, file_field='file', read_size=READ_SIZE):
+        self._input = stream
+        self._decoder = MultipartDecoder(boundary)
+        self._read_size = read_size
+        self._file_field = file_field
+        self._field = None
+        self._field_data = []
+        self._pending = b''
+        self.form = {}
+        self.filename = None
+        self.skipped_files = []
+        self.bytes_read = 0
+
+        self._events = self._iter_events()
+        for event in self._events:
+            if self._handle(event):
+                break
+        self._chunks = self._file_chunks()
+        self.stream = io.BufferedReader(_ReadAdapter(self._read_file), read_size)
+
+    def _iter_events(self):
+        decoder = self._decoder
+        while True:
+            event = decoder.next_event()
+            if isinstance(event, NeedData):
+                chunk = self._input.read(self._read_size)
+                self.bytes_read += len(chunk)
+                decoder.receive_data(chunk if chunk else None)
+                continue
+            yield event
+            if isinstance(event, Epilogue):
+                return
+
+    def _handle(self, event):
+        """Record form field data; return True when *event* opens the upload"""
+        if isinstance(event, Field):
+            self._field, self._field_data = event.name, []
+        elif isinstance(event, File):
+            self._field = None
+            if event.name == self._file_field:
+                if self.filename is None:
+                    self.filename = event.filename
+                    return True
+                self.skipped_files.append(event.filename)
+        elif isinstance(event, Data) and self._field is not None:
+            self._field_data.append(event.data)
+            if not event.more_data:
+                self.form[self._field] = b''.join(self._field_data).decode('utf-8')
+                self._field = None
+        return False
+
+    def _file_chunks(self):
+        if self.filename is None:
+            return
+        for event in self._events:
+            if isinstance(event, Data):
+                if event.data:
+                    yield event.data
+                if not event.more_data:
+                    return
+
+    def _read_file(self, size):
+        if not self._pending:
+            self._pending = next(self._chunks, b'')
+        data, self._pending = self._pending[:size], self._pending[size:]
+        return data
+
+    def next_file(self):
+        """Skip what is left of the current file part and move ``filename``
+        and ``stream`` on to the next file part named ``file_field``.
+        Returns False, leaving them as they were, when there is none."""
+        for _ in self._chunks:
+            pass
+        previous, self.filename = self.filename, None
+        for event in self._events:
+            if self._handle(event):
+                self._pending = b''
+                self._chunks = self._file_chunks()
+                self.stream = io.BufferedReader(_ReadAdapter(self._read_file), self._read_size)
+                return True
+        self.filename = previous
+        return False
+
+    def finish(self):
+        """Consume the rest of the body and return all collected form fields"""
+        for _ in self._chunks:
+            pass
+        for event in self._events:
+            self._handle(event)
+        return self.form
+
+
+def tee(stream, sink):
+    """Return a buffered stream that copies everything read from *stream* to *sink*"""
+    def read(size):
+        data = stream.read(size)
+        sink.write(data)
+        return data
+    return io.BufferedReader(_ReadAdapter(read), READ_SIZE)
+
+
+def copy_hashed(stream, sink, algorithm='sha256'):
+    """Copy *stream* to *sink* and return the hex digest of the bytes copied"""
+    hasher = hashlib.new(algorithm)
+    while True:
+        data = stream.read(COPY_SIZE)
+        if not data:
+            return hasher.hexdigest()
+        hasher.update(data)
+        sink.write(data)
+
+
+class _CountingRaw(io.RawIOBase):
+    """Raw stream over *stream* that reports the size of every read"""
+
+    def __init__(self, stream, callback):
+        self._stream = stream
+        self._callback = callback
+        name = getattr(stream, 'name', None)
+        if isinstance(name, str):
+            self.name = name
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self._stream.read(len(buffer))
+        size = len(data)
+        buffer[:size] = data
+        self._callback(size)
+        return size
+
+    def fileno(self):
+        return self._stream.fileno()
+
+    def count_to(self, position):
+        """Report the bytes up to `position` as read, when they were
+        consumed some other way (e.g. through a memory map of the file)"""
+        skipped = position - self._stream.tell()
+        if skipped > 0:
+            self._stream.seek(position)
+            self._callback(skipped)
+
+    def seekable(self):
+        return self._stream.seekable()
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self._stream.seek(offset, whence)
+
+    def tell(self):
+        return self._stream.tell()
+
+
+def counting(stream, callback):
+    """Return a buffered stream over *stream* that passes the number of
+    bytes of each read to *callback*; seekable if *stream* is"""
+    return io.BufferedReader(_CountingRaw(stream, callback), READ_SIZE)
+
+
+def map_file(stream):
+    """Read-only memory map of the whole regular file behind `stream` (an
+    open binary file, or a counting() wrapper of one), or None if there is
+    none to map: a socket or pipe, an in-memory stream, an empty file"""
+    try:
+        if not stream.seekable():
+            return None
+        fd = stream.fileno()
+        info = os.fstat(fd)
+        if not stat.S_ISREG(info.st_mode) or info.st_size == 0:
+            return None
+        return mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+    except (AttributeError, OSError, ValueError):  # io.UnsupportedOperation is both
+        return None
+
+
+def iter_mapped_lines(buffer, start=0, end=None, progress=None):
+    """Yield the lines, newline included, of the memory map `buffer` from
+    byte `start` up to `end` (the end of the map by default), which must
+    fall just after a newline. `progress(position)` is called with the
+    position reached every MAP_REPORT_SIZE bytes and at the end."""
+    buffer.seek(start)
+    readline = buffer.readline
+    if end is None and progress is None:
+        yield from iter(readline, b'')
+        return
+    end = len(buffer) if end is None else end
+    position = start
+    report_at = start + MAP_REPORT_SIZE
+    while position < end:
+        line = readline()
+        position += len(line)
+        yield line
+        if progress is not None and position >= report_at:
+            progress(position)
+            report_at = position + MAP_REPORT_SIZE
+    if progress is not None:
+        progress(position)
+
+
+def _iter_mapped_json_lines(stream, buffer, start, errors, first_line, first_offset):
+    """iter_json_lines over `buffer`, a memory map of the file `stream`
+    reads, from byte `start`; leaves `stream` at the end of the file"""
+    raw = getattr(stream, 'raw', None)
+    progress = raw.count_to if isinstance(raw, _CountingRaw) else None
+    with buffer:
+        yield from iter_json_lines(iter_mapped_lines(buffer, start, progress=progress), errors,
+                                   first_line, first_offset)
+        stream.seek(len(buffer))
+
+
+def drain(stream):
+    """Read *stream* to the end, e.g. to finish filling a tee sink"""
+    while stream.read(READ_SIZE):
+        pass
+
+
+def _peekable(stream):
+    if hasattr(stream, 'peek'):
+        return stream
+    return io.BufferedReader(_ReadAdapter(stream.read), READ_SIZE)
+
+
+def _prepend(data, stream):
+    """Return a buffered stream that yields `data` and then the rest of `stream`"""
+    def read(size):
+        nonlocal data
+        if data:
+            chunk, data = data[:size], data[size:]
+            return chunk
+        return stream.read(size)
+    return io.BufferedReader(_ReadAdapter(read), READ_SIZE)
+
+
+def _first_byte(stream):
+    """Skip a UTF-8 BOM and leading whitespace.
+    Returns (next byte, bytes skipped, newlines skipped)
+    """
+    skipped = newlines = 0
+    while True:
+        data = stream.peek(READ_SIZE)
+        if not data:
+            return b'', skipped, newlines
+        if data.startswith(codecs.BOM_UTF8):
+            skipped += len(stream.read(len(codecs.BOM_UTF8)))
+            continue
+        stripped = data.lstrip()
+        whitespace = stream.read(len(data) - len(stripped))
+        skipped += len(whitespace)
+        newlines += whitespace.count(b'\n')
+        if stripped:
+            return stripped[:1], skipped, newlines
+
+
+ERROR_MODES = ('fail', 'skip', 'quarantine')
+
+
+class LineErrors:
+    """What to do with JSON Lines records that fail to parse.
+
+    'fail' raises InvalidJSONError on the first bad line, 'skip' drops bad
+    lines and 'quarantine' also copies them verbatim to the binary file
+    `quarantine`. Skipped lines are counted in ``count`` and the first
+    `max_samples` are kept in ``samples`` as (line, byte offset, message).
+    """
+
+    def __init__(self, mode='fail', quarantine=None, max_samples=20):
+        if mode not in ERROR_MODES:
+            raise ValueError(f"Unknown error mode '{mode}'")
+        if mode == 'quarantine' and quarantine is None:
+            raise ValueError("Quarantine mode needs a quarantine file")
+        self.mode = mode
+        self.quarantine = quarantine
+        self.max_samples = max_samples
+        self.count = 0
+        self.samples = []
+
+    def handle(self, line_num, offset, raw, error):
+        """Deal with one bad line; raises in 'fail' mode"""
+        message = f"Invalid JSON on line {line_num} (byte offset {offset}): {error}"
+        if self.mode == 'fail':
+            raise InvalidJSONError(message)
+        self.count += 1
+        if len(self.samples) < self.max_samples:
+            self.samples.append((line_num, offset, message))
+        if self.quarantine is not None:
+            self.quarantine.write(raw if raw.endswith(b'\n') else raw + b'\n')
+
+
+def iter_json_lines(stream, errors=None, first_line=1, first_offset=0):
+    """Yield one record per non-blank line of a binary JSON Lines stream
+    (or any iterable of byte lines).
+    Reads a line at a time, so memory does not grow with the file, and
+    parses it with the selected backend (backends.loads). Bad lines go to
+    `errors` (a LineErrors, fail-fast by default); `first_line` and
+    `first_offset` position the stream within the original file.
+    """
+    if errors is None:
+        errors = LineErrors()
+    loads = backends.loads
+    offset = first_offset
+    for line_num, raw in enumerate(stream, first_line):
+        line = raw.strip()
+        if line:
+            try:
+                record = loads(line)
+            except ValueError as e:
+                errors.handle(line_num, offset, raw, e)
+            else:
+                yield record
+        offset += len(raw)
+
+
+def not_line_delimited(line):
+    """True if the first line of a document shows it is not JSON Lines: the
+    line opens a value that continues on later lines, or holds several
+    concatenated values."""
+    try:
+        json.loads(line)
+    except json.JSONDecodeError as e:
+        return e.pos >= len(line.rstrip()) or e.msg == 'Extra data'
+    except ValueError:
+        return False
+    return False
+
+
+_JSONPATH_STEP = re.compile(r"""\.([^.\[\]'"*]+)|\[\*\]|\['([^']*)'\]|\["([^"]*)"\]""")
+
+
+def record_path_prefix(path):
+    """ijson prefix for a record path given as a simple JSONPath
+    (``$.data.results[*]``, ``$['data']['results'][*]``) or as an ijson
+    prefix (``data.results.item``). Only member names and ``[*]`` are
+    understood. Raises ValueError for anything else.
+    """
+    path = path.strip()
+    if not path.startswith('$'):
+        return path
+    parts = []
+    pos = 1
+    while pos < len(path):
+        match = _JSONPATH_STEP.match(path, pos)
+        if match is None:
+            raise ValueError(f"Unsupported record path '{path}': only $, .name, ['name'] and [*] are allowed")
+        if match.group(0) == '[*]':
+            parts.append('item')
+        else:
+            name = next(g for g in match.groups() if g is not None)
+            if '.' in name:
+                raise ValueError(f"Unsupported record path '{path}': member names cannot contain '.'")
+            parts.append(name)
+        pos = match.end()
+    return '.'.join(parts)
+
+
+def detect_record_path(stream):
+    """ijson prefix of the array of objects with the most items in a
+    document that is one JSON object acting as a wrapper, e.g.
+    ``data.results.item`` for ``{"meta": {...}, "data": {"results": [...]}}``.
+    Arrays are looked for through nested objects but not inside other
+    arrays; ties go to the first. The object is only a wrapper if, at every
+    level down to that array, everything beside the path is an object
+    (metadata such as ``meta`` or ``links``): a scalar or another array
+    next to it may be a field of the record itself, which would be lost,
+    so then the document stays one record. Reads `stream` to the end and
+    returns None if the document is not a single object or not a wrapper.
+    """
+    counts = {}
+    children = {}  # object prefix -> {child prefix: 'map' / 'array' / 'scalar'}
+    containers = []  # ('map' / 'array', prefix) for each open container
+    values = 0
+    try:
+        for prefix, event, _ in backends.ijson.parse(stream, multiple_values=True):
+            if event == 'map_key':
+                continue
+            if not containers:
+                values += 1
+                if values > 1 or event != 'start_map':
+                    return None
+            in_array = any(kind == 'array' for kind, _ in containers)
+            if containers and containers[-1][0] == 'map' and not in_array and event not in ('end_map', 'end_array'):
+                kind = 'map' if event == 'start_map' else 'array' if event == 'start_array' else 'scalar'
+                children.setdefault(containers[-1][1], {})[prefix] = kind
+            if event in ('start_map', 'start_array'):
+                if event == 'start_array' and not in_array:
+                    counts.setdefault(prefix + '.item', 0)
+                elif (event == 'start_map' and containers[-1:] and containers[-1][0] == 'array'
+                      and not any(kind == 'array' for kind, _ in containers[:-1]) and prefix in counts):
+                    counts[prefix] += 1
+                containers.append((event[6:], prefix))
+            elif event in ('end_map', 'end_array'):
+                containers.pop()
+    except ijson.JSONError as e:
+        raise InvalidJSONError(f"Invalid JSON: {e}") from e
+    best = max(counts.values(), default=0)
+    if not best:
+        return None
+    found = next(prefix for prefix, count in counts.items() if count == best)
+    parent = ''
+    for part in found[:-len('.item')].split('.'):
+        path = f"{parent}.{part}" if parent else part
+        if any(kind != 'map' for child, kind in children.get(parent, {}).items() if child != path):
+            return None
+        parent = path
+    return found
+
+
+def _select(value, parts):
+    """Values of an already parsed document at ijson prefix `parts`"""
+    if not parts:
+        yield value
+    elif parts[0] == 'item' and isinstance(value, list):
+        for item in value:
+            yield from _select(item, parts[1:])
+    elif isinstance(value, dict) and parts[0] in value:
+        yield from _select(value[parts[0]], parts[1:])
+
+
+def _iter_prefix(stream, prefix):
+    """Values at ijson `prefix` in every JSON value of `stream`"""
+    if backends.ijson is not None:
+        try:
+            yield from backends.ijson.items(stream, prefix, multiple_values=True, use_float=True)
+        except ijson.JSONError as e:
+            raise InvalidJSONError(f"Invalid JSON: {e}") from e
+        return
+    try:
+        document = json.load(stream)
+    except json.JSONDecodeError as e:
+        raise InvalidJSONError(f"Invalid JSON: {e}") from e
+    yield from _select(document, prefix.split('.') if prefix else [])
+
+
+def _iter_detected(stream):
+    """Records of a document read as concatenated JSON values, or, if it is
+    a single object, of its largest array of objects (detect_record_path).
+    The document is read twice, from a spool if `stream` cannot seek."""
+    if stream.seekable():
+        start = stream.tell()
+        prefix = detect_record_path(stream)
+        stream.seek(start)
+        yield from _iter_prefix(stream, prefix or '')
+        return
+    with tempfile.TemporaryFile() as spool:
+        teed = tee(stream, spool)
+        prefix = detect_record_path(teed)
+        drain(teed)
+        spool.seek(0)
+        yield from _iter_prefix(spool, prefix or '')
+
+
+def _peek_line(stream):
+    """The next non-blank line of `stream`, stripped (None at the end), and
+    the stream to go on reading from, which still starts with that line"""
+    if stream.seekable():
+        start = stream.tell()
+        line = next((raw for raw in iter(stream.readline, b'') if raw.strip()), None)
+        stream.seek(start)
+        return line and line.strip(), stream
+    consumed = []
+    for raw in iter(stream.readline, b''):
+        consumed.append(raw)
+        if raw.strip():
+            return raw.strip(), _prepend(b''.join(consumed), stream)
+    return None, _prepend(b''.join(consumed), stream)
+
+
+def _is_value(line):
+    """True if `line` holds exactly one JSON value"""
+    try:
+        backends.loads(line)
+    except ValueError:
+        return False
+    return True
+
+
+def is_document(head, following):
+    """True if an input whose first non-blank line is `head`, followed by
+    the non-blank line `following` (None if there is none), holds JSON
+    documents rather than JSON Lines: its first line is not line delimited
+    (see not_line_delimited) while the next one is no JSON value of its own
+    either, which would make the first a bad JSON Lines record. A single
+    complete line is always JSON Lines."""
+    if following is None:
+        return not_line_delimited(head)
+    return not_line_delimited(head) and not _is_value(following)
+
+
+def _jsonpath(prefix):
+    """The JSONPath of an ijson prefix, e.g. ``$.data.results[*]``"""
+    return '$' + ''.join('[*]' if part == 'item' else f".{part}" for part in prefix.split('.') if part)
+
+
+def _iter_record_path(stream, record_path):
+    """_iter_prefix, raising InvalidJSONError if `record_path` finds nothing"""
+    found = False
+    for record in _iter_prefix(stream, record_path):
+        found = True
+        yield record
+    if not found:
+        raise InvalidJSONError(f"No records found at record path '{_jsonpath(record_path)}'")
+
+
+def iter_records(stream, errors=None, record_path=None):
+    """Yield top-level records from a binary stream of JSON or JSON Lines.
+
+    A document starting with ``[`` yields the items of that array. Otherwise
+    the input is read as JSON Lines, one record per line with bad lines
+    handled by `errors`, unless its first lines show it is not line
+    delimited (see is_document), in which case it is read as concatenated
+    JSON values (e.g. a single pretty-printed object). A single such object
+    that only wraps an array of objects in metadata (see detect_record_path)
+    yields the items of that array instead; any other object is one record.
+    `record_path` (an ijson prefix, see record_path_prefix) selects the
+    records of every document explicitly; InvalidJSONError is raised if it
+    finds none. Uses ijson when available so only one record is
+    materialized at a time. JSON Lines in a regular file are
+    read through a memory map of it (map_file) rather than buffered reads.
+    """
+    if record_path is not None:
+        yield from _iter_record_path(stream, record_path)
+        return
+
+    stream = _peekable(stream)
+    first, skipped, newlines = _first_byte(stream)
+    if not first:
+        return
+
+    if first == b'[':
+        if backends.ijson is not None:
+            try:
+                yield from backends.ijson.items(stream, 'item', use_float=True)
+            except ijson.JSONError as e:
+                raise InvalidJSONError(f"Invalid JSON: {e}") from e
+        else:
+            try:
+                yield from json.load(stream)
+            except json.JSONDecodeError as e:
+                raise InvalidJSONError(f"Invalid JSON: {e}") from e
+        return
+
+    head = stream.readline()
+    if backends.ijson is not None:
+        following, stream = _peek_line(stream)
+        if is_document(head, following):
+            if first == b'{' and stream.seekable():
+                stream.seek(-len(head), io.SEEK_CUR)
+                yield from _iter_detected(stream)
+            elif first == b'{':
+                yield from _iter_detected(_prepend(head, stream))
+            else:
+                yield from _iter_prefix(_prepend(head, stream), '')
+            return
+
+    buffer = map_file(stream)
+    if buffer is not None:
+        yield from _iter_mapped_json_lines(stream, buffer, stream.tell() - len(head), errors,
+                                           newlines + 1, skipped)
+        return
+    lines = itertools.chain([head], stream)
+    yield from iter_json_lines(lines, errors, first_line=newlines + 1, first_offset=skipped)
@@ -0,0 +1,225 @@
+"""
+Relational (multi-table) conversion of nested records.
+
+Instead of widening a row for every item of a nested array, each path that
+holds an array of objects becomes its own table. A record gives one row in
+the root table; every item of one of its arrays of objects gives one row
+in that array's table, which points back at the row it came from. The same
+applies to arrays nested inside those items, at any depth:
+
+    {"id": 1, "order": {"items": [{"sku": "a", "parts": [{"n": 1}]}]}}
+
+    root               _row_id, id
+    order_items        _row_id, _parent_row_id, _position, sku
+    order_items_parts  _row_id, _parent_row_id, _position, n
+
+`_row_id` numbers the rows of each table from 1, `_parent_row_id` is the
+`_row_id` of the parent row in the parent table and `_position` is the
+item's index in its array. Within a table rows are flattened like
+flatten_json with arrays kept as JSON text, so no table grows a column per
+array item. All tables are written in the same pass over the input.
+"""
+
+import itertools
+import os
+import tempfile
+
+from flattener import Flattening
+from writers import ARTIFACT_SUFFIXES, COMPRESSION_SUFFIXES, open_writer, row_index_path
+
+ROOT_TABLE = 'root'
+ROW_ID_COLUMN = '_row_id'
+PARENT_ID_COLUMN = '_parent_row_id'
+POSITION_COLUMN = '_position'
+EXTRA_COLUMN = '_extra'
+LINK_COLUMNS = (ROW_ID_COLUMN, PARENT_ID_COLUMN, POSITION_COLUMN)
+
+_ROW_FLATTENING = Flattening('json')
+
+
+def _is_table(value):
+    # An empty array has no rows to give, so it makes neither rows nor a column
+    return isinstance(value, list) and all(isinstance(item, dict) for item in value)
+
+
+def _strip(node, prefix, sep, children):
+    """Copy of the object `node` without its arrays of objects, which are
+    added to `children` as (key path, items) instead"""
+    row = {}
+    for k, v in node.items():
+        key = f"{prefix}{sep}{k}" if prefix else k
+        if isinstance(v, dict):
+            row[k] = _strip(v, key, sep, children)
+        elif _is_table(v):
+            children.append((key, v))
+        else:
+            row[k] = v
+    return row
+
+
+class RelationalSplitter:
+    """Split records into (table, row) pairs, numbering the rows of each table.
+
+    Rows are still nested objects (minus their arrays of objects) with the
+    link columns added first; link columns replace record keys of the same
+    name. A record that is not an object becomes a root row with a `value`.
+    """
+
+    def __init__(self, sep='_'):
+        self.sep = sep
+        self.row_counts = {}
+
+    def split(self, record):
+        """The rows of one record, each parent before its children"""
+        rows = []
+        self._add(ROOT_TABLE, record if isinstance(record, dict) else {'value': record}, None, None, rows)
+        return rows
+
+    def _add(self, table, node, parent_id, position, rows):
+        children = []
+        row = _strip(node, '', self.sep, children)
+        row_id = self.row_counts[table] = self.row_counts.get(table, 0) + 1
+        links = {ROW_ID_COLUMN: row_id}
+        if parent_id is not None:
+            links[PARENT_ID_COLUMN] = parent_id
+            links[POSITION_COLUMN] = position
+        rows.append((table, {**links, **row, **links}))
+        for key, items in children:
+            child = key if table == ROOT_TABLE else f"{table}{self.sep}{key}"
+            for item_position, item in enumerate(items):
+                self._add(child, item, row_id, item_position, rows)
+
+
+def _header(keys, extra_column=None):
+    """Link columns first, then the other keys sorted"""
+    links = [k for k in LINK_COLUMNS if k in keys]
+    header = links + sorted(k for k in keys if k not in LINK_COLUMNS and k != extra_column)
+    return header + [extra_column] if extra_column else header
+
+
+def relational_columns(records, sep='_'):
+    """Complete header of every table the records produce, for a second
+    pass that needs no `_extra` column. Returns {table: header}"""
+    splitter = RelationalSplitter(sep)
+    keys = {}
+    for record in records:
+        for table, row in splitter.split(record):
+            _ROW_FLATTENING.keys(row, keys.setdefault(table, {}))
+    return {table: _header(table_keys) for table, table_keys in keys.items()}
+
+
+class _Table:
+    """Artifact of one table. Without a known header the first `window`
+    rows are held back to fix it, and keys first seen later go to `_extra`,
+    as in the sampled single-table conversion."""
+
+    def __init__(self, name, path, artifact_format, compression, window, max_preview, header=None):
+        self.name = name
+        self.path = path
+        self.artifact_format = artifact_format
+        self.compression = compression
+        self.window = window
+        self.max_preview = max_preview
+        self.header = header
+        self.rows = 0
+        self.preview_rows = []
+        self._pending = []
+        self._writer = None
+        self._flattener = None
+        if header is not None:
+            self._open()
+
+    def _open(self):
+        if self.header is None:
+            keys = {}
+            for row in self._pending:
+                _ROW_FLATTENING.keys(row, keys)
+            self.header = _header(keys, EXTRA_COLUMN)
+        extra = EXTRA_COLUMN if self.header[-1:] == [EXTRA_COLUMN] else None
+        self._flattener = _ROW_FLATTENING.compile(self.header, fill=None, extra_column=extra)
+        self._writer = open_writer(self.path, self.header, self.artifact_format, self.compression)
+
+    def add(self, row):
+        self._pending.append(row)
+        if len(self._pending) >= self.window:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return 0
+        if self._writer is None:
+            self._open()
+        batch = list(self._flattener.rows(self._pending))
+        self._pending = []
+        self._writer.write_batch(batch)
+        if len(self.preview_rows) < self.max_preview:
+            self.preview_rows.extend(batch[:self.max_preview - len(self.preview_rows)])
+        self.rows += len(batch)
+        return len(batch)
+
+    def close(self):
+        self.flush()
+        if self._writer is None:
+            self._open()
+        self._writer.close()
+
+    def result(self):
+        types = self._writer.types.as_dict() if self._writer is not None else {}
+        return {'name': self.name, 'path': self.path, 'columns': self.header, 'types': types, 'rows': self.rows,
+                'preview_rows': self.preview_rows}
+
+
+def write_tables(records, artifact_format='csv', compression=None, headers=None, window=1000,
+                 max_preview=20, directory=None, sep='_', progress=None):
+    """Split `records` into tables and write each into its own temporary
+    artifact, all in one pass. `headers` ({table: header}, from
+    relational_columns) fixes every table's columns up front; otherwise
+    each table's first `window` rows decide them. Written rows are reported
+    to `progress` (a jobs.Progress).
+    Returns a list of table results (name, path, columns, column types,
+    rows and preview_rows), the root table first and the others in the order they
+    were first seen. The root table is always present.
+    """
+    suffix = ARTIFACT_SUFFIXES[artifact_format] + COMPRESSION_SUFFIXES.get(compression, '')
+    splitter = RelationalSplitter(sep)
+    tables = {}
+
+    def table(name):
+        if name not in tables:
+            fd, path = tempfile.mkstemp(suffix=suffix, dir=directory)
+            os.close(fd)
+            tables[name] = _Table(name, path, artifact_format, compression, window, max_preview,
+                                  None if headers is None else headers.get(name, [ROW_ID_COLUMN]))
+        return tables[name]
+
+    try:
+        table(ROOT_TABLE)
+        for batch in iter(lambda: list(itertools.islice(records, window)), []):
+            for record in batch:
+                for name, row in splitter.split(record):
+                    table(name).add(row)
+            written = sum(t.flush() for t in tables.values())
+            if progress is not None:
+                progress.add_rows(written)
+        for t in tables.values():
+            t.close()
+    except BaseException:
+        for t in tables.values():
+            if t._writer is not None:
+                try:
+                    t._writer.close()
+                except Exception:
+                    pass
+        remove_tables(t.result() for t in tables.values())
+        raise
+    return [t.result() for t in tables.values()]
+
+
+def remove_tables(tables):
+    """Delete the artifacts (and CSV row indexes) of table results"""
+    for t in tables:
+        for path in (t['path'], row_index_path(t['path'])):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,192 @@
+"""
+Column projection and row filtering applied while records stream past.
+
+Projection picks the flattened columns to keep with glob patterns
+(fnmatch, e.g. `user_*`). Whole subtrees of a record that cannot hold a
+kept column are skipped by the flattening helpers (see flattener.py), so
+they are never walked, joined into key paths or written.
+
+Row predicates such as `status=active` or `user_age>=30` name a flattened
+column, and are evaluated on the nested record before it is flattened, so
+rows that fail them cost a lookup per predicate and nothing else.
+"""
+
+import fnmatch
+import json
+import re
+
+PREDICATE_OPERATORS = ('!=', '>=', '<=', '=', '>', '<')
+_PREDICATE = re.compile(r'^\s*([^\s!<>=].*?)\s*(!=|>=|<=|=|>|<)\s*(.*?)\s*$')
+_WILDCARDS = re.compile(r'[*?\[]')
+_MEMO_SIZE = 100000  # Decisions remembered per Projection before starting over
+_MISSING = object()
+
+
+class Projection:
+    """Flattened columns kept by `include` and `exclude` glob patterns.
+
+    A column is kept if it matches any `include` pattern (every column when
+    there are none) and no `exclude` pattern. Decisions are memoized per key.
+    """
+
+    def __init__(self, include=(), exclude=()):
+        self.include = tuple(include)
+        self.exclude = tuple(exclude)
+        self._include_regexes = [re.compile(fnmatch.translate(p)) for p in self.include]
+        self._exclude_regexes = [re.compile(fnmatch.translate(p)) for p in self.exclude]
+        # Literal start of each include pattern, and whether anything follows it
+        self._include_prefixes = [(_WILDCARDS.split(p, 1)[0], bool(_WILDCARDS.search(p))) for p in self.include]
+        # Exclude patterns ending in '*' also exclude everything below a match
+        self._subtree_regexes = [r for p, r in zip(self.exclude, self._exclude_regexes) if p.endswith('*')]
+        self._wants = {}
+        self._enters = {}
+
+    def __bool__(self):
+        return bool(self.include or self.exclude)
+
+    def __eq__(self, other):
+        return isinstance(other, Projection) and (self.include, self.exclude) == (other.include, other.exclude)
+
+    def __hash__(self):
+        return hash((self.include, self.exclude))
+
+    def __getstate__(self):
+        return {'include': self.include, 'exclude': self.exclude}
+
+    def __setstate__(self, state):
+        self.__init__(state['include'], state['exclude'])
+
+    def wants(self, column):
+        """True if `column` is kept"""
+        wanted = self._wants.get(column)
+        if wanted is None:
+            if len(self._wants) >= _MEMO_SIZE:
+                self._wants.clear()
+            wanted = self._wants[column] = (
+                (not self._include_regexes or any(r.match(column) for r in self._include_regexes))
+                and not any(r.match(column) for r in self._exclude_regexes))
+        return wanted
+
+    def enters(self, key):
+        """False if no kept column can be `key` or start with it, so the
+        value at that key path can be skipped. May be True for a subtree
+        that turns out to hold nothing kept; never False for one that does."""
+        entered = self._enters.get(key)
+        if entered is None:
+            if len(self._enters) >= _MEMO_SIZE:
+                self._enters.clear()
+            entered = self._enters[key] = (
+                (not self.include or any(
+                    literal.startswith(key) or (open_ended and key.startswith(literal))
+                    for literal, open_ended in self._include_prefixes))
+                and not any(r.match(key) for r in self._subtree_regexes))
+        return entered
+
+
+def _literal(text):
+    """A predicate value: JSON (number, true, false, null, "string") if it
+    parses, else the text itself"""
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+class RowFilter:
+    """Keep the records that satisfy every predicate.
+
+    A predicate is `<column><op><value>` with op one of =, !=, >, >=, <, <=.
+    `column` is a flattened column name and `value` is read as JSON when it
+    parses (`30`, `true`, `null`, `"30"`), else as a plain string. = and !=
+    compare for equality; the ordering operators hold only when both sides
+    are numbers or both are strings. A missing column compares as null.
+    Raises ValueError for a malformed predicate.
+    """
+
+    def __init__(self, predicates=(), sep='_'):
+        self.predicates = tuple(predicates)
+        self.sep = sep
+        self._tests = []
+        for predicate in self.predicates:
+            match = _PREDICATE.match(predicate)
+            if match is None:
+                raise ValueError(f"Invalid row predicate '{predicate}': expected <column><op><value> "
+                                 f"with op one of {', '.join(PREDICATE_OPERATORS)}")
+            column, op, value = match.groups()
+            self._tests.append((column, op, _literal(value)))
+
+    def __bool__(self):
+        return bool(self.predicates)
+
+    def __eq__(self, other):
+        return isinstance(other, RowFilter) and (self.predicates, self.sep) == (other.predicates, other.sep)
+
+    def __hash__(self):
+        return hash((self.predicates, self.sep))
+
+    def __call__(self, record):
+        for column, op, expected in self._tests:
+            value = lookup(record, column, self.sep)
+            if not _compare(None if value is _MISSING else value, op, expected):
+                return False
+        return True
+
+    def filter(self, records):
+        """The records that satisfy every predicate, lazily"""
+        return filter(self, records) if self._tests else records
+
+
+def _compare(value, op, expected):
+    if op == '=':
+        return _equal(value, expected)
+    if op == '!=':
+        return not _equal(value, expected)
+    numbers = (int, float)
+    if isinstance(value, bool) or isinstance(expected, bool):
+        return False
+    if not (isinstance(value, numbers) and isinstance(expected, numbers)
+            or isinstance(value, str) and isinstance(expected, str)):
+        return False
+    if op == '>':
+        return value > expected
+    if op == '>=':
+        return value >= expected
+    if op == '<':
+        return value < expected
+    return value <= expected
+
+
+def _equal(value, expected):
+    # 1 == True in Python, but not in JSON
+    return value == expected and isinstance(value, bool) == isinstance(expected, bool)
+
+
+def lookup(record, column, sep='_'):
+    """Value of flattened `column` in the nested `record`, found without
+    flattening it; a missing column gives a private sentinel. A record that
+    is not an object has only the `value` column."""
+    if not isinstance(record, (dict, list)):
+        return record if column == 'value' else _MISSING
+    return _lookup(record, column, sep)
+
+
+def _lookup(node, column, sep):
+    if isinstance(node, dict):
+        if column in node:
+            return node[column]
+        # Keys may contain `sep` themselves, so every key that prefixes the column is tried
+        for key, value in node.items():
+            if column.startswith(key + sep) and isinstance(value, (dict, list)):
+                found = _lookup(value, column[len(key) + len(sep):], sep)
+                if found is not _MISSING:
+                    return found
+    elif isinstance(node, list):
+        head, _, rest = column.partition(sep)
+        if head.isdigit() and int(head) < len(node):
+            item = node[int(head)]
+            if not rest:
+                return item
+            # Like flatten_json, only objects inside an array are flattened further
+            if isinstance(item, dict):
+                return _lookup(item, rest, sep)
+    return _MISSING
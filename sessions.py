@@ -0,0 +1,196 @@
+"""
+Conversion sessions shared by every worker process.
+
+A session maps the id handed out by /convert to its metadata and to the
+artifact files on disk. Sessions live in a small SQLite database so that
+any gunicorn worker can serve the download, expire after `ttl` seconds
+without access, and the least recently used ones are evicted once their
+files exceed `max_bytes` in total. Evicting a session deletes its files.
+Hit, miss and eviction counts are kept in the same database, and so is the
+state of background jobs, so any worker can report a job's progress.
+"""
+
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+
+COUNTERS = ('stored', 'hits', 'misses', 'expired', 'evicted')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    files TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_accessed ON sessions (accessed);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+"""
+
+
+def _remove_files(paths):
+    for path in paths:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Cleanup error: {e}")
+
+
+class SessionStore:
+    """SQLite-backed session table with TTL and size-bounded LRU eviction"""
+
+    def __init__(self, path, ttl=3600, max_bytes=2 * 1024 ** 3):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.executescript(_SCHEMA)
+        finally:
+            db.close()
+        with self._connect() as db:
+            db.executemany('INSERT OR IGNORE INTO counters (name, value) VALUES (?, 0)',
+                           [(name,) for name in COUNTERS])
+
+    @contextmanager
+    def _connect(self):
+        # A short-lived connection per call keeps the store safe to use from
+        # any thread; IMMEDIATE transactions serialize writers across processes
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                yield db
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+            db.execute('COMMIT')
+        finally:
+            db.close()
+
+    @staticmethod
+    def _count(db, name, amount=1):
+        if amount:
+            db.execute('UPDATE counters SET value = value + ? WHERE name = ?', (amount, name))
+
+    def put(self, session_id, data, files=()):
+        """Store `data` (JSON-serializable) and the paths of its backing files"""
+        files = [path for path in files if path]
+        size = sum(os.path.getsize(path) for path in files if os.path.exists(path))
+        now = time.time()
+        with self._connect() as db:
+            db.execute('INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, ?, ?)',
+                       (session_id, json.dumps(data), json.dumps(files), size, now, now))
+            self._count(db, 'stored')
+        self.evict(keep=session_id)
+
+    def get(self, session_id):
+        """Return the session's data, or None if it is unknown or expired"""
+        now = time.time()
+        expired_files = None
+        with self._connect() as db:
+            row = db.execute('SELECT data, files, accessed FROM sessions WHERE id = ?',
+                             (session_id,)).fetchone()
+            if row is not None and now - row[2] > self.ttl:
+                db.execute('DELETE FROM sessions WHERE id = ?', (session_id,))
+                self._count(db, 'expired')
+                expired_files, row = json.loads(row[1]), None
+            if row is None:
+                self._count(db, 'misses')
+            else:
+                db.execute('UPDATE sessions SET accessed = ? WHERE id = ?', (now, session_id))
+                self._count(db, 'hits')
+        if expired_files:
+            _remove_files(expired_files)
+        return None if row is None else json.loads(row[0])
+
+    def update(self, session_id, data, files=()):
+        """Replace a stored session's data and files, keeping its age"""
+        files = [path for path in files if path]
+        size = sum(os.path.getsize(path) for path in files if os.path.exists(path))
+        with self._connect() as db:
+            db.execute('UPDATE sessions SET data = ?, files = ?, size = ? WHERE id = ?',
+                       (json.dumps(data), json.dumps(files), size, session_id))
+        self.evict(keep=session_id)
+
+    def expire_in(self, session_id, seconds):
+        """Let a session expire `seconds` from now (at most its TTL) unless it is used again"""
+        accessed = time.time() - self.ttl + min(seconds, self.ttl)
+        with self._connect() as db:
+            db.execute('UPDATE sessions SET accessed = MIN(accessed, ?) WHERE id = ?',
+                       (accessed, session_id))
+
+    def discard(self, session_id):
+        """Forget a session and delete its files"""
+        with self._connect() as db:
+            row = db.execute('SELECT files FROM sessions WHERE id = ?', (session_id,)).fetchone()
+            db.execute('DELETE FROM sessions WHERE id = ?', (session_id,))
+        if row is not None:
+            _remove_files(json.loads(row[0]))
+
+    def evict(self, keep=None):
+        """Drop expired sessions, then least recently used ones while the
+        total size of their files is over `max_bytes`. The session `keep`
+        is never evicted for size."""
+        cutoff = time.time() - self.ttl
+        removed = []
+        with self._connect() as db:
+            expired = db.execute('SELECT id, files FROM sessions WHERE accessed < ?',
+                                 (cutoff,)).fetchall()
+            total = db.execute('SELECT COALESCE(SUM(size), 0) FROM sessions WHERE accessed >= ?',
+                               (cutoff,)).fetchone()[0]
+            evicted = []
+            if total > self.max_bytes:
+                for session_id, files, size in db.execute(
+                        'SELECT id, files, size FROM sessions WHERE accessed >= ? ORDER BY accessed',
+                        (cutoff,)).fetchall():
+                    if total <= self.max_bytes:
+                        break
+                    if session_id == keep:
+                        continue
+                    evicted.append((session_id, files))
+                    total -= size
+            for session_id, files in expired + evicted:
+                db.execute('DELETE FROM sessions WHERE id = ?', (session_id,))
+                removed.extend(json.loads(files))
+            self._count(db, 'expired', len(expired))
+            self._count(db, 'evicted', len(evicted))
+        _remove_files(removed)
+
+    def put_job(self, job_id, data):
+        """Store the state of a background job (JSON-serializable). Jobs not
+        updated for `ttl` seconds are dropped, including ones whose worker died."""
+        now = time.time()
+        with self._connect() as db:
+            db.execute('INSERT OR REPLACE INTO jobs VALUES (?, ?, ?)', (job_id, json.dumps(data), now))
+            db.execute('DELETE FROM jobs WHERE updated < ?', (now - self.ttl,))
+
+    def get_job(self, job_id):
+        """Return a job's last stored state, or None if it is unknown or expired"""
+        with self._connect() as db:
+            row = db.execute('SELECT data FROM jobs WHERE id = ? AND updated >= ?',
+                             (job_id, time.time() - self.ttl)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def stats(self):
+        """Counters plus the current number and total size of sessions"""
+        with self._connect() as db:
+            stats = dict(db.execute('SELECT name, value FROM counters').fetchall())
+            stats['sessions'], stats['bytes'] = db.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM sessions').fetchone()
+        return stats
@@ -0,0 +1,158 @@
+"""Column types only widen up the lattice, and typed artifacts hold the values they were given"""
+
+import os
+import sys
+from datetime import datetime, timezone
+
+import pyarrow as pa
+import pyarrow.ipc as pa_ipc
+import pyarrow.parquet as pq
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from columntypes import (BOOLEAN, DATETIME, DATETIME_TZ, FLOAT, INTEGER, NULL, STRING,  # noqa: E402
+                         ColumnTypes, join, parse_datetime, value_type, values_type)
+from writers import ArrowRowWriter, arrow_schema  # noqa: E402
+
+NAIVE = '2024-05-01T12:30:00'
+AWARE = '2024-05-01T12:30:00+02:00'
+
+
+def column_type(*batches):
+    """Type of one column fed batch by batch, checked against the per-value path"""
+    types, per_value = ColumnTypes(), ColumnTypes()
+    for batch in batches:
+        types.add_rows(['c'], [(value,) for value in batch])
+        for value in batch:
+            per_value.add_record({'c': value})
+    assert types['c'] == per_value['c']
+    return types['c']
+
+
+def test_numbers_widen_int_to_float_to_string():
+    assert column_type([1, 2]) == INTEGER
+    assert column_type([1], [2.5]) == FLOAT
+    assert column_type([1, 2.5]) == FLOAT
+    assert column_type([1], [2.5], ['x']) == STRING
+    assert column_type(['x'], [1], [2.5]) == STRING
+
+
+def test_types_never_narrow():
+    types = ColumnTypes()
+    for column_type_ in (INTEGER, FLOAT, INTEGER, NULL):
+        types.add('c', column_type_)
+    assert types['c'] == FLOAT
+    types.add('c', BOOLEAN)
+    types.add('c', INTEGER)
+    assert types['c'] == STRING
+
+
+def test_join_is_symmetric():
+    for a in (NULL, BOOLEAN, INTEGER, FLOAT, DATETIME, DATETIME_TZ, STRING):
+        assert join(a, NULL) == join(NULL, a) == a
+        assert join(a, STRING) == STRING
+        for b in (NULL, BOOLEAN, INTEGER, FLOAT, DATETIME, DATETIME_TZ, STRING):
+            assert join(a, b) == join(b, a)
+
+
+def test_booleans_are_not_numbers():
+    assert column_type([True, False]) == BOOLEAN
+    assert column_type([True], [1]) == STRING
+    assert column_type([0, False]) == STRING
+
+
+def test_ints_past_64_bits_are_strings():
+    assert value_type(2 ** 63 - 1) == INTEGER
+    assert value_type(2 ** 63) == STRING
+    assert column_type([1, -2 ** 63 - 1]) == STRING
+    assert column_type([0.5, 2 ** 64]) == STRING
+
+
+def test_datetimes():
+    assert column_type([NAIVE, '2024-05-01 08:00', '2024-05-01T08:00:00.123456']) == DATETIME
+    assert column_type([AWARE, '2024-05-01T12:30:00Z', '2024-05-01T12:30:00-0530']) == DATETIME_TZ
+    assert column_type([NAIVE], [None, AWARE]) == STRING
+    assert column_type([NAIVE], [1]) == STRING
+    for text in ('2024-05-01', '2024-13-01T00:00:00', '2024-05-01T12:30:00.1234567', 'May 1st'):
+        assert value_type(text) == STRING
+    assert parse_datetime(AWARE) == datetime(2024, 5, 1, 10, 30)
+    assert parse_datetime(NAIVE) == datetime(2024, 5, 1, 12, 30)
+
+
+def test_null_only_columns():
+    assert values_type([None, None]) == NULL
+    assert column_type([None], [None, None]) == NULL
+    assert column_type([None], [1], [None]) == INTEGER
+    assert ColumnTypes()['never_seen'] == NULL
+    assert arrow_schema(['c'], ColumnTypes({'c': NULL})).field('c').type == pa.string()
+
+
+def read_table(path, output_format):
+    if output_format == 'parquet':
+        return pq.read_table(path)
+    return pa_ipc.open_file(pa.memory_map(path)).read_all()
+
+
+HEADER = ['n', 'x', 'mixed', 'flag', 'when', 'when_tz', 'empty', 'obj']
+BATCHES = [
+    [(1, 1, 1, True, NAIVE, AWARE, None, {'a': 1})],
+    [(2, 2.5, 'two', False, None, '2024-05-01T00:00:00Z', None, [1, 2])],
+    [(None, -3, 3.5, None, '2024-05-02 08:00', None, None, 'text')],
+]
+
+
+@pytest.mark.parametrize('output_format', ['parquet', 'arrow'])
+def test_staged_rows_are_cast_at_close(tmp_path, output_format):
+    path = str(tmp_path / f"out.{output_format}")
+    writer = ArrowRowWriter(path, HEADER, output_format)
+    for rows in BATCHES:
+        writer.write_batch(rows)
+    writer.close()
+    assert writer.types.as_dict() == {'n': INTEGER, 'x': FLOAT, 'mixed': STRING, 'flag': BOOLEAN,
+                                      'when': DATETIME, 'when_tz': DATETIME_TZ, 'empty': NULL, 'obj': STRING}
+    table = read_table(path, output_format)
+    assert table.schema == arrow_schema(HEADER, writer.types)
+    assert table.to_pydict() == {
+        'n': [1, 2, None],
+        'x': [1.0, 2.5, -3.0],
+        'mixed': ['1', 'two', '3.5'],
+        'flag': [True, False, None],
+        'when': [datetime(2024, 5, 1, 12, 30), None, datetime(2024, 5, 2, 8, 0)],
+        'when_tz': [datetime(2024, 5, 1, 10, 30, tzinfo=timezone.utc),
+                    datetime(2024, 5, 1, 0, 0, tzinfo=timezone.utc), None],
+        'empty': [None, None, None],
+        'obj': ['{"a": 1}', '[1, 2]', 'text'],
+    }
+
+
+@pytest.mark.parametrize('output_format', ['parquet', 'arrow'])
+def test_staged_rows_match_rows_typed_up_front(tmp_path, output_format):
+    staged_path, typed_path = str(tmp_path / 'staged'), str(tmp_path / 'typed')
+    types = ColumnTypes()
+    for rows in BATCHES:
+        types.add_rows(HEADER, rows)
+    staged = ArrowRowWriter(staged_path, HEADER, output_format)
+    typed = ArrowRowWriter(typed_path, HEADER, output_format, types.as_dict())
+    for rows in BATCHES:
+        staged.write_batch(rows)
+        typed.write_batch(rows)
+    staged.close()
+    typed.close()
+    assert read_table(staged_path, output_format).equals(read_table(typed_path, output_format))
+
+
+def test_typed_writer_rejects_a_row_that_does_not_fit(tmp_path):
+    writer = ArrowRowWriter(str(tmp_path / 'out.parquet'), ['n'], types={'n': INTEGER})
+    writer.write_batch([(1,), (2,)])
+    with pytest.raises(ValueError, match=r"Column 'n' .* row 4 holds 'x'"):
+        writer.write_batch([(3,), ('x',)])
+
+
+@pytest.mark.parametrize('output_format', ['parquet', 'arrow'])
+def test_no_rows_gives_text_columns(tmp_path, output_format):
+    path = str(tmp_path / 'out')
+    ArrowRowWriter(path, ['a', 'b'], output_format).close()
+    table = read_table(path, output_format)
+    assert table.num_rows == 0
+    assert table.schema == pa.schema([('a', pa.string()), ('b', pa.string())])
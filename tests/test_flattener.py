@@ -0,0 +1,158 @@
+"""CompiledFlattener must give the same rows as flatten_json, whatever the records look like"""
+
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flattener import ARRAY_MODES, Flattening, flatten_json  # noqa: E402
+
+EXTRA = '_extra'
+
+NESTED = [
+    {'id': 1, 'user': {'name': 'a', 'address': {'city': 'x', 'geo': {'lat': 1.5, 'lng': -2}}}},
+    {'id': 2, 'user': {'name': 'b', 'address': {'city': 'y', 'geo': {'lat': 0, 'lng': 0}}}},
+    {'id': 3, 'user': {'name': None, 'address': {}}},
+]
+
+HETEROGENEOUS = [
+    {'id': 1, 'a': 1, 'b': 'x'},
+    {'b': 'y', 'id': 2, 'a': 2},
+    {'id': 3, 'c': True, 'd': {'e': None}},
+    {'id': 4, 'a': 'text', 'b': 2.5},
+    {'id': 5},
+    {},
+    'scalar',
+    7,
+    None,
+    [1, 2],
+]
+
+ARRAYS = [
+    {'id': 1, 'tags': ['a', 'b'], 'items': [{'sku': 's1', 'qty': 1}, {'sku': 's2', 'qty': 2}]},
+    {'id': 2, 'tags': [], 'items': []},
+    {'id': 3, 'tags': list(range(15)), 'items': [{'sku': f"s{i}"} for i in range(12)]},
+    {'id': 4, 'tags': list(range(20)), 'items': [{'sku': f"s{i}"} for i in range(12)]},
+    {'id': 5, 'tags': [[1, 2], {'x': 1}, None], 'items': [{'sku': 's', 'parts': [{'n': 1}, {'n': 2}]}]},
+    {'id': 6, 'matrix': [[1, 2], [3, 4]], 'mixed': [1, 'two', {'three': 3}, [4]]},
+]
+
+KEY_COLLISIONS = [
+    {'a_b': 1, 'a': {'b': 2}},
+    {'a': {'b': 3}, 'a_b': 4},
+    {'a': [10, 11], 'a_0': 'direct'},
+    {'a_count': 'mine', 'a': list(range(12))},
+    {'x': {'y_z': 1, 'y': {'z': 2}}},
+]
+
+SHAPE_CHANGES = [
+    {'id': 1, 'v': {'b': 1}},
+    {'id': 2, 'v': [1, 2]},
+    {'id': 3, 'v': 5},
+    {'id': 4, 'v': {'b': 1, 'c': 2}},
+    {'id': 5, 'v': {'b': [1]}},
+    {'id': 6, 'v': {'b': {'deep': 1}}},
+    {'id': 7, 'v': None},
+    {'id': 8, 'v': [1, 2, 3]},
+    {'id': 9, 'v': [{'k': 1}]},
+    {'id': 10, 'v': ['k']},
+    {'id': 11, 'v': {}},
+    {'id': 12, 'v': []},
+    {'id': 13, 'v': {'b': 1}},
+]
+
+RECORDS = {
+    'nested': NESTED,
+    'heterogeneous': HETEROGENEOUS,
+    'arrays': ARRAYS,
+    'key_collisions': KEY_COLLISIONS,
+    'shape_changes': SHAPE_CHANGES,
+}
+
+
+def expected_rows(flattening, records, columns, extra_column):
+    """Rows as flatten_json gives them, laid out like CompiledFlattener's"""
+    known = {k for k in columns if k != extra_column}
+    rows = []
+    for record in flattening.records(records):
+        if isinstance(record, dict):
+            flat = flatten_json(record, sep=flattening.sep, array_limit=flattening.array_limit,
+                                json_arrays=flattening.json_arrays)
+        else:
+            flat = {'value': record}
+        row = [flat.get(k, '') for k in columns]
+        if extra_column is not None:
+            extra = {k: v for k, v in flat.items() if k not in known}
+            row[columns.index(extra_column)] = json.dumps(extra, ensure_ascii=False) if extra else ''
+        rows.append(tuple(row))
+    return rows
+
+
+def all_columns(flattening, records):
+    keys = {}
+    for record in flattening.records(records):
+        if isinstance(record, dict):
+            flattening.keys(record, keys)
+        else:
+            keys['value'] = None
+    return list(keys)
+
+
+def compiled_rows(flattening, records, columns, **options):
+    return list(flattening.compile(columns, **options).rows(flattening.records(records)))
+
+
+@pytest.mark.parametrize('arrays', ARRAY_MODES)
+@pytest.mark.parametrize('name', RECORDS)
+def test_matches_flatten_json_with_every_column(arrays, name):
+    flattening = Flattening(arrays)
+    records = RECORDS[name]
+    columns = all_columns(flattening, records)
+    assert compiled_rows(flattening, records, columns) == expected_rows(flattening, records, columns, None)
+
+
+@pytest.mark.parametrize('arrays', ARRAY_MODES)
+@pytest.mark.parametrize('name', RECORDS)
+def test_matches_flatten_json_with_extra_column(arrays, name):
+    # The header only knows the first record's columns; everything else goes to _extra
+    flattening = Flattening(arrays)
+    records = RECORDS[name]
+    columns = all_columns(flattening, records[:1]) + [EXTRA]
+    assert (compiled_rows(flattening, records, columns, extra_column=EXTRA)
+            == expected_rows(flattening, records, columns, EXTRA))
+
+
+@pytest.mark.parametrize('arrays', ARRAY_MODES)
+@pytest.mark.parametrize('name', RECORDS)
+def test_matches_flatten_json_past_max_shapes(arrays, name):
+    flattening = Flattening(arrays)
+    records = RECORDS[name]
+    columns = all_columns(flattening, records) + [EXTRA]
+    assert (compiled_rows(flattening, records, columns, extra_column=EXTRA, max_shapes=1)
+            == expected_rows(flattening, records, columns, EXTRA))
+
+
+@pytest.mark.parametrize('arrays', ARRAY_MODES)
+def test_matches_flatten_json_with_array_limit_and_separator(arrays):
+    flattening = Flattening(arrays, array_limit=2, sep='.')
+    records = [record for group in RECORDS.values() for record in group]
+    columns = all_columns(flattening, records[::2]) + [EXTRA]
+    assert (compiled_rows(flattening, records, columns, extra_column=EXTRA)
+            == expected_rows(flattening, records, columns, EXTRA))
+
+
+@pytest.mark.parametrize('arrays', ARRAY_MODES)
+def test_reused_shapes_match_flatten_json(arrays):
+    # Each record runs twice, so the second pass goes through the compiled shapes
+    flattening = Flattening(arrays)
+    records = [record for group in RECORDS.values() for record in group] * 2
+    columns = all_columns(flattening, records) + [EXTRA]
+    compiler = flattening.compile(columns, extra_column=EXTRA)
+    first = list(compiler.rows(flattening.records(records)))
+    second = list(compiler.rows(flattening.records(records)))
+    expected = expected_rows(flattening, records, columns, EXTRA)
+    assert first == expected
+    assert second == expected
@@ -0,0 +1,86 @@
+"""MultipartUpload reads the file parts of a form straight from the request body"""
+
+import io
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from readers import MultipartUpload, iter_records  # noqa: E402
+
+BOUNDARY = 'test-boundary'
+
+
+def body(*parts):
+    """A multipart/form-data body from (name, value) fields and (name, filename, data) files"""
+    out = []
+    for part in parts:
+        out.append(f'--{BOUNDARY}\r\n'.encode())
+        if len(part) == 2:
+            name, value = part
+            out.append(f'Content-Disposition: form-data; name="{name}"\r\n\r\n'.encode())
+            out.append(value.encode() + b'\r\n')
+        else:
+            name, filename, data = part
+            out.append(f'Content-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                       'Content-Type: application/octet-stream\r\n\r\n'.encode())
+            out.append(data + b'\r\n')
+    out.append(f'--{BOUNDARY}--\r\n'.encode())
+    return b''.join(out)
+
+
+def upload(*parts, read_size=7):
+    # A small read size makes every part span several reads
+    return MultipartUpload(io.BytesIO(body(*parts)), BOUNDARY.encode(), read_size=read_size)
+
+
+def test_fields_before_the_file_are_ready_at_once():
+    up = upload(('format', 'xlsx'), ('file', 'a.jsonl', b'{"a": 1}\n{"a": 2}\n'))
+    assert up.form == {'format': 'xlsx'}
+    assert up.filename == 'a.jsonl'
+    assert list(iter_records(up.stream)) == [{'a': 1}, {'a': 2}]
+    assert up.finish() == {'format': 'xlsx'}
+
+
+def test_fields_after_the_file_come_with_finish():
+    up = upload(('format', 'xlsx'), ('file', 'a.jsonl', b'{"a": 1}\n'), ('arrays', 'json'), ('sep', '.'))
+    assert up.form == {'format': 'xlsx'}
+    assert list(iter_records(up.stream)) == [{'a': 1}]
+    assert up.finish() == {'format': 'xlsx', 'arrays': 'json', 'sep': '.'}
+
+
+def test_finish_skips_the_unread_rest_of_the_file():
+    up = upload(('file', 'a.jsonl', b'{"a": 1}\n' * 100), ('sep', '.'))
+    assert up.stream.read(3) == b'{"a'
+    assert up.finish() == {'sep': '.'}
+    assert up.skipped_files == []
+
+
+def test_next_file_moves_through_every_file_part():
+    up = upload(('file', 'a.jsonl', b'{"a": 1}\n'), ('other', 'x.bin', b'ignored'),
+                ('batch', 'union'), ('file', 'b.json', b'[{"b": 2}]'), ('file', 'c.jsonl', b''))
+    seen = []
+    while True:
+        seen.append((up.filename, list(iter_records(up.stream))))
+        if not up.next_file():
+            break
+    assert seen == [('a.jsonl', [{'a': 1}]), ('b.json', [{'b': 2}]), ('c.jsonl', [])]
+    assert up.filename == 'c.jsonl'
+    assert up.finish() == {'batch': 'union'}
+    assert up.skipped_files == []
+
+
+def test_file_parts_not_opened_are_listed_by_finish():
+    up = upload(('file', 'a.jsonl', b'{"a": 1}\n'), ('file', 'b.jsonl', b'{"b": 2}\n'),
+                ('file', 'c.jsonl', b'{"c": 3}\n'), ('sep', '.'))
+    assert list(iter_records(up.stream)) == [{'a': 1}]
+    assert up.finish() == {'sep': '.'}
+    assert up.skipped_files == ['b.jsonl', 'c.jsonl']
+
+
+def test_no_file_part():
+    up = upload(('format', 'csv'))
+    assert up.filename is None
+    assert up.stream.read() == b''
+    assert up.next_file() is False
+    assert up.finish() == {'format': 'csv'}
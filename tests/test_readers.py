@@ -0,0 +1,124 @@
+"""How iter_records reads JSON Lines and documents, and finds the records in them"""
+
+import codecs
+import io
+import json
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from readers import InvalidJSONError, LineErrors, iter_records, record_path_prefix  # noqa: E402
+
+ORDER = {'order_id': 17, 'customer': 'acme', 'lines': [{'sku': 'a', 'qty': 1}, {'sku': 'b', 'qty': 2}]}
+WRAPPER = {'meta': {'page': 1, 'tags': ['x']}, 'data': {'results': [{'a': 1}, {'a': 2}, {'a': 3}]},
+           'links': {'next': None}}
+
+
+def records(data, **options):
+    return list(iter_records(io.BytesIO(data), **options))
+
+
+def file_records(data, **options):
+    # A regular file, so JSON Lines go through the memory-mapped reader
+    with tempfile.TemporaryFile() as f:
+        f.write(data)
+        f.seek(0)
+        return list(iter_records(f, **options))
+
+
+def pretty(value):
+    return json.dumps(value, indent=2).encode()
+
+
+def minified(value):
+    return json.dumps(value).encode()
+
+
+@pytest.mark.parametrize('encode', [pretty, minified])
+def test_single_object_with_record_fields_stays_one_record(encode):
+    assert records(encode(ORDER)) == [ORDER]
+
+
+def test_one_line_is_json_lines():
+    line = {'id': 1, 'items': [{'x': 1}, {'x': 2}]}
+    assert records(minified(line) + b'\n') == [line]
+    assert records(minified(line) + b'\n' + minified(line) + b'\n') == [line, line]
+
+
+def test_one_line_wrapper_is_one_record():
+    assert records(minified(WRAPPER)) == [WRAPPER]
+
+
+def test_pretty_wrapper_yields_its_array():
+    assert records(pretty(WRAPPER)) == WRAPPER['data']['results']
+    assert records(pretty({'results': [{'a': 1}, {'a': 2}]})) == [{'a': 1}, {'a': 2}]
+
+
+@pytest.mark.parametrize('document', [
+    {'data': {'total': 2, 'results': [{'a': 1}, {'a': 2}]}},   # scalar beside the array
+    {'order': {'id': 17, 'lines': [{'x': 1}, {'x': 2}]}},      # scalar one level up
+    {'data': [{'a': 1}, {'a': 2}], 'included': [{'b': 1}]},    # another array of objects
+    {'tags': ['x', 'y'], 'items': [{'a': 1}, {'a': 2}]},       # an array of scalars
+    {'items': [{'a': 1}], 'note': None},                      # a null field
+])
+def test_object_with_data_beside_the_array_stays_one_record(document):
+    assert records(pretty(document)) == [document]
+
+
+def test_wrapper_read_from_a_stream_that_cannot_seek():
+    stream = io.BufferedReader(io.BytesIO(pretty(WRAPPER)))
+    stream.seekable = lambda: False
+    assert list(iter_records(stream)) == WRAPPER['data']['results']
+
+
+def test_record_path_picks_records_of_any_object():
+    assert records(pretty(ORDER), record_path=record_path_prefix('$.lines[*]')) == ORDER['lines']
+    assert records(minified(WRAPPER), record_path='data.results.item') == WRAPPER['data']['results']
+
+
+def test_record_path_that_finds_nothing_names_the_path():
+    with pytest.raises(InvalidJSONError, match=r"\$\.data\.missing\[\*\]"):
+        records(pretty(WRAPPER), record_path=record_path_prefix('$.data.missing[*]'))
+
+
+@pytest.mark.parametrize('read', [records, file_records])
+def test_bom_and_blank_lines(read):
+    data = codecs.BOM_UTF8 + b'\r\n  \n{"a": 1}\r\n\r\n{"b": 2}\n\n'
+    assert read(data) == [{'a': 1}, {'b': 2}]
+
+
+@pytest.mark.parametrize('read', [records, file_records])
+def test_broken_first_line_fails_on_that_line(read):
+    data = codecs.BOM_UTF8 + b'\n\n{"a": 1\n{"a": 2}\n{"a": 3}\n'
+    with pytest.raises(InvalidJSONError, match=r'line 3 \(byte offset 5\)'):
+        read(data)
+
+
+@pytest.mark.parametrize('read', [records, file_records])
+def test_broken_first_line_is_skipped(read):
+    errors = LineErrors('skip')
+    assert read(b'{"a": 1\n{"a": 2}\n\n{"a": 3}\n', errors=errors) == [{'a': 2}, {'a': 3}]
+    assert errors.count == 1
+    assert [sample[:2] for sample in errors.samples] == [(1, 0)]
+
+
+def test_broken_first_line_is_quarantined():
+    quarantine = io.BytesIO()
+    errors = LineErrors('quarantine', quarantine)
+    assert records(b'{"a": 1\n{"a": 2}', errors=errors) == [{'a': 2}]
+    assert quarantine.getvalue() == b'{"a": 1\n'
+
+
+@pytest.mark.parametrize('read', [records, file_records])
+def test_pretty_printed_single_object(read):
+    record = {'id': 1, 'user': {'name': 'a'}, 'tags': [1, 2]}
+    assert read(codecs.BOM_UTF8 + b'\n' + pretty(record) + b'\n') == [record]
+
+
+def test_truncated_document_is_invalid():
+    with pytest.raises(InvalidJSONError):
+        records(b'{"a": 1,\n')
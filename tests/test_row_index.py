@@ -0,0 +1,147 @@
+"""CSV artifacts are paged through their row index (.idx) rather than read from the top"""
+
+import csv
+import io
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flattener import Flattening  # noqa: E402
+from main import app  # noqa: E402
+from parallel import parallel_convert  # noqa: E402
+from writers import (COMPRESSIONS, ROW_INDEX_STRIDE, CSVRowWriter, load_row_index,  # noqa: E402
+                     open_compressed, read_artifact_page, row_index_path)
+
+HEADER = ['id', 'name', 'note']
+ROWS = [(i, f"n{i}", 'line\nbreak, "quoted"' if i % 7 == 0 else 'x' * (i % 5)) for i in range(50)]
+PAGES = [(0, 5), (6, 3), (7, 7), (20, 1), (45, 10), (49, 1), (50, 5), (13, 0)]
+
+
+def text_row(row):
+    return tuple('' if value is None else str(value) for value in row)
+
+
+def write_csv(path, rows, compression=None, index_stride=7, batch=9):
+    writer = CSVRowWriter(path, HEADER, compression, index_stride)
+    for i in range(0, len(rows), batch):
+        writer.write_batch(rows[i:i + batch])
+    writer.close()
+    return path
+
+
+def csv_rows(path, compression=None):
+    with open_compressed(path, 'rb', compression) as f:
+        return [tuple(row) for row in csv.reader(io.TextIOWrapper(f, encoding='utf-8', newline=''))][1:]
+
+
+def rows_at(path, offset, compression=None):
+    """The rows read from byte `offset` of the uncompressed CSV on"""
+    with open_compressed(path, 'rb', compression) as f:
+        f.seek(offset)
+        return [tuple(row) for row in csv.reader(io.TextIOWrapper(f, encoding='utf-8', newline=''))]
+
+
+@pytest.mark.parametrize('compression', (None,) + tuple(COMPRESSIONS))
+def test_index_marks_every_stride(tmp_path, compression):
+    path = write_csv(str(tmp_path / 'out.csv'), ROWS, compression)
+    rows, offsets = load_row_index(row_index_path(path))
+    assert list(rows) == list(range(0, len(ROWS), 7))
+    for row, offset in zip(rows, offsets):
+        assert rows_at(path, offset, compression)[0] == text_row(ROWS[row])
+
+
+@pytest.mark.parametrize('compression', (None,) + tuple(COMPRESSIONS))
+@pytest.mark.parametrize('offset,limit', PAGES)
+def test_page_matches_slice(tmp_path, compression, offset, limit):
+    path = write_csv(str(tmp_path / 'out.csv'), ROWS, compression)
+    expected = [text_row(row) for row in ROWS[offset:offset + limit]]
+    assert read_artifact_page(path, 'csv', HEADER, offset, limit, compression=compression) == expected
+
+
+@pytest.mark.parametrize('compression', (None,) + tuple(COMPRESSIONS))
+def test_page_selects_columns(tmp_path, compression):
+    path = write_csv(str(tmp_path / 'out.csv'), ROWS, compression)
+    page = read_artifact_page(path, 'csv', HEADER, 12, 4, ['note', 'id'], compression)
+    assert page == [(text_row(row)[2], str(row[0])) for row in ROWS[12:16]]
+
+
+def test_page_without_index(tmp_path):
+    path = write_csv(str(tmp_path / 'out.csv'), ROWS, index_stride=None)
+    assert not os.path.exists(row_index_path(path))
+    assert read_artifact_page(path, 'csv', HEADER, 8, 3) == [text_row(row) for row in ROWS[8:11]]
+
+
+def test_text_blocks_are_indexed_between_blocks(tmp_path):
+    # Pre-encoded blocks (as parallel workers send them) can only be marked where they start
+    path = str(tmp_path / 'out.csv')
+    writer = CSVRowWriter(path, HEADER, index_stride=10)
+    for start, end in ((0, 4), (4, 16), (16, 17), (17, 40), (40, 50)):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(ROWS[start:end])
+        writer.write_text(buffer.getvalue(), end - start)
+    writer.close()
+    rows, offsets = load_row_index(row_index_path(path))
+    assert list(rows) == [0, 16, 40]
+    for row, offset in zip(rows, offsets):
+        assert rows_at(path, offset)[0] == text_row(ROWS[row])
+    for offset, limit in PAGES:
+        assert read_artifact_page(path, 'csv', HEADER, offset, limit) == [text_row(row) for row in
+                                                                          ROWS[offset:offset + limit]]
+
+
+@pytest.mark.parametrize('compression', (None,) + tuple(COMPRESSIONS))
+def test_index_from_parallel_blocks(tmp_path, compression):
+    # Small ranges give every worker a few hundred rows, so blocks do not line up with the stride
+    count = 3500
+    source = tmp_path / 'in.jsonl'
+    source.write_bytes(b''.join(json.dumps({'id': i, 'v': {'w': i * 2}}).encode() + b'\n'
+                                for i in range(count)))
+    path = str(tmp_path / 'out.csv')
+    total_rows, header, _, _ = parallel_convert(str(source), path, Flattening('truncate'), workers=2,
+                                                range_bytes=9000, compression=compression)
+    assert (total_rows, header) == (count, ['id', 'v_w'])
+    expected = [(str(i), str(i * 2)) for i in range(count)]
+    assert csv_rows(path, compression) == expected
+    rows, offsets = load_row_index(row_index_path(path))
+    assert rows[0] == 0 and any(row % ROW_INDEX_STRIDE for row in rows)
+    assert all(ROW_INDEX_STRIDE <= b - a < 2 * ROW_INDEX_STRIDE for a, b in zip(rows, rows[1:]))
+    for row, offset in zip(rows, offsets):
+        assert rows_at(path, offset, compression)[0] == expected[row]
+    for offset in (0, 999, 1000, 1001, 2345, 3499):
+        assert read_artifact_page(path, 'csv', header, offset, 7, compression=compression) == \
+            expected[offset:offset + 7]
+
+
+@pytest.fixture
+def client():
+    saved = {key: app.config[key] for key in ('ARTIFACT_COMPRESSION', 'RESULT_CACHE_BYTES')}
+    app.config['RESULT_CACHE_BYTES'] = 0
+    yield app.test_client()
+    app.config.update(saved)
+
+
+@pytest.mark.parametrize('compression', (None,) + tuple(COMPRESSIONS))
+@pytest.mark.parametrize('options', [{}, {'schema_mode': 'spooled', 'workers': '2'},
+                                     {'output_format': 'parquet'}, {'output_format': 'arrow'}])
+def test_preview_rows_route(client, compression, options):
+    app.config['ARTIFACT_COMPRESSION'] = compression
+    count = 2345
+    data = b'\n'.join(json.dumps({'id': i, 'a': {'b': i * 2}, 's': ROWS[i % 50][2]}).encode()
+                      for i in range(count))
+    response = client.post('/api/convert', data=dict(options, file=(io.BytesIO(data), 'in.jsonl')),
+                           content_type='multipart/form-data')
+    assert response.status_code == 200, response.json
+    session_id = response.json['session_id']
+    for offset in (0, 999, 1000, 2340):
+        page = client.get(f'/preview/{session_id}/rows?offset={offset}&limit=7&columns=id,s').json
+        assert page['columns'] == ['id', 's']
+        assert page['total_rows'] == count
+        assert [[int(row[0]), row[1]] for row in page['rows']] == \
+            [[i, ROWS[i % 50][2]] for i in range(offset, min(offset + 7, count))]
+    assert client.get(f'/preview/{session_id}/rows?offset={count}').json['rows'] == []
+    assert client.get(f'/preview/{session_id}/rows?columns=nope').status_code == 400
+    assert client.get(f'/preview/{session_id}/rows?offset=-1').status_code == 400
@@ -0,0 +1,192 @@
+"""Column projection and row predicates must agree with plain flattening"""
+
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flattener import ARRAY_MODES, RECORD_ID_COLUMN, Flattening  # noqa: E402
+from selection import Projection, RowFilter, lookup  # noqa: E402
+
+EXTRA = '_extra'
+
+RECORDS = [
+    {'id': 1, 'user': {'name': 'a', 'address': {'city': 'x', 'geo': {'lat': 1.5, 'lng': -2}}}, 'tags': ['t1', 't2']},
+    {'id': 2, 'user': {'name': 'b', 'address': {}}, 'tags': list(range(12)), 'items': [{'sku': 's1', 'qty': 1}]},
+    {'id': 3, 'user_name': 'flat', 'user': None, 'items': [{'sku': 's2'}, {'sku': 's3', 'qty': [1, 2]}]},
+    {'a_b': 1, 'a': {'b': 2, 'c': {'d': 3}}, 'x': {'y_z': 1, 'y': {'z': 2}}},
+    {'id': 5, 'v': [[1, 2], {'w': 1}, None]},
+    'scalar',
+    None,
+]
+
+PROJECTIONS = [
+    Projection(['user_*']),
+    Projection(['user_address_geo_l?t', 'id']),
+    Projection(exclude=['user_*']),
+    Projection(['a*'], ['a_b']),
+    Projection(['*_0', '*_count']),
+    Projection(['tags_1?', 'items_*_sku']),
+    Projection(['[ax]_*']),
+    Projection(['value', 'id']),
+    Projection(exclude=['*']),
+]
+
+
+def projection_id(projection):
+    return f"include={','.join(projection.include)};exclude={','.join(projection.exclude)}"
+
+
+def test_glob_pruning_of_include_patterns():
+    projection = Projection(['user_address_*', 'id'])
+    assert projection.enters('user') and projection.enters('user_address')
+    assert projection.enters('user_address_geo') and projection.enters('id')
+    assert not projection.enters('user_name') and not projection.enters('tags')
+    assert projection.wants('user_address_geo_lat') and projection.wants('id')
+    assert not projection.wants('user_address') and not projection.wants('identifier')
+
+
+def test_glob_pruning_of_exclude_patterns():
+    # An exclude ending in '*' prunes the subtree below a match; others only drop columns
+    projection = Projection(exclude=['user_*', 'id'])
+    assert projection.enters('user') and not projection.enters('user_address')
+    assert projection.enters('id') and not projection.wants('id')
+    assert not projection.wants('user_address_city') and projection.wants('users')
+
+
+def test_pattern_with_leading_wildcard_enters_everything():
+    projection = Projection(['*_lat'])
+    assert projection.enters('user') and projection.enters('anything')
+    assert projection.wants('user_address_geo_lat') and not projection.wants('lat')
+
+
+def test_empty_projection_is_false():
+    assert not Projection()
+    assert Projection(['a']) and Projection(exclude=['a'])
+    assert Flattening(projection=Projection()).projection is None
+
+
+@pytest.mark.parametrize('arrays', ARRAY_MODES)
+@pytest.mark.parametrize('projection', PROJECTIONS, ids=projection_id)
+def test_projection_matches_filtered_flattening(arrays, projection):
+    full = Flattening(arrays)
+    projected = Flattening(arrays, projection=projection)
+    for record in full.records(RECORDS):
+        assert projected.row(record) == {k: v for k, v in full.row(record).items() if projection.wants(k)}
+
+    keys, projected_keys = {}, {}
+    for record in full.records(RECORDS):
+        full.keys(record, keys)
+        projected.keys(record, projected_keys)
+    assert list(projected_keys) == [k for k in keys if projection.wants(k)]
+
+
+@pytest.mark.parametrize('arrays', ARRAY_MODES)
+@pytest.mark.parametrize('projection', PROJECTIONS, ids=projection_id)
+def test_compiled_projection_matches_filtered_flattening(arrays, projection):
+    # Columns outside the projection that show up anyway would land in _extra
+    full = Flattening(arrays)
+    projected = Flattening(arrays, projection=projection)
+    keys = {}
+    for record in projected.records(RECORDS[:2]):
+        projected.keys(record, keys)
+    columns = list(keys) + [EXTRA]
+    expected = []
+    for record in full.records(RECORDS):
+        flat = {k: v for k, v in full.row(record).items() if projection.wants(k)}
+        extra = {k: v for k, v in flat.items() if k not in keys}
+        expected.append(tuple(flat.get(k, '') for k in keys) +
+                        (json.dumps(extra, ensure_ascii=False) if extra else '',))
+    compiler = projected.compile(columns, extra_column=EXTRA)
+    for _ in range(2):  # The second pass reuses the compiled shapes
+        assert list(compiler.rows(projected.records(RECORDS))) == expected
+
+
+@pytest.mark.parametrize('predicate, column, op, value', [
+    ('status=active', 'status', '=', 'active'),
+    ('  user_age >= 30 ', 'user_age', '>=', 30),
+    ('n!=null', 'n', '!=', None),
+    ('flag=true', 'flag', '=', True),
+    ('id="30"', 'id', '=', '30'),
+    ('score<-1.5', 'score', '<', -1.5),
+    ('note=', 'note', '=', ''),
+    ('expr=a=b', 'expr', '=', 'a=b'),
+    ('range<=>5', 'range', '<=', '>5'),
+])
+def test_predicate_parsing(predicate, column, op, value):
+    assert RowFilter([predicate])._tests == [(column, op, value)]
+
+
+@pytest.mark.parametrize('predicate', ['status', '=active', ' >= 3', '!=x', '', 'a b'])
+def test_malformed_predicate(predicate):
+    with pytest.raises(ValueError, match='Invalid row predicate'):
+        RowFilter([predicate])
+
+
+def test_lookup_with_separator_inside_keys():
+    record = {'a_b': {'c': 1}, 'a': {'b_d': 2, 'b': {'e': 3}}, 'x': {'y_z': 4}, 'x_y': {'z': 5}}
+    assert lookup(record, 'a_b_c') == 1
+    assert lookup(record, 'a_b_d') == 2
+    assert lookup(record, 'a_b_e') == 3
+    assert lookup(record, 'x_y_z') in (4, 5)
+    assert lookup({'a.b': {'c': 1}}, 'a.b.c', sep='.') == 1
+    assert lookup({'a': {'b': 1}}, 'a_b', sep='.') != 1
+
+
+@pytest.mark.parametrize('record, column, value', [
+    ({'tags': ['x', 'y']}, 'tags_1', 'y'),
+    ({'items': [{'sku': 's1'}, {'sku': 's2'}]}, 'items_1_sku', 's2'),
+    ({'m': [[1, 2], [3, 4]]}, 'm_1', [3, 4]),
+    ({'user': {'name': None}}, 'user_name', None),
+    ('scalar', 'value', 'scalar'),
+])
+def test_lookup_matches_flattened_column(record, column, value):
+    assert lookup(record, column) == value
+    assert Flattening('index').row(record)[column] == value
+
+
+def test_lookup_of_missing_column_is_not_null():
+    for record, column in [({'a': 1}, 'b'), ({'a': {'b': 1}}, 'a_c'), ({'a': [1]}, 'a_1'), ({'a': 1}, 'a_b'),
+                           ({'m': [[1, 2]]}, 'm_0_0'), ('scalar', 'a')]:
+        assert lookup(record, column) is not None
+        assert RowFilter([f"{column}=null"])(record)
+        assert not RowFilter([f"{column}!=null"])(record)
+
+
+@pytest.mark.parametrize('predicate, record, kept', [
+    ('flag=true', {'flag': True}, True),
+    ('flag=1', {'flag': True}, False),
+    ('flag!=1', {'flag': True}, True),
+    ('n=true', {'n': 1}, False),
+    ('n=1', {'n': 1.0}, True),
+    ('n>0', {'n': True}, False),
+    ('n<=true', {'n': True}, False),
+    ('n>0', {'n': 0.5}, True),
+    ('n>=30', {'n': '40'}, False),
+    ('n="30"', {'n': '30'}, True),
+    ('n=30', {'n': '30'}, False),
+    ('s>b', {'s': 'c'}, True),
+    ('s>1', {'s': 'c'}, False),
+    ('n>0', {}, False),
+    ('n<0', {'n': None}, False),
+])
+def test_bool_number_and_string_comparisons(predicate, record, kept):
+    assert RowFilter([predicate])(record) is kept
+
+
+def test_every_predicate_must_hold():
+    row_filter = RowFilter(['user_age>=30', 'user_name!=b'])
+    records = [{'user': {'age': 30, 'name': 'a'}}, {'user': {'age': 40, 'name': 'b'}}, {'user': {'age': 20}},
+               {'user': {'age': 31}}]
+    assert list(row_filter.filter(records)) == [records[0], records[3]]
+    assert list(RowFilter().filter(records)) == records
+
+
+def test_exploded_rows_are_filtered_one_by_one():
+    records = [{'id': 1, 'items': [{'sku': 'a'}, {'sku': 'b'}]}, {'id': 2, 'items': [{'sku': 'b'}]}]
+    flattening = Flattening('explode', row_filter=RowFilter(['items_sku=b']))
+    assert [flattening.row(r) for r in flattening.records(records)] == [
+        {RECORD_ID_COLUMN: 1, 'id': 1, 'items_sku': 'b'}, {RECORD_ID_COLUMN: 2, 'id': 2, 'items_sku': 'b'}]
@@ -0,0 +1,779 @@
+"""
+Row-batch writers for the conversion artifacts.
+
+The streaming conversion hands rows (tuples in header order) to a writer
+one batch at a time, so only a single batch is ever held in memory.
+CSV is always available; Parquet and Arrow IPC need pyarrow and keep the
+JSON types (ints, floats, booleans and nulls) instead of turning
+everything into text. CSV can be gzip or zstd compressed as it is written
+(zstd needs the zstandard package).
+
+CSV writers also record a row index next to the file: the byte offset of
+about every ROW_INDEX_STRIDE-th row, so any page of rows can be read back
+without scanning from the start. Columnar files need no index, their
+row groups / record batches already say how many rows they hold.
+"""
+
+import array
+import bisect
+import csv
+import gzip
+import io
+import itertools
+import json
+import math
+import os
+import re
+import tempfile
+import time
+import zipfile
+import zlib
+from datetime import datetime, timezone
+from xml.sax.saxutils import escape as xml_escape, quoteattr as xml_quoteattr
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.ipc as pa_ipc
+    import pyarrow.parquet as pq
+except Exception:
+    pa = None
+try:
+    import zstandard
+except Exception:
+    zstandard = None
+
+from columntypes import (BOOLEAN, DATETIME, DATETIME_TZ, FLOAT, INTEGER, NULL, ColumnTypes, parse_datetime,
+                         value_type, values_type)
+
+COLUMNAR_FORMATS = ('parquet', 'arrow')
+ARTIFACT_SUFFIXES = {'csv': '.csv', 'parquet': '.parquet', 'arrow': '.arrow'}
+EXCEL_MAX_ROWS = 1048576  # Rows per worksheet, header included
+EXCEL_MAX_COLUMNS = 16384
+EXCEL_MAX_CELL_CHARS = 32767
+EXCEL_MAX_SHEET_NAME = 31
+COMPRESSIONS = ('gzip',) + (('zstd',) if zstandard is not None else ())
+COMPRESSION_SUFFIXES = {'gzip': '.gz', 'zstd': '.zst'}
+COMPRESSION_MIMETYPES = {'gzip': 'application/gzip', 'zstd': 'application/zstd'}
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+READ_SIZE = 1024 * 1024  # Bytes per chunk when streaming a file back out
+ROW_INDEX_STRIDE = 1000  # Rows between entries of a CSV row index
+ROW_INDEX_SUFFIX = '.idx'
+
+
+def _check_compression(compression):
+    if compression is not None and compression not in COMPRESSIONS:
+        raise ValueError(f"Unsupported compression '{compression}'")
+
+
+def _is_path(target):
+    return isinstance(target, (str, bytes, os.PathLike))
+
+
+def open_compressed(path, mode='rb', compression=None):
+    """Open `path` as a binary file, compressed ('wb') or decompressed ('rb')
+    on the fly when `compression` is 'gzip' or 'zstd'. `path` may also be
+    an open binary file: it is returned as it is without compression, else
+    wrapped in a (de)compressor that leaves it open when closed."""
+    _check_compression(compression)
+    if compression == 'gzip':
+        if not _is_path(path):
+            return gzip.GzipFile(fileobj=path, mode=mode, compresslevel=GZIP_LEVEL)
+        return gzip.open(path, mode, compresslevel=GZIP_LEVEL) if 'w' in mode else gzip.open(path, mode)
+    if compression == 'zstd':
+        options = {} if _is_path(path) else {'closefd': False}
+        if 'w' in mode:
+            return zstandard.open(path, mode, cctx=zstandard.ZstdCompressor(level=ZSTD_LEVEL), **options)
+        return zstandard.open(path, mode, **options)
+    return open(path, mode) if _is_path(path) else path
+
+
+def _compressor(compression):
+    if compression == 'gzip':
+        return zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+
+
+def _decompressor(compression):
+    if compression == 'gzip':
+        return zlib.decompressobj(47)
+    return zstandard.ZstdDecompressor().decompressobj()
+
+
+def iter_encoded(path, stored=None, compression=None, chunk_size=READ_SIZE):
+    """Yield the bytes of the file at `path`, stored with compression
+    `stored`, re-encoded with `compression` (None for plain bytes) chunk by
+    chunk, so no second copy of the file is ever written."""
+    _check_compression(compression)
+    decoder = _decompressor(stored) if stored is not None and stored != compression else None
+    encoder = _compressor(compression) if compression is not None and stored != compression else None
+    with open(path, 'rb') as f:
+        for data in iter(lambda: f.read(chunk_size), b''):
+            if decoder is not None:
+                data = decoder.decompress(data)
+            if encoder is not None:
+                data = encoder.compress(data)
+            if data:
+                yield data
+    tail = decoder.flush() if decoder is not None else b''
+    if encoder is not None:
+        tail = encoder.compress(tail) + encoder.flush()
+    if tail:
+        yield tail
+
+
+def row_index_path(path):
+    """Path of the row index kept next to the CSV artifact at `path`"""
+    return path + ROW_INDEX_SUFFIX
+
+
+def load_row_index(path):
+    """Return (row numbers, byte offsets) of the row index at `path`"""
+    pairs = array.array('q')
+    with open(path, 'rb') as f:
+        pairs.frombytes(f.read())
+    return pairs[0::2], pairs[1::2]
+
+
+class CSVRowWriter:
+    """Write row batches to a CSV file, optionally gzip or zstd compressed.
+
+    Every `index_stride` rows the uncompressed byte offset of the next row
+    is noted; on close the (row, offset) pairs are saved to
+    row_index_path(path). An `index_stride` of None writes no index.
+    `path` may also be a writable binary file (e.g. stdout), which gets no
+    index and is flushed rather than closed.
+    `types` (a columntypes.ColumnTypes) accumulates the type of every column.
+    """
+
+    def __init__(self, path, header, compression=None, index_stride=ROW_INDEX_STRIDE):
+        self.path = path
+        self.header = list(header)
+        self.types = ColumnTypes()
+        self.index_stride = index_stride if _is_path(path) else None
+        self.rows_written = 0
+        self.bytes_written = 0
+        self._index = array.array('q')
+        self._next_mark = 0
+        self._file = open_compressed(path, 'wb', compression)
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer)
+        self._writer.writerow(header)
+        self._flush()
+
+    def _flush(self):
+        data = self._buffer.getvalue().encode('utf-8')
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        self._file.write(data)
+        self.bytes_written += len(data)
+
+    def _mark(self):
+        if self.index_stride and self.rows_written >= self._next_mark:
+            self._index.extend((self.rows_written, self.bytes_written))
+            self._next_mark = self.rows_written + self.index_stride
+
+    def write_batch(self, rows):
+        self.types.add_rows(self.header, rows)
+        start = 0
+        while start < len(rows):
+            self._mark()
+            step = self._next_mark - self.rows_written if self.index_stride else len(rows)
+            chunk = rows[start:start + step]
+            self._writer.writerows(chunk)
+            self._flush()
+            self.rows_written += len(chunk)
+            start += len(chunk)
+
+    def write_text(self, text, row_count):
+        """Append `row_count` rows that were already CSV-encoded with the
+        default dialect. Index entries can only fall between such blocks;
+        the encoder adds the rows' column types to `types` itself."""
+        self._mark()
+        data = text.encode('utf-8')
+        self._file.write(data)
+        self.bytes_written += len(data)
+        self.rows_written += row_count
+
+    def close(self):
+        if self._file is self.path:
+            self._file.flush()
+        else:
+            self._file.close()
+        if self.index_stride:
+            with open(row_index_path(self.path), 'wb') as f:
+                f.write(self._index.tobytes())
+
+
+def _to_text(value):
+    if value is None or type(value) is str:
+        return value
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    return str(value)
+
+
+# Lattice types whose values are all text or null already
+_TEXT_TYPES = (NULL, DATETIME, DATETIME_TZ)
+
+
+def _arrow_type(column_type):
+    """Arrow type storing a column of lattice type `column_type`"""
+    if column_type == BOOLEAN:
+        return pa.bool_()
+    if column_type == INTEGER:
+        return pa.int64()
+    if column_type == FLOAT:
+        return pa.float64()
+    if column_type == DATETIME:
+        return pa.timestamp('us')
+    if column_type == DATETIME_TZ:
+        return pa.timestamp('us', tz='UTC')
+    return pa.string()
+
+
+def _fits(column_type, field_type):
+    # Values of `column_type` can be stored in an Arrow column of `field_type`
+    return (column_type == NULL or _arrow_type(column_type) == field_type
+            or column_type == INTEGER and field_type == pa.float64())
+
+
+def arrow_schema(header, types):
+    """Arrow schema for the columns of `header` given their lattice `types`
+    (a mapping); null-only and string columns are stored as text"""
+    return pa.schema([pa.field(name, _arrow_type(types[name])) for name in header])
+
+
+class ArrowRowWriter:
+    """Write row batches as Parquet row groups or Arrow IPC record batches.
+
+    Column types come from `types` (a mapping of column to lattice type, see
+    columntypes.py), typically inferred over the whole input. Without them
+    the rows are staged as text in a temporary Arrow stream while their
+    types are inferred, and cast to those types when the writer is closed,
+    so a later row can still widen a column (ints to floats, a mix to text).
+    Booleans, 64-bit ints and floats keep their type, ISO 8601 date-times
+    are stored as timestamps (UTC for those with an offset) and everything
+    else as text (objects and arrays as JSON). With `types`, every batch
+    must fit them; ints are accepted in float columns and anything in text
+    columns. `types` accumulates what was written.
+    """
+
+    def __init__(self, path, header, output_format='parquet', types=None):
+        if pa is None:
+            raise ValueError(f"Output format '{output_format}' requires pyarrow")
+        self.path = path
+        self.header = list(header)
+        self.output_format = output_format
+        self.schema = None
+        self.rows_written = 0
+        self.types = ColumnTypes()
+        self._writer = None
+        self._staged = None
+        if types is not None:
+            self._open(arrow_schema(self.header, ColumnTypes(types)))
+        else:
+            self.schema = pa.schema([pa.field(name, pa.string()) for name in self.header])
+            self._staged = tempfile.TemporaryFile()
+            self._writer = pa_ipc.new_stream(self._staged, self.schema)
+
+    def _open(self, schema):
+        self.schema = schema
+        if self.output_format == 'parquet':
+            self._writer = pq.ParquetWriter(self.path, schema)
+        else:
+            self._writer = pa_ipc.new_file(self.path, schema)
+
+    def _array(self, name, field_type, values):
+        column_type = values_type(values)
+        self.types.add(name, column_type)
+        if pa.types.is_string(field_type):
+            if column_type in _TEXT_TYPES:
+                return pa.array(values, type=field_type)
+            if column_type == INTEGER:  # Arrow writes them as str() does
+                return pa.array(values, type=pa.int64()).cast(field_type)
+            return pa.array([_to_text(v) for v in values], type=field_type)
+        if not _fits(column_type, field_type):
+            row_num, value = next((n, v) for n, v in enumerate(values, self.rows_written + 1)
+                                  if not _fits(value_type(v), field_type))
+            raise ValueError(f"Column '{name}' was typed {field_type} from the whole input "
+                             f"but row {row_num} holds {value!r}")
+        if pa.types.is_timestamp(field_type):
+            return pa.array(values, type=pa.string()).cast(field_type)
+        return pa.array(values, type=field_type)
+
+    def write_batch(self, rows):
+        columns = list(zip(*rows)) if rows else [()] * len(self.header)
+        arrays = [self._array(f.name, f.type, values) for f, values in zip(self.schema, columns)]
+        self._writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=self.schema))
+        self.rows_written += len(rows)
+
+    def _write_staged(self):
+        # Cast the staged text to the types of the whole input
+        staged, self._staged = self._staged, None
+        with staged:
+            self._writer.close()
+            self._writer = None
+            if not self.rows_written:
+                return
+            staged.seek(0)
+            schema = arrow_schema(self.header, self.types)
+            self._open(schema)
+            for batch in pa_ipc.open_stream(staged):
+                arrays = [column if field.type == pa.string() else column.cast(field.type)
+                          for field, column in zip(schema, batch.columns)]
+                self._writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+
+    def close(self):
+        if self._staged is not None:
+            self._write_staged()
+        if self._writer is None:
+            # No rows: still produce a valid file with the header as text columns
+            self._open(pa.schema([pa.field(name, pa.string()) for name in self.header]))
+        self._writer.close()
+
+
+def _column_letter(index):
+    letters = ''
+    index += 1
+    while index:
+        index, rem = divmod(index - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+
+_ILLEGAL_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+_INVALID_SHEET_CHARS = re.compile('[\\[\\]:*?/\\\\\x00-\x1f]')
+
+_XLSX_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+_REL_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+_XML_DECL = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+_STYLES_XML = (
+    f'{_XML_DECL}<styleSheet xmlns="{_XLSX_NS}">'
+    '<numFmts count="1"><numFmt numFmtId="164" formatCode="yyyy-mm-dd hh:mm:ss"/></numFmts>'
+    '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/></cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+_XLSX_DATE_STYLE = 1  # Index of the date-time cell format above
+_XLSX_EPOCH = datetime(1899, 12, 30)  # Day 0 of Excel's date serial numbers
+_XLSX_FIRST_DATE = datetime(1900, 3, 1)  # Serials before this are off by Excel's 1900 leap day
+
+
+def _xlsx_cell(ref, value):
+    """SpreadsheetML for one cell; '' for an empty cell"""
+    kind = type(value)
+    if value is None:
+        return ''
+    if kind is bool:
+        return f'<c r="{ref}" t="b"><v>{int(value)}</v></c>'
+    if kind is int or (kind is float and math.isfinite(value)):
+        return f'<c r="{ref}"><v>{value!r}</v></c>'
+    if kind is float and value != value:
+        return ''
+    if kind is datetime:
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        if value >= _XLSX_FIRST_DATE:
+            serial = (value - _XLSX_EPOCH).total_seconds() / 86400
+            return f'<c r="{ref}" s="{_XLSX_DATE_STYLE}"><v>{serial!r}</v></c>'
+        value = value.isoformat(sep=' ')
+    text = _ILLEGAL_XML_CHARS.sub('', _to_text(value))[:EXCEL_MAX_CELL_CHARS]
+    return f'<c r="{ref}" t="inlineStr"><is><t xml:space="preserve">{xml_escape(text)}</t></is></c>'
+
+
+class XLSXRowWriter:
+    """Write row batches straight into worksheet XML inside the xlsx zip.
+
+    Nothing is kept per row: numbers, booleans and datetimes are written as
+    typed cells, everything else as inline strings (no shared string table),
+    and each sheet's XML is streamed into the archive as it is produced, so
+    memory stays constant regardless of row count. When a
+    sheet reaches `sheet_rows` (Excel's limit by default) the writer starts
+    a new sheet with the header repeated. `start_table` moves on to a new,
+    named sheet with a different header, so one workbook can hold several
+    tables. `target` may be a path or any writable binary file object,
+    seekable or not. With `track_types`, `types` (a columntypes.ColumnTypes)
+    accumulates the type of every column written since the last header.
+    """
+
+    def __init__(self, target, header, sheet_rows=EXCEL_MAX_ROWS, compresslevel=1, track_types=False):
+        self.sheet_rows = sheet_rows
+        self._track_types = track_types
+        self.sheet_count = 0
+        self.sheet_names = []
+        self._table = None
+        self._table_sheets = 0
+        self._set_header(header)
+        self._zip = zipfile.ZipFile(target, 'w', zipfile.ZIP_DEFLATED, compresslevel=compresslevel)
+        self._sheet = None
+        self._row_num = 0
+
+    def _set_header(self, header):
+        if len(header) > EXCEL_MAX_COLUMNS:
+            raise ValueError(f"Excel supports at most {EXCEL_MAX_COLUMNS} columns, got {len(header)}")
+        self.header = list(header)
+        self.types = ColumnTypes() if self._track_types else None
+        self._refs = [_column_letter(i) for i in range(len(self.header))]
+
+    def start_table(self, name, header):
+        """End the current sheet and continue on a sheet named after `name`
+        with its own `header`; the sheet is created even if no rows follow"""
+        self._end_sheet()
+        self._set_header(header)
+        self._table = name
+        self._table_sheets = 0
+        self._start_sheet()
+
+    def _sheet_name(self):
+        if self._table is None:
+            return f"Sheet{self.sheet_count}"
+        self._table_sheets += 1
+        suffix = f" ({self._table_sheets})" if self._table_sheets > 1 else ''
+        base = _INVALID_SHEET_CHARS.sub('_', self._table).strip("'") or 'Sheet'
+        name = base[:EXCEL_MAX_SHEET_NAME - len(suffix)] + suffix
+        taken = {n.lower() for n in self.sheet_names}
+        count = 1
+        while name.lower() in taken:
+            count += 1
+            tag = f"~{count}{suffix}"
+            name = base[:EXCEL_MAX_SHEET_NAME - len(tag)] + tag
+        return name
+
+    def _write_row(self, values):
+        self._row_num += 1
+        row_num = self._row_num
+        cells = ''.join([_xlsx_cell(f"{ref}{row_num}", value) for ref, value in zip(self._refs, values)])
+        return f'<row r="{row_num}">{cells}</row>'
+
+    def _start_sheet(self):
+        self._end_sheet()
+        self.sheet_count += 1
+        self.sheet_names.append(self._sheet_name())
+        self._sheet = self._zip.open(f'xl/worksheets/sheet{self.sheet_count}.xml', 'w', force_zip64=True)
+        self._sheet.write(f'{_XML_DECL}<worksheet xmlns="{_XLSX_NS}"><sheetData>'.encode('utf-8'))
+        self._row_num = 0
+        self._sheet.write(self._write_row(self.header).encode('utf-8'))
+
+    def _end_sheet(self):
+        if self._sheet is not None:
+            self._sheet.write(b'</sheetData></worksheet>')
+            self._sheet.close()
+            self._sheet = None
+
+    def write_batch(self, rows):
+        if self.types is not None:
+            self.types.add_rows(self.header, rows)
+        start = 0
+        while start < len(rows) or self._sheet is None:
+            if self._sheet is None or self._row_num >= self.sheet_rows:
+                self._start_sheet()
+            room = self.sheet_rows - self._row_num
+            chunk = rows[start:start + room]
+            self._sheet.write(''.join([self._write_row(row) for row in chunk]).encode('utf-8'))
+            start += len(chunk)
+
+    def close(self):
+        if self._sheet is None and self.sheet_count == 0:
+            self._start_sheet()
+        self._end_sheet()
+        sheets = range(1, self.sheet_count + 1)
+        write = self._zip.writestr
+        write('xl/workbook.xml', (
+            f'{_XML_DECL}<workbook xmlns="{_XLSX_NS}" xmlns:r="{_REL_NS}"><sheets>'
+            + ''.join(f'<sheet name={xml_quoteattr(name)} sheetId="{i}" r:id="rId{i}"/>'
+                      for i, name in zip(sheets, self.sheet_names))
+            + '</sheets></workbook>'))
+        write('xl/_rels/workbook.xml.rels', (
+            f'{_XML_DECL}<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            + ''.join(f'<Relationship Id="rId{i}" Type="{_REL_NS}/worksheet" Target="worksheets/sheet{i}.xml"/>'
+                      for i in sheets)
+            + f'<Relationship Id="rId{self.sheet_count + 1}" Type="{_REL_NS}/styles" Target="styles.xml"/>'
+            + '</Relationships>'))
+        write('xl/styles.xml', _STYLES_XML)
+        write('_rels/.rels', (
+            f'{_XML_DECL}<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            f'<Relationship Id="rId1" Type="{_REL_NS}/officeDocument" Target="xl/workbook.xml"/>'
+            '</Relationships>'))
+        content_type = 'application/vnd.openxmlformats-officedocument.spreadsheetml'
+        write('[Content_Types].xml', (
+            f'{_XML_DECL}<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            f'<Override PartName="/xl/workbook.xml" ContentType="{content_type}.sheet.main+xml"/>'
+            + ''.join(f'<Override PartName="/xl/worksheets/sheet{i}.xml" ContentType="{content_type}.worksheet+xml"/>'
+                      for i in sheets)
+            + f'<Override PartName="/xl/styles.xml" ContentType="{content_type}.styles+xml"/>'
+            '</Types>'))
+        self._zip.close()
+
+
+class _ChunkSink(io.RawIOBase):
+    """Unseekable write target that hands written bytes back in chunks"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def iter_xlsx(header, batches, sheet_rows=EXCEL_MAX_ROWS):
+    """Yield the bytes of an xlsx workbook as it is produced from row batches"""
+    sink = _ChunkSink()
+    writer = XLSXRowWriter(sink, header, sheet_rows)
+    for batch in batches:
+        writer.write_batch(batch)
+        data = sink.take()
+        if data:
+            yield data
+    writer.close()
+    yield sink.take()
+
+
+def iter_table_bytes(header, batches, output_format='csv', compression=None):
+    """Yield the bytes of a file of `output_format` (see open_writer) as it
+    is written from row batches, with nothing stored on disk"""
+    sink = _ChunkSink()
+    writer = open_writer(sink, header, output_format, compression)
+    try:
+        for batch in batches:
+            writer.write_batch(batch)
+            data = sink.take()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    yield sink.take()
+
+
+def iter_xlsx_tables(tables, sheet_rows=EXCEL_MAX_ROWS):
+    """Yield the bytes of an xlsx workbook with one sheet per table, from
+    (name, header, row batches) triples"""
+    sink = _ChunkSink()
+    writer = XLSXRowWriter(sink, [], sheet_rows)
+    for name, header, batches in tables:
+        writer.start_table(name, header)
+        for batch in batches:
+            writer.write_batch(batch)
+            data = sink.take()
+            if data:
+                yield data
+    writer.close()
+    yield sink.take()
+
+
+def iter_zip(members, chunk_size=READ_SIZE):
+    """Yield the bytes of a zip archive as it is produced from (name, path)
+    pairs; `members` may be a generator that creates each file just in time.
+    Already compressed formats (Parquet, Arrow, gzip, zstd) are stored as is.
+    """
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED, compresslevel=1) as archive:
+        for name, path in members:
+            stored = name.endswith(('.parquet', '.arrow', *COMPRESSION_SUFFIXES.values()))
+            info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+            info.compress_type = zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED
+            with open(path, 'rb') as src, archive.open(info, 'w', force_zip64=True) as dst:
+                for data in iter(lambda: src.read(chunk_size), b''):
+                    dst.write(data)
+                    chunk = sink.take()
+                    if chunk:
+                        yield chunk
+    yield sink.take()
+
+
+def open_writer(path, header, output_format='csv', compression=None, types=None):
+    """Open a row-batch writer for an artifact of `output_format`, at a path
+    or into a writable binary file.
+    `compression` applies to CSV only; columnar formats compress internally.
+    `types` (column -> lattice type, when known up front) fixes the schema
+    of a columnar artifact.
+    """
+    if output_format == 'csv':
+        return CSVRowWriter(path, header, compression)
+    if output_format in COLUMNAR_FORMATS:
+        return ArrowRowWriter(path, header, output_format, types)
+    if output_format == 'excel':
+        return XLSXRowWriter(path, header, track_types=True)
+    raise ValueError(f"Unknown artifact format '{output_format}'")
+
+
+def write_rows(writer, rows, window, max_preview=20, progress=None):
+    """Drain an iterator of row tuples into `writer`, `window` rows per batch.
+    Reports each batch to `progress.add_rows` if given. Closes the writer.
+    Returns (total_rows, preview_rows)
+    """
+    total_rows = 0
+    preview_rows = []
+    try:
+        for batch in iter(lambda: list(itertools.islice(rows, window)), []):
+            writer.write_batch(batch)
+            total_rows += len(batch)
+            if progress is not None:
+                progress.add_rows(len(batch))
+            if len(preview_rows) < max_preview:
+                preview_rows.extend(batch[:max_preview - len(preview_rows)])
+    finally:
+        writer.close()
+    return total_rows, preview_rows
+
+
+def open_arrow_source(path, artifact_format, batch_size=5000, compression=None, types=None):
+    """Return (schema, iterator of RecordBatches) for a conversion artifact.
+    `types` (column -> lattice type) types the columns of a CSV artifact."""
+    if artifact_format == 'parquet':
+        parquet_file = pq.ParquetFile(path)
+        return parquet_file.schema_arrow, parquet_file.iter_batches(batch_size=batch_size)
+    if artifact_format == 'arrow':
+        reader = pa_ipc.open_file(path)
+        return reader.schema, (reader.get_batch(i) for i in range(reader.num_record_batches))
+    # Without types they are inferred from the first block of the CSV
+    options = None
+    if types is not None:
+        options = pa_csv.ConvertOptions(column_types={name: _arrow_type(t) for name, t in types.items()},
+                                        null_values=[''], strings_can_be_null=True)
+    reader = pa_csv.open_csv(pa.input_stream(path, compression=compression), convert_options=options)
+    return reader.schema, iter(reader)
+
+
+# Read a CSV field back as a value of each lattice type; the rest stay text
+_CSV_VALUES = {
+    BOOLEAN: 'True'.__eq__,
+    INTEGER: int,
+    FLOAT: float,
+    DATETIME: datetime.fromisoformat,
+    DATETIME_TZ: parse_datetime,
+}
+
+
+def _typed_csv_rows(path, types, batch_size, compression):
+    with open_compressed(path, 'rb', compression) as f:
+        reader = csv.reader(io.TextIOWrapper(f, encoding='utf-8', newline=''))
+        converters = [_CSV_VALUES.get(types.get(name)) for name in next(reader, [])]
+        for rows in iter(lambda: list(itertools.islice(reader, batch_size)), []):
+            yield [tuple([None if text == '' else text if convert is None else convert(text)
+                          for text, convert in zip(row, converters)]) for row in rows]
+
+
+def iter_artifact_rows(path, artifact_format, batch_size=5000, compression=None, types=None):
+    """Yield lists of row tuples (plain Python values) from a conversion artifact.
+    CSV fields are read back as the lattice type of their column in `types`
+    (column -> type); without it pandas guesses the types chunk by chunk."""
+    if artifact_format == 'csv' and types is not None:
+        yield from _typed_csv_rows(path, types, batch_size, compression)
+    elif artifact_format == 'csv':
+        import pandas as pd
+        for frame in pd.read_csv(path, chunksize=batch_size, compression=compression):
+            frame = frame.astype(object).where(frame.notna(), None)
+            yield list(frame.itertuples(index=False, name=None))
+    else:
+        _, batches = open_arrow_source(path, artifact_format, batch_size)
+        for batch in batches:
+            yield list(zip(*[column.to_pylist() for column in batch.columns]))
+
+
+def _csv_page(path, offset, limit, positions, compression=None):
+    index_path = row_index_path(path)
+    if os.path.exists(index_path):
+        rows, offsets = load_row_index(index_path)
+    else:
+        rows, offsets = [], []
+    entry = bisect.bisect_right(rows, offset) - 1
+    with open_compressed(path, 'rb', compression) as f:
+        if entry >= 0:
+            f.seek(offsets[entry])
+            skip = offset - rows[entry]
+        else:
+            skip = offset + 1  # No index: skip the header too
+        reader = csv.reader(io.TextIOWrapper(f, encoding='utf-8', newline=''))
+        return [tuple(row[i] if i < len(row) else '' for i in positions)
+                for row in itertools.islice(reader, skip, skip + limit)]
+
+
+def _parquet_page(path, offset, limit, names):
+    parquet_file = pq.ParquetFile(path)
+    groups = []
+    first_row = group_start = 0
+    for i in range(parquet_file.metadata.num_row_groups):
+        group_rows = parquet_file.metadata.row_group(i).num_rows
+        if group_start + group_rows > offset and group_start < offset + limit:
+            if not groups:
+                first_row = group_start
+            groups.append(i)
+        group_start += group_rows
+    if not groups:
+        return []
+    table = parquet_file.read_row_groups(groups, columns=names)
+    table = table.slice(offset - first_row, limit)
+    return list(zip(*[column.to_pylist() for column in table.columns]))
+
+
+def _arrow_page(path, offset, limit, names):
+    reader = pa_ipc.open_file(pa.memory_map(path))
+    batches = []
+    batch_start = 0
+    for i in range(reader.num_record_batches):
+        # Batches are memory mapped, so only their metadata is read here
+        batch = reader.get_batch(i)
+        if batch_start + batch.num_rows > offset:
+            if not batches:
+                skip = offset - batch_start
+            batches.append(batch.select(names))
+            if batch_start + batch.num_rows >= offset + limit:
+                break
+        batch_start += batch.num_rows
+    if not batches:
+        return []
+    table = pa.Table.from_batches(batches).slice(skip, limit)
+    return list(zip(*[column.to_pylist() for column in table.columns]))
+
+
+def read_artifact_page(path, artifact_format, header, offset, limit, columns=None, compression=None):
+    """Rows `offset` to `offset + limit` of a conversion artifact, as tuples
+    of the values in `columns` (default: the whole `header`). CSV pages seek
+    through the row index, so the cost does not grow with `offset` (except
+    for compressed CSV, which has to be decompressed up to the page);
+    Parquet / Arrow read only the row groups or batches holding the page.
+    """
+    names = list(header) if columns is None else list(columns)
+    if artifact_format == 'csv':
+        positions = {name: i for i, name in enumerate(header)}
+        return _csv_page(path, offset, limit, [positions[name] for name in names], compression)
+    if artifact_format == 'parquet':
+        return _parquet_page(path, offset, limit, names)
+    return _arrow_page(path, offset, limit, names)
+
+
+def convert_artifact(src_path, src_format, dst_path, dst_format, src_compression=None, types=None):
+    """Re-encode an artifact into another csv / parquet / arrow file batch by
+    batch; `types` (column -> lattice type) types the columns read from CSV"""
+    if pa is None:
+        raise ValueError(f"Converting to '{dst_format}' requires pyarrow")
+    schema, batches = open_arrow_source(src_path, src_format, compression=src_compression, types=types)
+    if dst_format == 'csv':
+        writer = pa_csv.CSVWriter(dst_path, schema)
+    elif dst_format == 'parquet':
+        writer = pq.ParquetWriter(dst_path, schema)
+    else:
+        writer = pa_ipc.new_file(dst_path, schema)
+    try:
+        for batch in batches:
+            writer.write_batch(batch)
+    finally:
+        writer.close()